@@ -0,0 +1,111 @@
+import asyncio
+from concurrent.futures import Future
+
+from historical import HistoricalDataFetcher
+from orders import submit_order
+from trade_app import start_app
+
+
+class AsyncTradeApp:
+    """asyncio facade over TradeApp
+
+    Every request is bridged from the reader thread to the event loop:
+    per-reqId and per-orderId futures are wrapped with asyncio.wrap_future
+    and streaming callbacks are pushed with loop.call_soon_threadsafe, so
+    hundreds of requests can be awaited with asyncio.gather over one socket.
+
+        app = await AsyncTradeApp.connect()
+        bars = await asyncio.gather(*(app.historical_bars(make_stock(t), "1 Y", "1 day") for t in tickers))
+    """
+
+    def __init__(self, app, loop=None):
+        self.app = app
+        self.loop = loop or asyncio.get_running_loop()
+        self.fetcher = HistoricalDataFetcher(app)
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=7496, client_id=23, timeout: float = 10):
+        loop = asyncio.get_running_loop()
+        app = await loop.run_in_executor(None, start_app, host, port, client_id, timeout)
+        return cls(app, loop)
+
+    def disconnect(self):
+        self.app.disconnect()
+
+    async def _pace(self):
+        delay = self.app.pacer.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _wait_event(self, event, timeout, what):
+        if not await self.loop.run_in_executor(None, event.wait, timeout):
+            raise TimeoutError(f"{what} not received after {timeout}s")
+
+    async def historical_bars(self, contract, duration="1 D", bar_size="1 min", what_to_show="TRADES", use_rth=1,
+                              end=None):
+        """bars indexed by Date, chunked and paced by HistoricalDataFetcher"""
+        future = self.fetcher.fetch(contract, duration, bar_size, what_to_show, use_rth, end)
+        return await asyncio.wrap_future(future, loop=self.loop)
+
+    async def contract_details(self, contract) -> list:
+        req_id = self.app.next_request_id()
+        future = self.app.requests[req_id] = Future()
+        await self._pace()
+        self.app.reqContractDetails(req_id, contract)
+        return await asyncio.wrap_future(future, loop=self.loop)
+
+    async def positions(self, timeout: float = 10):
+        self.app.positions_ready.clear()
+        self.app._positions.clear()
+        await self._pace()
+        self.app.reqPositions()
+        await self._wait_event(self.app.positions_ready, timeout, "positions")
+        return self.app.positions_df
+
+    async def open_orders(self, all_clients=False, timeout: float = 10) -> dict:
+        self.app.open_orders_ready.clear()
+        self.app.open_orders.clear()
+        await self._pace()
+        if all_clients:
+            self.app.reqAllOpenOrders()
+        else:
+            self.app.reqOpenOrders()
+        await self._wait_event(self.app.open_orders_ready, timeout, "open orders")
+        return dict(self.app.open_orders)
+
+    async def place_order(self, contract, order, order_id=None):
+        """sends the order and returns its OrderHandle once TWS acknowledged it"""
+        await self._pace()
+        order_id = self.app.nextOrderId() if order_id is None else order_id
+        handle = submit_order(self.app, order_id, contract, order, pace=False)
+        await asyncio.wrap_future(handle.acked, loop=self.loop)
+        return handle
+
+    async def order_done(self, handle) -> str:
+        """final status of an order: Filled, Cancelled or Inactive"""
+        return await asyncio.wrap_future(handle.done, loop=self.loop)
+
+    async def cancel_order(self, handle) -> str:
+        await self._pace()
+        self.app.cancelOrder(handle.order_id, "")
+        return await self.order_done(handle)
+
+    async def ticks(self, contract, generic_ticks=""):
+        """async iterator of (tick type, price) for a market data subscription
+
+            async for tick_type, price in app.ticks(option):
+                ...
+        """
+        queue = asyncio.Queue()
+        req_id = self.app.next_request_id()
+        self.app.tick_handlers[req_id] = (
+            lambda tick_type, price: self.loop.call_soon_threadsafe(queue.put_nowait, (tick_type, price))
+        )
+        await self._pace()
+        self.app.reqMktData(req_id, contract, generic_ticks, False, False, [])
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.app.tick_handlers.pop(req_id, None)
+            self.app.cancelMktData(req_id)
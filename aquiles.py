@@ -0,0 +1,268 @@
+"""Aquiles command line
+
+    python aquiles.py close --source csv --dry-run
+    python aquiles.py close --source cloud --tiered --exit-after-days 21
+    python aquiles.py close --daemon --max-notional 250000 --max-daily-loss 5000
+    python aquiles.py history AAPL MSFT --duration "1 Y" --bar-size "1 day" --csv
+    python aquiles.py positions --json positions.json
+    python aquiles.py stream AAPL MSFT SPY --bar-size "1 min"
+    python aquiles.py portfolio --interval 10
+
+Only argparse is imported up front, every command imports what it needs.
+A dry run neither loads ibapi nor connects to TWS.
+"""
+import argparse
+
+
+def connect(args):
+    from trade_app import start_app
+
+    app = start_app(args.host, args.port, args.client_id)
+    if getattr(args, "journal", False):
+        from journal import OrderJournal
+
+        journal = OrderJournal.for_client(args.client_id)
+        unfinished = journal.unfinished()
+        if unfinished:
+            print(f"resuming {len(unfinished)} orders of an interrupted run")
+        app.use_journal(journal)
+    return app
+
+
+def has_limits(args) -> bool:
+    return any(limit is not None for limit in (args.max_notional, args.max_underlying_notional, args.max_daily_loss))
+
+
+def start_portfolio(app, args):
+    """with any --max-* limit, a live portfolio that checks every order before it is sent"""
+    from portfolio import Limits, Portfolio
+
+    book = Portfolio(app, args.account, limits=Limits(
+        args.max_notional, args.max_underlying_notional, args.max_daily_loss,
+    ))
+    book.start()
+    return book
+
+
+def load_positions(args):
+    if args.source == "csv":
+        from options import load_sheet_positions
+
+        return load_sheet_positions(args.sheet)
+    from options import load_tracker_positions
+    from tracker import TrackerClient
+
+    return load_tracker_positions(TrackerClient().open_trades())
+
+
+def close(args):
+    if args.gateways:
+        from multi_account import close_open_positions_accounts, load_gateways
+
+        report = close_open_positions_accounts(
+            load_gateways(args.gateways), load_positions(args), args.dry_run,
+            tiered=args.tiered, exit_after_days=args.exit_after_days,
+        )
+        print(report.to_string(index=False))
+        return
+
+    import options
+
+    app = None if args.dry_run else connect(args)
+    book = None
+    try:
+        if app is not None and has_limits(args):
+            book = start_portfolio(app, args)
+        if args.daemon and app is not None:
+            from daemon import CloseOutDaemon
+
+            CloseOutDaemon(app, lambda: load_positions(args)).run()
+        elif args.watch:
+            options.watch_open_positions_csv(
+                app, args.dry_run, args.sheet, tiered=args.tiered, exit_after_days=args.exit_after_days
+            )
+        elif args.source == "csv":
+            options.close_open_positions_csv(
+                app, args.dry_run, args.sheet, tiered=args.tiered, exit_after_days=args.exit_after_days
+            )
+        else:
+            options.close_open_positions_cloud(
+                app, args.dry_run, tiered=args.tiered, exit_after_days=args.exit_after_days
+            )
+    finally:
+        if book is not None:
+            book.stop()
+        if app is not None:
+            app.disconnect()
+
+
+def fetch_historical_stocks_data(app, tickers, duration="2 D", bar_size="5 mins", what_to_show="TRADES",
+                                 store=None):
+    """returns the bars of every ticker, only fetching from IB what is not in the local bar store"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from bar_store import BarStore
+    from historical import MAX_IN_FLIGHT, HistoricalDataFetcher
+    from trade_app import make_stock
+
+    store = store or BarStore()
+    fetcher = HistoricalDataFetcher(app)
+    with ThreadPoolExecutor(max_workers=max(1, min(len(tickers), MAX_IN_FLIGHT))) as executor:
+        results = executor.map(
+            lambda ticker: store.update(fetcher, make_stock(ticker), duration, bar_size, what_to_show), tickers
+        )
+        return dict(zip(tickers, results))
+
+
+def extract_store_historical_data(historical_data):
+    """stores the bars of each ticker in <ticker>.csv"""
+    for ticker, data in historical_data.items():
+        data.to_csv(ticker + ".csv")
+
+
+def history(args):
+    app = connect(args)
+    try:
+        data = fetch_historical_stocks_data(app, args.tickers, args.duration, args.bar_size, args.what_to_show)
+    finally:
+        app.disconnect()
+    for ticker, bars in data.items():
+        if len(bars):
+            print(f"{ticker}: {len(bars)} bars from {bars.index[0]} to {bars.index[-1]}")
+        else:
+            print(f"{ticker}: no bars")
+    if args.csv:
+        extract_store_historical_data(data)
+
+
+def positions(args):
+    app = connect(args)
+    try:
+        positions_df = app.request_positions()
+    finally:
+        app.disconnect()
+    print(positions_df.to_string(index=False))
+    if args.json:
+        positions_df.to_json(args.json)
+
+
+def stream(args):
+    import time
+
+    from realtime import RealTimeBars
+    from trade_app import make_stock
+
+    app = connect(args)
+    streams = RealTimeBars(app, what_to_show=args.what_to_show)
+    try:
+        streams.subscribe_many([make_stock(ticker) for ticker in args.tickers], args.bar_size)
+        while True:
+            time.sleep(args.interval)
+            print(streams.snapshot().to_string(index=False))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        streams.close()
+        app.disconnect()
+
+
+def portfolio(args):
+    import time
+
+    from portfolio import Portfolio
+
+    app = connect(args)
+    book = Portfolio(app, args.account)
+    try:
+        book.start()
+        while True:
+            snapshot = book.snapshot()
+            print(snapshot.underlyings().to_string(index=False))
+            print(f"notional {snapshot.total('notional'):.0f}, unrealized {snapshot.total('unrealized_pnl'):.2f}, "
+                  f"daily {snapshot.total('daily_pnl'):.2f}")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        book.stop()
+        app.disconnect()
+
+
+def make_parser():
+    connection = argparse.ArgumentParser(add_help=False)
+    connection.add_argument('--host', default="127.0.0.1", help="TWS or IB Gateway host")
+    connection.add_argument('--port', type=int, default=7496)
+    connection.add_argument('--client-id', type=int, default=23)
+
+    parser = argparse.ArgumentParser(prog="aquiles", description="Aquiles trader")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    close_parser = commands.add_parser("close", parents=[connection], help="close the open positions")
+    close_parser.add_argument('--source', choices=["csv", "cloud"], default="csv",
+                              help="positions from the sheet export or from the tracker")
+    close_parser.add_argument('--sheet', default=None, help="CSV export of the Options Trading google sheet")
+    close_parser.add_argument('--dry-run', action=argparse.BooleanOptionalAction)
+    close_parser.add_argument('--daemon', action='store_true', help="keep running and close positions on live quotes")
+    close_parser.add_argument('--watch', action='store_true',
+                              help="with --source csv, keep running and close the positions of every new export")
+    close_parser.add_argument('--tiered', action='store_true', help="rest every tier at IB in a One-Cancels-All group")
+    close_parser.add_argument('--exit-after-days', type=int,
+                              help="with --tiered, buy at market once a position is this old")
+    close_parser.add_argument('--journal', action=argparse.BooleanOptionalAction, default=True,
+                              help="track orders in a local journal, orders a crashed run sent but TWS "
+                                   "never acknowledged are sent again under the same id")
+    close_parser.add_argument('--gateways',
+                              help="JSON file of gateways to close the positions of several accounts at once")
+    close_parser.add_argument('--account', help="account of the --max-* limits, defaults to the first managed one")
+    close_parser.add_argument('--max-notional', type=float,
+                              help="refuse orders taking the short option notional of the book over this")
+    close_parser.add_argument('--max-underlying-notional', type=float,
+                              help="refuse orders taking the short option notional of one underlying over this")
+    close_parser.add_argument('--max-daily-loss', type=float,
+                              help="refuse orders adding exposure once the daily loss reaches this")
+    close_parser.set_defaults(func=close)
+
+    history_parser = commands.add_parser("history", parents=[connection], help="update the local bar store")
+    history_parser.add_argument('tickers', nargs="+")
+    history_parser.add_argument('--duration', default="2 D")
+    history_parser.add_argument('--bar-size', default="5 mins")
+    history_parser.add_argument('--what-to-show', default="TRADES")
+    history_parser.add_argument('--csv', action='store_true', help="also write the bars to <ticker>.csv")
+    history_parser.set_defaults(func=history)
+
+    positions_parser = commands.add_parser("positions", parents=[connection], help="print the positions at IB")
+    positions_parser.add_argument('--json', help="also write them to this file")
+    positions_parser.set_defaults(func=positions)
+
+    stream_parser = commands.add_parser("stream", parents=[connection], help="print live bar indicators")
+    stream_parser.add_argument('tickers', nargs="+")
+    stream_parser.add_argument('--bar-size', default="5 secs")
+    stream_parser.add_argument('--what-to-show', default="TRADES")
+    stream_parser.add_argument('--interval', type=float, default=5, help="seconds between prints")
+    stream_parser.set_defaults(func=stream)
+
+    portfolio_parser = commands.add_parser("portfolio", parents=[connection],
+                                           help="print live P&L and exposure per underlying")
+    portfolio_parser.add_argument('--account', help="defaults to the first managed account")
+    portfolio_parser.add_argument('--interval', type=float, default=10, help="seconds between prints")
+    portfolio_parser.set_defaults(func=portfolio)
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.command == "close":
+        if args.watch and args.source != "csv":
+            parser.error("--watch only works with --source csv")
+        if args.gateways and has_limits(args):
+            parser.error("--max-* limits only work with a single connection, not with --gateways")
+        if args.sheet is None:
+            from sheet import SHEET_PATH
+
+            args.sheet = SHEET_PATH
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
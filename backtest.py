@@ -0,0 +1,176 @@
+"""replays cached daily option bars against past positions to evaluate close-out schedules
+
+    history = tracker_history(TrackerClient().all_trades())
+    panel = BarPanel.from_store(history, BarStore())
+    report = sweep(panel, make_grid([0.7, 0.75, 0.8], [0.5, 0.6], [0.3, 0.4]))
+
+The bars of every position are laid out once in a (positions x days since
+open) panel. Each parameter set is then evaluated for all positions at once
+with array operations, and parameter sets are spread over a process pool.
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from aquiles_enums import Right
+from bar_store import BarStore
+from options import BUY_PERCENTAGES, buy_percentages, make_option, round_prices
+
+MULTIPLIER = 100
+REPORT_COLUMNS = [
+    "first", "week", "later", "pnl", "premium", "fill_rate", "mean_days_held", "capital_turnover",
+    "annual_return_on_capital",
+]
+
+
+def tracker_history(rows) -> pd.DataFrame:
+    """every short option the tracker ever listed, open or closed, with the date it was opened"""
+    df = pd.DataFrame.from_records(rows)
+    df = df[df["type"] != "BUY"]
+    return pd.DataFrame({
+        "symbol": df["symbol"],
+        "expiry": pd.to_datetime(df["last_trade_date_or_contract_month"], format="%Y-%m-%d").dt.strftime("%Y%m%d"),
+        "strike": df["strike"].astype(float),
+        "right": df["right"].astype(int).map({right.value: right.name.upper() for right in Right}),
+        "sell_price": df["sell_price"].astype(float),
+        "opened": pd.to_datetime(df["sell_date"], format="%Y-%m-%d"),
+        "num_contracts": df["num_of_contracts"].astype(int),
+    }).reset_index(drop=True)
+
+
+def sheet_history(positions: pd.DataFrame, today=None) -> pd.DataFrame:
+    """history from positions of load_sheet_positions
+
+    The sheet only lists the days since open of each position, so the open
+    date is counted back from today.
+    """
+    today = pd.Timestamp(today or datetime.today().date())
+    history = positions.drop(columns="days_since_open")
+    history["opened"] = today - pd.to_timedelta(positions["days_since_open"], unit="D")
+    return history
+
+
+class BarPanel:
+    """daily bars of every position by calendar day since it was opened
+
+    opens/lows/closes are (positions, days) arrays, NaN where there was no bar.
+    Day d of a position is d days after it was opened, the last day is its expiry.
+    """
+
+    def __init__(self, positions, opens, lows, closes):
+        self.positions = positions.reset_index(drop=True)
+        self.opens = opens
+        self.lows = lows
+        self.closes = closes
+        self.sell_price = self.positions["sell_price"].to_numpy(dtype=np.float64)
+        self.contracts = self.positions["num_contracts"].to_numpy(dtype=np.float64)
+        self.collateral = self.positions["strike"].to_numpy(dtype=np.float64) * MULTIPLIER * self.contracts
+        has_bar = ~np.isnan(closes)
+        self.has_bars = has_bar.any(axis=1)
+        # settle positions that never filled at the last close before expiry
+        last = closes.shape[1] - 1 - np.argmax(has_bar[:, ::-1], axis=1)
+        self.last_day = np.where(self.has_bars, last, 0)
+        self.settle_price = np.where(self.has_bars, closes[np.arange(len(closes)), self.last_day], np.nan)
+
+    @classmethod
+    def from_store(cls, history: pd.DataFrame, store: BarStore = None, what_to_show="TRADES"):
+        """panel of the cached daily bars of every position, positions without bars are dropped"""
+        store = store or BarStore()
+        expiries = pd.to_datetime(history["expiry"].astype(str).str[:8], format="%Y%m%d")
+        spans = (expiries - history["opened"]).dt.days.clip(lower=0).to_numpy()
+        days = int(spans.max()) + 1 if len(spans) else 1
+        shape = (len(history), days)
+        opens, lows, closes = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+        for i, row in enumerate(history.itertuples(index=False)):
+            bars = store.load(make_option(row.symbol, row.expiry, row.strike, row.right), "1 day", what_to_show)
+            if bars is None or not len(bars):
+                continue
+            offsets = ((bars.index - row.opened) // pd.Timedelta(days=1)).to_numpy()
+            keep = (offsets >= 0) & (offsets <= spans[i])
+            offsets = offsets[keep]
+            opens[i, offsets] = bars["Open"].to_numpy()[keep]
+            lows[i, offsets] = bars["Low"].to_numpy()[keep]
+            closes[i, offsets] = bars["Close"].to_numpy()[keep]
+        panel = cls(history, opens, lows, closes)
+        if not panel.has_bars.all():
+            print(f"no cached bars for {(~panel.has_bars).sum()} of {len(history)} positions, leaving them out")
+            keep = panel.has_bars
+            panel = cls(history[keep], opens[keep], lows[keep], closes[keep])
+        return panel
+
+
+def simulate(panel: BarPanel, percentages=None) -> dict:
+    """replays the close-out policy with one set of BUY_PERCENTAGES over every position
+
+    The buy limit of day d is the sell price times the tier of d days since
+    open, rounded like options.round_prices. A day fills when its low reaches
+    the limit, at the open if it gapped below it. Positions never filled are
+    settled at their last close.
+    """
+    if not len(panel.positions):
+        raise ValueError("no positions to simulate")
+    days = np.arange(panel.opens.shape[1])
+    tiers = buy_percentages(days, percentages)
+    # one rounding per position and tier, the days of a tier share its limit
+    limits = np.empty(panel.opens.shape)
+    for tier in np.unique(tiers):
+        limits[:, tiers == tier] = round_prices(panel.sell_price * tier, panel.positions["symbol"])[:, None]
+
+    with np.errstate(invalid="ignore"):
+        fills = panel.lows <= limits
+    filled = fills.any(axis=1)
+    fill_day = np.where(filled, np.argmax(fills, axis=1), panel.last_day)
+    rows = np.arange(len(fill_day))
+    fill_price = np.fmin(panel.opens[rows, fill_day], limits[rows, fill_day])
+    exit_price = np.where(filled, fill_price, panel.settle_price)
+
+    pnl = (panel.sell_price - exit_price) * panel.contracts * MULTIPLIER
+    days_held = fill_day + 1
+    # capital is the cash securing each position while it is open
+    capital_days = (panel.collateral * days_held).sum()
+    opened = panel.positions["opened"]
+    span = (opened.max() - opened.min()).days + int(days_held.max())
+    return {
+        "pnl": pnl.sum(),
+        "premium": (panel.sell_price * panel.contracts * MULTIPLIER).sum(),
+        "fill_rate": filled.mean(),
+        "mean_days_held": days_held.mean(),
+        # how many times the average capital in use was committed to new positions
+        "capital_turnover": panel.collateral.sum() * span / capital_days,
+        "annual_return_on_capital": pnl.sum() / capital_days * 365,
+    }
+
+
+def make_grid(first, week, later) -> list:
+    """every combination of the three BUY_PERCENTAGES tiers"""
+    return [{"1": a, "7": b, "8": c} for a, b, c in itertools.product(first, week, later)]
+
+
+_panel = None
+
+
+def _init_worker(panel):
+    global _panel
+    _panel = panel
+
+
+def _run_chunk(grid) -> list:
+    return [(p["1"], p["7"], p["8"], *simulate(_panel, p).values()) for p in grid]
+
+
+def sweep(panel: BarPanel, grid, max_workers=None, chunk_size=64) -> pd.DataFrame:
+    """simulates every parameter set of the grid, best P&L first
+
+    The panel is sent once to each worker process, parameter sets go in chunks.
+    """
+    grid = list(grid) or [BUY_PERCENTAGES]
+    chunks = [grid[i:i + chunk_size] for i in range(0, len(grid), chunk_size)]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(chunks))
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(panel,)) as executor:
+        rows = [row for chunk in executor.map(_run_chunk, chunks) for row in chunk]
+    report = pd.DataFrame.from_records(rows, columns=REPORT_COLUMNS)
+    return report.sort_values("pnl", ascending=False, kind="stable").reset_index(drop=True)
@@ -0,0 +1,110 @@
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from bars import BAR_COLUMNS
+
+DEFAULT_STORE_DIR = os.path.expanduser("~/.aquiles/bars")
+
+
+def contract_key(contract, bar_size, what_to_show, use_rth=1) -> str:
+    """directory name of the bars of a contract, e.g. AAPL_STK_SMART_USD_1-day_TRADES_RTH"""
+    parts = [contract.symbol, contract.secType, contract.exchange, contract.currency]
+    if contract.secType in ("OPT", "FOP", "FUT"):
+        parts += [contract.lastTradeDateOrContractMonth, str(contract.strike), contract.right]
+    parts += [bar_size, what_to_show, "RTH" if use_rth else "ALL"]
+    return re.sub(r"[^A-Za-z0-9.]+", "-", "_".join(str(part) for part in parts if part))
+
+
+def parse_bar_dates(dates) -> pd.DatetimeIndex:
+    """IB dates look like 20230801, 20230801 09:30:00 or 20230801 09:30:00 US/Eastern"""
+    dates = pd.Index(dates).astype(str)
+    return pd.DatetimeIndex(pd.to_datetime(dates.str.slice(0, 17).str.strip()), name="Date")
+
+
+def missing_duration(last_bar: pd.Timestamp, now: datetime = None) -> str:
+    """smallest IB durationStr covering the time since the last cached bar"""
+    now = now or datetime.now()
+    seconds = max(int((pd.Timestamp(now) - last_bar).total_seconds()), 60)
+    if seconds <= 86400:
+        return f"{seconds} S"
+    days = -(-seconds // 86400) + 1
+    if days < 365:
+        return f"{days} D"
+    return f"{-(-days // 365)} Y"
+
+
+class BarStore:
+    """bars on disk as memory-mapped NumPy files, one directory per
+    (contract, bar size, whatToShow, useRTH)
+
+    load maps the files read only, so reading a year of bars costs no copy.
+    update fetches only the bars after the last cached one and merges them.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_DIR):
+        self.path = path
+
+    def _dir(self, key):
+        return os.path.join(self.path, key)
+
+    def load(self, contract, bar_size, what_to_show="TRADES", use_rth=1):
+        """cached bars indexed by Date, None if nothing is cached"""
+        directory = self._dir(contract_key(contract, bar_size, what_to_show, use_rth))
+        try:
+            dates = np.load(os.path.join(directory, "dates.npy"), mmap_mode="r")
+            values = np.load(os.path.join(directory, "values.npy"), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        if len(dates) != len(values):  # interrupted write
+            return None
+        return pd.DataFrame(
+            values,
+            index=pd.DatetimeIndex(dates.view("datetime64[ns]"), name="Date"),
+            columns=BAR_COLUMNS,
+            copy=False,
+        )
+
+    def write(self, contract, bar_size, what_to_show, data: pd.DataFrame, use_rth=1):
+        directory = self._dir(contract_key(contract, bar_size, what_to_show, use_rth))
+        os.makedirs(directory, exist_ok=True)
+        if not isinstance(data.index, pd.DatetimeIndex):
+            data = data.set_axis(parse_bar_dates(data.index))
+        arrays = {
+            "values.npy": np.ascontiguousarray(data[BAR_COLUMNS].to_numpy(dtype=np.float64)),
+            "dates.npy": data.index.to_numpy(dtype="datetime64[ns]").view(np.int64),
+        }
+        for name, array in arrays.items():
+            tmp = os.path.join(directory, f".{name}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp, os.path.join(directory, name))
+
+    def update(self, fetcher, contract, duration="1 Y", bar_size="1 day", what_to_show="TRADES", use_rth=1):
+        """returns all cached bars after fetching from IB only the ones not cached yet
+
+        `duration` is only used to fill an empty cache.
+
+        Adjusted bars change retroactively on splits and dividends, so ADJUSTED_LAST
+        is always fetched in full.
+        """
+        cached = self.load(contract, bar_size, what_to_show, use_rth)
+        if cached is None or not len(cached) or what_to_show == "ADJUSTED_LAST":
+            data = fetcher.fetch(contract, duration, bar_size, what_to_show, use_rth).result()
+            if not len(data):
+                return data
+            data = data.set_axis(parse_bar_dates(data.index))
+        else:
+            tail = fetcher.fetch(
+                contract, missing_duration(cached.index[-1]), bar_size, what_to_show, use_rth
+            ).result()
+            if not len(tail):
+                return cached
+            tail = tail.set_axis(parse_bar_dates(tail.index))
+            # the last cached bar may have been incomplete, the fresh one wins
+            data = pd.concat((cached[cached.index < tail.index[0]], tail))
+        self.write(contract, bar_size, what_to_show, data, use_rth)
+        return self.load(contract, bar_size, what_to_show, use_rth)
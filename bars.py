@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+BAR_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+class BarBuffer:
+    """growable columnar storage for the bars of one historical data request
+
+    Appending a bar is amortized O(1): values go into preallocated NumPy
+    arrays that double in size when full. to_frame wraps them in a
+    DataFrame indexed by Date without copying.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.dates = np.empty(capacity, dtype=object)
+        self.values = np.empty((capacity, len(BAR_COLUMNS)), dtype=np.float64)
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        capacity = max(2 * len(self.dates), 1024)
+        dates = np.empty(capacity, dtype=object)
+        dates[:self.size] = self.dates[:self.size]
+        values = np.empty((capacity, len(BAR_COLUMNS)), dtype=np.float64)
+        values[:self.size] = self.values[:self.size]
+        self.dates, self.values = dates, values
+
+    def append(self, bar):
+        if self.size == len(self.dates):
+            self._grow()
+        self.dates[self.size] = bar.date
+        self.values[self.size] = (bar.open, bar.high, bar.low, bar.close, float(bar.volume))
+        self.size += 1
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            self.values[:self.size],
+            index=pd.Index(self.dates[:self.size], name="Date"),
+            columns=BAR_COLUMNS,
+            copy=False,
+        )
@@ -0,0 +1,197 @@
+"""end-to-end throughput benchmarks against the local gateway simulator
+
+    python benchmarks.py --scales 10 1000 100000 --output bench_results.json
+
+Every scenario runs the real client code (TradeApp, submit_orders,
+HistoricalDataFetcher, close_open_positions_csv) against a GatewaySimulator
+on an ephemeral port, so no TWS or market data subscription is needed.
+By default the client pacer is disabled to measure the client itself,
+--paced keeps the 50 messages per second limit on both ends.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+import numpy as np
+
+from contracts import ContractResolver, contract_cache_key
+from historical import HistoricalDataFetcher
+from options import close_open_positions_csv, make_option
+from orders import make_order, submit_orders
+from pacing import HistoricalPacer, Pacer
+from simulator import GatewaySimulator, SimulatorConfig, make_position
+from trade_app import make_stock, start_app
+
+DEFAULT_SCALES = [10, 1000, 100000]
+BAR_REQUESTS = 20
+
+
+def latency_stats(latencies) -> dict:
+    """p50, p99 and max of latencies in seconds, in milliseconds"""
+    latencies = np.asarray([latency for latency in latencies if latency is not None]) * 1000
+    if not len(latencies):
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {"p50_ms": round(p50, 3), "p99_ms": round(p99, 3), "max_ms": round(latencies.max(), 3)}
+
+
+def synthetic_positions(n):
+    """n short puts as (symbol, expiry, strike), all expiring in two years"""
+    expiry = date(date.today().year + 2, 12, 17)
+    return [(f"S{i % 500:03d}", expiry, float(50 + i // 500)) for i in range(n)]
+
+
+def write_sheet(path, positions):
+    """a CSV laid out like the download of the Options Trading google sheet"""
+    with open(path, "w") as f:
+        f.write("Options trading,,,,\n,,,,\n")
+        f.write("Ticker,Ticker,Days since open,Num Contratos,Status\n")
+        for symbol, expiry, strike in positions:
+            f.write(f"{symbol} {expiry.strftime('%b%d')}'{expiry.strftime('%y')} {strike:g} P 1.50,"
+                    f"{symbol},3,-1,O\n")
+
+
+def seed_resolver(app, path, positions) -> ContractResolver:
+    """a resolver whose cache already knows every contract, the simulator has no contract details"""
+    resolver = ContractResolver(app, path=path, max_entries=len(positions) + 1)
+    for con_id, (symbol, expiry, strike) in enumerate(positions, start=1):
+        contract = make_option(symbol, expiry.strftime("%Y%m%d"), strike, "P")
+        resolver.cache[contract_cache_key(contract)] = {
+            "conId": con_id, "tradingClass": symbol, "localSymbol": f"{symbol} {strike:g}P",
+            "minTick": 0.01, "expiry": expiry.strftime("%Y%m%d"),
+        }
+    return resolver
+
+
+class Benchmark:
+    def __init__(self, paced=False):
+        self.paced = paced
+
+    def simulator_config(self, **kwargs) -> SimulatorConfig:
+        if not self.paced:
+            kwargs.update(max_messages_per_second=None, max_historical_requests=math.inf)
+        return SimulatorConfig(**kwargs)
+
+    def connect(self, gateway, client_id=1):
+        app = start_app(gateway.host, gateway.port, client_id)
+        if not self.paced:
+            app.pacer = Pacer(rate=math.inf)
+        return app
+
+    def run(self, name, scale, scenario):
+        """runs one scenario, measuring wall time and peak Python memory"""
+        tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = scenario(scale)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result.update(scenario=name, scale=scale, paced=self.paced, seconds=round(elapsed, 4),
+                      peak_memory_mb=round(peak / 2 ** 20, 3))
+        return result
+
+    def orders(self, n) -> dict:
+        """submits n limit orders and waits for every ack"""
+        with GatewaySimulator(self.simulator_config()) as gateway:
+            app = self.connect(gateway)
+            try:
+                contract = make_stock("AAPL")
+                start = time.perf_counter()
+                handles = submit_orders(app, [(contract, make_order("BUY", 100.0)) for _ in range(n)])
+                for handle in handles:
+                    handle.acked.result(timeout=60)
+                elapsed = time.perf_counter() - start
+            finally:
+                app.disconnect()
+        return {"orders_per_second": round(n / elapsed, 1), **latency_stats(h.ack_latency for h in handles)}
+
+    def bars(self, n) -> dict:
+        """fetches n bars for each of BAR_REQUESTS contracts"""
+        with GatewaySimulator(self.simulator_config(bars_per_request=n)) as gateway:
+            app = self.connect(gateway)
+            try:
+                pacer = None if self.paced else HistoricalPacer(max_requests=math.inf, max_same_contract=math.inf)
+                fetcher = HistoricalDataFetcher(app, pacer=pacer)
+                contracts = [make_stock(f"S{i:03d}") for i in range(BAR_REQUESTS)]
+                start = time.perf_counter()
+                frames = [future.result(timeout=600) for future in fetcher.fetch_many(contracts, "1 D", "1 min")]
+                elapsed = time.perf_counter() - start
+            finally:
+                app.disconnect()
+        total = sum(len(frame) for frame in frames)
+        return {"bars": total, "bars_per_second": round(total / elapsed, 1)}
+
+    def positions(self, n) -> dict:
+        """receives n positions and builds positions_df"""
+        live = [make_position(symbol, expiry.strftime("%Y%m%d"), strike, "P", -1, 150.0, con_id=i)
+                for i, (symbol, expiry, strike) in enumerate(synthetic_positions(n), start=1)]
+        with GatewaySimulator(self.simulator_config(positions=live)) as gateway:
+            app = self.connect(gateway)
+            try:
+                start = time.perf_counter()
+                positions_df = app.request_positions(timeout=600)
+                elapsed = time.perf_counter() - start
+            finally:
+                app.disconnect()
+        return {"positions": len(positions_df), "positions_per_second": round(len(positions_df) / elapsed, 1)}
+
+    def close_csv(self, n) -> dict:
+        """closes n positions of a sheet download, from reading the CSV to the last ack"""
+        positions = synthetic_positions(n)
+        live = [make_position(symbol, expiry.strftime("%Y%m%d"), strike, "P", -1, 150.0, con_id=i)
+                for i, (symbol, expiry, strike) in enumerate(positions, start=1)]
+        with tempfile.TemporaryDirectory() as tmp, GatewaySimulator(self.simulator_config(positions=live)) as gateway:
+            sheet = os.path.join(tmp, "sheet.csv")
+            write_sheet(sheet, positions)
+            app = self.connect(gateway)
+            try:
+                resolver = seed_resolver(app, os.path.join(tmp, "contracts.json"), positions)
+                start = time.perf_counter()
+                handles = close_open_positions_csv(app, path=sheet, resolver=resolver)
+                elapsed = time.perf_counter() - start
+            finally:
+                app.disconnect()
+        return {
+            "orders": len(handles), "positions_per_second": round(n / elapsed, 1),
+            **latency_stats(h.ack_latency for h in handles),
+        }
+
+    SCENARIOS = ["orders", "bars", "positions", "close_csv"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks the client against the gateway simulator")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--scenarios", nargs="+", choices=Benchmark.SCENARIOS, default=Benchmark.SCENARIOS)
+    parser.add_argument("--paced", action="store_true", help="keep the TWS message rate limits")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    benchmark = Benchmark(paced=args.paced)
+    results = []
+    for name in args.scenarios:
+        for scale in args.scales:
+            result = benchmark.run(name, scale, getattr(benchmark, name))
+            print(json.dumps(result))
+            results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "results": results,
+        }, f, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# lets the tests import the modules at the root of the repo
@@ -0,0 +1,134 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from datetime import datetime
+
+from trade_app import RequestError
+
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.aquiles/contracts.json")
+
+
+def contract_cache_key(contract) -> str:
+    return "|".join(str(part) for part in (
+        contract.symbol, contract.secType, contract.lastTradeDateOrContractMonth, float(contract.strike or 0),
+        contract.right, contract.multiplier, contract.exchange, contract.currency,
+    ))
+
+
+def round_to_tick(price, min_tick):
+    return round(round(price / min_tick) * min_tick, 10)
+
+
+class ContractResolver:
+    """qualifies contracts with their conId, trading class and minimum tick
+
+    Resolved contracts are kept in an LRU cache persisted as JSON. Entries
+    of expired contracts are evicted, so repeat runs on the same open
+    positions never ask TWS again. Misses are resolved with concurrent
+    reqContractDetails requests. One resolver can be shared by several
+    threads, resolve and save take turns.
+    """
+
+    def __init__(self, app, path=DEFAULT_CACHE_PATH, max_entries=10000, timeout: float = 10):
+        self.app = app
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self.cache = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entries = []
+        return self._evict(OrderedDict(entries))
+
+    def _evict(self, cache):
+        today = datetime.today().strftime("%Y%m%d")
+        for key in [key for key, entry in cache.items() if entry["expiry"] and entry["expiry"][:8] < today]:
+            del cache[key]
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+        return cache
+
+    def save(self):
+        """writes the cache through a temporary file of its own, other processes may save at the same time"""
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            entries = list(self._evict(self.cache).items())
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _request(self, contract) -> Future:
+        req_id = self.app.next_request_id()
+        future = self.app.requests[req_id] = Future()
+        self.app.pacer.wait()
+        self.app.reqContractDetails(req_id, contract)
+        return future
+
+    def _store(self, key, details):
+        resolved = details.contract
+        self.cache[key] = {
+            "conId": resolved.conId,
+            "tradingClass": resolved.tradingClass,
+            "localSymbol": resolved.localSymbol,
+            "minTick": details.minTick,
+            "expiry": resolved.lastTradeDateOrContractMonth,
+        }
+
+    def resolve(self, contracts) -> list:
+        """qualified copies of the contracts, None for the ones TWS could not resolve unambiguously"""
+        with self._lock:
+            return self._resolve(contracts)
+
+    def _resolve(self, contracts) -> list:
+        keys = [contract_cache_key(contract) for contract in contracts]
+        pending = {}
+        for key, contract in zip(keys, contracts):
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            elif key not in pending:
+                pending[key] = self._request(contract)
+
+        for key, future in pending.items():
+            try:
+                details = future.result(timeout=self.timeout)
+            except (RequestError, TimeoutError) as error:
+                print(f"could not resolve {key}: {error or 'timeout'}")
+                continue
+            if len(details) != 1:
+                print(f"could not resolve {key}: {len(details)} matching contracts")
+                continue
+            self._store(key, details[0])
+
+        if pending:
+            self.save()
+        return [self.qualify(contract, self.cache.get(key)) for key, contract in zip(keys, contracts)]
+
+    @staticmethod
+    def qualify(contract, entry):
+        if entry is None:
+            return None
+        qualified = copy.copy(contract)
+        qualified.conId = entry["conId"]
+        qualified.tradingClass = entry["tradingClass"]
+        qualified.localSymbol = entry["localSymbol"]
+        return qualified
+
+    def min_tick(self, contract):
+        with self._lock:
+            entry = self.cache.get(contract_cache_key(contract))
+        return entry["minTick"] if entry else None
@@ -0,0 +1,248 @@
+import queue
+import threading
+import time
+from datetime import date, timedelta
+
+from ibapi.ticktype import TickTypeEnum
+
+from contracts import ContractResolver
+from options import get_buy_price, make_option, plan_close_orders
+from orders import OrderHandle, make_order, submit_order
+from reconcile import check_positions, index_working_orders
+
+ASK_TICKS = {TickTypeEnum.ASK, TickTypeEnum.DELAYED_ASK}
+
+
+class WatchedPosition:
+    """an open short option whose ask is streamed from TWS"""
+
+    __slots__ = (
+        "key", "contract", "symbol", "sell_price", "opened", "num_contracts",
+        "target", "evaluated_on", "ask", "handle", "req_id", "pending",
+    )
+
+    def __init__(self, key, contract, row, today):
+        self.key = key
+        self.contract = contract
+        self.symbol = row.symbol
+        self.sell_price = float(row.sell_price)
+        self.opened = today - timedelta(days=int(row.days_since_open))
+        self.num_contracts = int(row.num_contracts)
+        self.ask = None
+        self.handle = None
+        self.req_id = None
+        self.pending = False
+        self.target = None
+        self.retarget(today)
+
+    def retarget(self, today) -> bool:
+        """recomputes the buy price for today, True if the tier changed"""
+        target = get_buy_price(self.sell_price, (today - self.opened).days, self.symbol)
+        self.evaluated_on = today
+        changed = self.target is not None and target != self.target
+        self.target = target
+        return changed
+
+    @property
+    def working(self):
+        return self.handle is not None and not self.handle.done.done()
+
+    def outcome(self):
+        """how the last order ended: None while working or without one, "Filled", "Cancelled" or "Rejected"
+
+        Cancelled covers day orders expiring at the close. Rejected covers TWS
+        errors, including a modify refused because the order already filled.
+        """
+        if self.handle is None or not self.handle.done.done():
+            return None
+        if self.handle.done.exception() is not None:
+            return "Rejected"
+        status = self.handle.done.result()
+        if status == "Inactive":
+            return "Rejected"
+        return "Filled" if status == "Filled" else "Cancelled"
+
+
+class CloseOutDaemon:
+    """keeps the connection open and closes positions as soon as their ask crosses the buy price
+
+    Every open position gets a streaming quote. On each ask tick the buy price
+    is only recomputed when the day changed, an order is submitted once the ask
+    reaches it, and a working order is repriced only when its tier changes.
+    Orders are sent from a worker thread so ticks never block the reader thread.
+    A cancelled or expired order is placed again on the next tick. A position
+    whose order was rejected, or whose action failed, is parked: it is dropped
+    and only comes back on the next refresh, checked against the positions and
+    working orders at IB, so a permanent reject is retried once per refresh.
+    A close-out order already resting at IB is followed instead of placing a second one.
+    Positions are reloaded every `refresh_interval` seconds, a failed reload
+    is retried on the next one.
+
+        CloseOutDaemon(app, lambda: load_tracker_positions(TrackerClient().open_trades())).run()
+    """
+
+    def __init__(self, app, load_positions, resolver=None, refresh_interval=300, market_data_type=1):
+        self.app = app
+        self.load_positions = load_positions
+        self.resolver = resolver or ContractResolver(app)
+        self.refresh_interval = refresh_interval
+        self.market_data_type = market_data_type
+        self.positions = {}  # (symbol, expiry, strike, right) -> WatchedPosition
+        self.filled = set()  # keys closed by this daemon the tracker may still list as open
+        self.parked = set()  # keys dropped until the next refresh, see _park
+        self.today = date.today()
+        self._actions = queue.Queue()
+        self._worker = threading.Thread(target=self._work, daemon=True)
+
+    def _on_tick(self, position, tick_type, price):
+        if tick_type not in ASK_TICKS or price <= 0:
+            return
+        position.ask = price
+        repriced = position.evaluated_on != self.today and position.retarget(self.today)
+        if position.pending:
+            return
+        outcome = position.outcome()
+        if outcome == "Filled":
+            return  # swept by the main loop
+        if outcome == "Rejected":
+            self._park(position, f"order {position.handle.order_id} rejected")
+            return
+        if outcome == "Cancelled":
+            print(f"order {position.handle.order_id} for {position.key} was cancelled, placing it again")
+            position.handle = None
+        if position.working:
+            if repriced:
+                position.pending = True
+                self._actions.put(("reprice", position))
+        elif position.handle is None and price <= position.target:
+            position.pending = True
+            self._actions.put(("submit", position))
+
+    def _park(self, position, reason):
+        """stops acting on a position until the next refresh looks at it again"""
+        print(f"{position.key}: {reason}, parked until the next refresh")
+        position.pending = True  # no more actions from ticks
+        self.parked.add(position.key)
+
+    def _work(self):
+        while True:
+            action, position = self._actions.get()
+            try:
+                self._act(action, position)
+            except Exception as error:
+                self._park(position, f"{action} failed: {error!r}")
+
+    def _act(self, action, position):
+        if action == "reprice" and not position.working:
+            # filled or ended since the tick queued it, a modify would fail and must not become a new order
+            position.pending = False
+            return
+        order = make_order("BUY", position.target, num_contracts=position.num_contracts)
+        if action == "submit":
+            order_id = self.app.nextOrderId()
+        else:
+            order_id = position.handle.order_id
+        print(f"{action} BUY {position.num_contracts} {position.key} at {position.target} (ask {position.ask})")
+        position.handle = submit_order(self.app, order_id, position.contract, order)
+        position.pending = False
+
+    def _adopt(self, position, working) -> bool:
+        """follows the close-out order already resting at IB for a position, False if the daemon must leave it
+
+        Only a single plain order of this client can be repriced by the daemon,
+        tiered OCA legs or orders of other clients stay with whoever placed them.
+        """
+        orders = working.get((position.contract.conId, "BUY"), [])
+        if not orders:
+            return True
+        if len(orders) > 1 or orders[0].order.ocaGroup or orders[0].client_id != self.app.clientId:
+            print(f"{position.key}: {len(orders)} working orders placed elsewhere, leaving it to them")
+            return False
+        order = orders[0].order
+        handle = OrderHandle(orders[0].order_id, position.contract, order)
+        handle.journal = self.app.journal
+        self.app.orders[handle.order_id] = handle
+        handle.on_status("Submitted")
+        position.handle = handle
+        if abs(order.lmtPrice - position.target) > 1e-9:
+            position.pending = True
+            self._actions.put(("reprice", position))
+        return True
+
+    def _subscribe(self, position):
+        position.req_id = self.app.next_request_id()
+        self.app.tick_handlers[position.req_id] = (
+            lambda tick_type, price, position=position: self._on_tick(position, tick_type, price)
+        )
+        self.app.pacer.wait()
+        self.app.reqMktData(position.req_id, position.contract, "", False, False, [])
+
+    def _unsubscribe(self, position):
+        self.app.tick_handlers.pop(position.req_id, None)
+        self.app.pacer.wait()
+        self.app.cancelMktData(position.req_id)
+
+    def refresh(self):
+        """subscribes to new open positions and drops the ones that were closed
+
+        Only positions still short at IB count, so a position closed while
+        its order was not followed is not bought again.
+        """
+        self._drop_parked()
+        plan = plan_close_orders(check_positions(self.load_positions(), self.app.request_positions()))
+        rows = {(row.symbol, row.expiry, float(row.strike), row.right): row for row in plan.itertuples(index=False)}
+
+        for key in set(self.positions) - set(rows):
+            position = self.positions.pop(key)
+            self._unsubscribe(position)
+            if position.working:
+                self.app.pacer.wait()
+                self.app.cancelOrder(position.handle.order_id, "")
+
+        new_keys = [key for key in rows if key not in self.positions and key not in self.filled]
+        if not new_keys:
+            return
+        contracts = self.resolver.resolve([make_option(*key) for key in new_keys])
+        # orders resting from `aquiles close` or an earlier daemon, so no position gets a second BUY
+        working = index_working_orders(self.app.request_open_orders(all_clients=True))
+        for key, contract in zip(new_keys, contracts):
+            if contract is None:
+                continue
+            position = WatchedPosition(key, contract, rows[key], self.today)
+            if self._adopt(position, working):  # otherwise checked again on the next refresh
+                self.positions[key] = position
+                self._subscribe(position)
+
+    def _drop_parked(self):
+        for key in list(self.parked):
+            self.parked.discard(key)
+            position = self.positions.pop(key, None)
+            if position is not None:
+                self._unsubscribe(position)
+
+    def _sweep_filled(self):
+        for key, position in list(self.positions.items()):
+            if position.handle is not None and position.handle.status == "Filled":
+                print(f"filled {position.key} at {position.handle.avg_fill_price}")
+                self.filled.add(key)
+                self._unsubscribe(self.positions.pop(key))
+
+    def run(self, stop: threading.Event = None):
+        stop = stop or threading.Event()
+        self.app.reqMarketDataType(self.market_data_type)
+        self._worker.start()
+        next_refresh = time.monotonic()
+        try:
+            while not stop.is_set():
+                self.today = date.today()
+                self._sweep_filled()
+                if time.monotonic() >= next_refresh:
+                    next_refresh = time.monotonic() + self.refresh_interval
+                    try:
+                        self.refresh()
+                    except Exception as error:
+                        print(f"refreshing the positions failed, retrying in {self.refresh_interval}s: {error!r}")
+                stop.wait(1)
+        finally:
+            for position in self.positions.values():
+                self._unsubscribe(position)
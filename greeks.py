@@ -0,0 +1,224 @@
+"""Black-Scholes / Black-76 prices, implied volatility and greeks for whole chains at once
+
+Every function takes NumPy arrays (or anything broadcastable to them) and
+works element-wise, so thousands of contracts are priced in one call.
+Times are in years, rates and volatilities are annual and continuously
+compounded.
+
+    analysis = analyze_positions(positions, {"SPY": 512.3}, asks)
+    plan = plan_greeks_close_orders(analysis, min_extrinsic_left=0.2, max_delta=0.5)
+"""
+import math
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from options import POSITION_COLUMNS, round_prices
+
+try:
+    from scipy.special import ndtr as norm_cdf
+except ImportError:
+    def norm_cdf(x):
+        """standard normal CDF, Abramowitz & Stegun 26.2.17 (absolute error < 7.5e-8)"""
+        x = np.asarray(x, dtype=np.float64)
+        z = np.abs(x)
+        k = 1 / (1 + 0.2316419 * z)
+        poly = k * (0.319381530 + k * (-0.356563782 + k * (1.781477937 + k * (-1.821255978 + k * 1.330274429))))
+        upper = norm_pdf(z) * poly
+        return np.where(x >= 0, 1 - upper, upper)
+
+DAYS_PER_YEAR = 365.0
+MIN_YEARS = 1e-8  # keeps d1/d2 finite on the day of expiry
+MIN_VOL = 1e-4
+MAX_VOL = 5.0
+
+
+def norm_pdf(x):
+    x = np.asarray(x, dtype=np.float64)
+    return np.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+def years_to_expiry(expiry, today=None):
+    """years between today and the YYYYMMDD expiries, options expire at the end of their day"""
+    today = pd.Timestamp(today or datetime.today().date())
+    expiry = pd.to_datetime(pd.Series(expiry).astype(str).str[:8], format="%Y%m%d")
+    days = (expiry - today).dt.days.to_numpy(dtype=np.float64) + 1
+    return np.maximum(days, 0) / DAYS_PER_YEAR
+
+
+def _prepare(forward, strike, years, vol, is_call):
+    forward, strike, years, vol = (np.asarray(a, dtype=np.float64) for a in (forward, strike, years, vol))
+    years = np.maximum(years, MIN_YEARS)
+    is_call = np.asarray(is_call, dtype=bool)
+    sigma_t = np.maximum(vol, MIN_VOL) * np.sqrt(years)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1 = (np.log(forward / strike) + 0.5 * sigma_t * sigma_t) / sigma_t
+    return forward, strike, years, is_call, sigma_t, d1, d1 - sigma_t
+
+
+def _black(forward, strike, years, vol, is_call, discount):
+    forward, strike, _, is_call, _, d1, d2 = _prepare(forward, strike, years, vol, is_call)
+    call = forward * norm_cdf(d1) - strike * norm_cdf(d2)
+    put = strike * norm_cdf(-d2) - forward * norm_cdf(-d1)
+    return discount * np.where(is_call, call, put), d1
+
+
+def black_price(forward, strike, years, vol, is_call, discount=1.0):
+    """Black-76 price of an option on a forward, discount is exp(-rate * years)"""
+    return _black(forward, strike, years, vol, is_call, discount)[0]
+
+
+def forward_and_discount(spot, years, rate=0.0, dividend=0.0):
+    years = np.asarray(years, dtype=np.float64)
+    discount = np.exp(-np.asarray(rate) * years)
+    forward = np.asarray(spot, dtype=np.float64) * np.exp((np.asarray(rate) - np.asarray(dividend)) * years)
+    return forward, discount
+
+
+def bs_price(spot, strike, years, vol, is_call, rate=0.0, dividend=0.0):
+    """Black-Scholes price with a continuous dividend yield"""
+    forward, discount = forward_and_discount(spot, years, rate, dividend)
+    return black_price(forward, strike, years, vol, is_call, discount)
+
+
+def bs_greeks(spot, strike, years, vol, is_call, rate=0.0, dividend=0.0) -> dict:
+    """price, delta, gamma, vega (per volatility point) and theta (per calendar day)"""
+    forward, discount = forward_and_discount(spot, years, rate, dividend)
+    spot = np.asarray(spot, dtype=np.float64)
+    forward, strike, years, is_call, sigma_t, d1, d2 = _prepare(forward, strike, years, vol, is_call)
+    carry = discount * forward / spot  # exp(-dividend * years)
+    pdf_d1 = norm_pdf(d1)
+    cdf_d1, cdf_d2 = norm_cdf(d1), norm_cdf(d2)
+
+    price = discount * np.where(is_call, forward * cdf_d1 - strike * cdf_d2,
+                                strike * (1 - cdf_d2) - forward * (1 - cdf_d1))
+    delta = carry * np.where(is_call, cdf_d1, cdf_d1 - 1)
+    gamma = carry * pdf_d1 / (spot * sigma_t)
+    vega = spot * carry * pdf_d1 * np.sqrt(years)
+    rate, dividend = np.asarray(rate), np.asarray(dividend)
+    decay = -spot * carry * pdf_d1 * sigma_t / (2 * years)
+    call_theta = decay - rate * strike * discount * cdf_d2 + dividend * spot * carry * cdf_d1
+    put_theta = decay + rate * strike * discount * (1 - cdf_d2) - dividend * spot * carry * (1 - cdf_d1)
+    return {
+        "price": price,
+        "delta": delta,
+        "gamma": gamma,
+        "vega": vega / 100,
+        "theta": np.where(is_call, call_theta, put_theta) / DAYS_PER_YEAR,
+    }
+
+
+def implied_vol(price, spot, strike, years, is_call, rate=0.0, dividend=0.0, tol=1e-6, max_iter=100):
+    """implied volatility of every option price, NaN where there is none
+
+    Newton steps on vega, falling back to bisection whenever a step leaves the
+    bracket known to hold the solution, so every element converges.
+    Prices outside the no-arbitrage bounds have no implied volatility.
+    """
+    forward, discount = forward_and_discount(spot, years, rate, dividend)
+    price, forward, strike, years, discount, is_call = np.broadcast_arrays(
+        np.asarray(price, dtype=np.float64), forward, np.asarray(strike, dtype=np.float64),
+        np.maximum(np.asarray(years, dtype=np.float64), MIN_YEARS), discount, np.asarray(is_call, dtype=bool),
+    )
+    intrinsic = discount * np.maximum(np.where(is_call, forward - strike, strike - forward), 0)
+    upper = discount * np.where(is_call, forward, strike)
+    valid = (price > intrinsic) & (price < upper)
+
+    low = np.full(price.shape, MIN_VOL)
+    high = np.full(price.shape, MAX_VOL)
+    # Brenner-Subrahmanyam guess, good near the money
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vol = np.sqrt(2 * math.pi / years) * price / (discount * forward)
+    vol = np.clip(np.nan_to_num(vol, nan=0.3), 0.01, 2.0)
+
+    diff = np.zeros(price.shape)
+    for _ in range(max_iter):
+        model, d1 = _black(forward, strike, years, vol, is_call, discount)
+        diff = model - price
+        active = valid & (np.abs(diff) > tol)
+        if not active.any():
+            break
+        high = np.where(active & (diff > 0), vol, high)
+        low = np.where(active & (diff < 0), vol, low)
+        vega = discount * forward * norm_pdf(d1) * np.sqrt(years)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            newton = vol - diff / vega
+        bisect = ~np.isfinite(newton) | (newton <= low) | (newton >= high)
+        vol = np.where(active, np.where(bisect, 0.5 * (low + high), newton), vol)
+
+    return np.where(valid & (np.abs(diff) <= tol), vol, np.nan)
+
+
+def expand_chain(option_chain_df: pd.DataFrame) -> pd.DataFrame:
+    """one row per (exchange, trading class, expiry, strike) of TradeApp.option_chain_df"""
+    chain = option_chain_df.explode("Expiry").explode("Strike")
+    chain = chain.dropna(subset=["Expiry", "Strike"])
+    return chain.astype({"Strike": np.float64, "Expiry": str}).sort_values(
+        ["Symbol", "Exchange", "Expiry", "Strike"], kind="stable"
+    ).reset_index(drop=True)
+
+
+def analyze_chain(chain: pd.DataFrame, spot, vol, right="P", rate=0.0, today=None) -> pd.DataFrame:
+    """theoretical price and greeks of every contract of an expanded chain at a flat volatility"""
+    years = years_to_expiry(chain["Expiry"], today)
+    greeks = bs_greeks(spot, chain["Strike"].to_numpy(), years, vol, right == "C", rate)
+    return chain.assign(years=years, **greeks)
+
+
+def analyze_positions(positions: pd.DataFrame, underlying_prices, option_prices, rate=0.0,
+                      today=None) -> pd.DataFrame:
+    """implied volatility, greeks and remaining extrinsic value of every position
+
+    underlying_prices maps symbol to the price of the underlying, option_prices
+    holds the current price of each option (e.g. its ask), in the order of the positions.
+    extrinsic_left is the time value still in the option as a fraction of the sell price.
+    """
+    spot = positions["symbol"].map(underlying_prices).to_numpy(dtype=np.float64)
+    price = np.asarray(option_prices, dtype=np.float64)
+    strike = positions["strike"].to_numpy(dtype=np.float64)
+    is_call = positions["right"].str[0].str.upper().to_numpy() == "C"
+    years = years_to_expiry(positions["expiry"], today)
+
+    iv = implied_vol(price, spot, strike, years, is_call, rate)
+    greeks = bs_greeks(spot, strike, years, iv, is_call, rate)
+    intrinsic = np.maximum(np.where(is_call, spot - strike, strike - spot), 0)
+    extrinsic = np.maximum(price - intrinsic, 0)
+    analysis = positions.copy()
+    analysis["option_price"] = price
+    analysis["underlying_price"] = spot
+    analysis["years"] = years
+    analysis["iv"] = iv
+    for name in ("delta", "gamma", "vega", "theta"):
+        analysis[name] = greeks[name]
+    analysis["intrinsic"] = intrinsic
+    analysis["extrinsic"] = extrinsic
+    analysis["extrinsic_left"] = extrinsic / positions["sell_price"].to_numpy(dtype=np.float64)
+    return analysis
+
+
+def greeks_close_mask(analysis: pd.DataFrame, min_extrinsic_left=0.2, max_delta=0.5) -> np.ndarray:
+    """positions worth closing now
+
+    A short option is bought back once less than `min_extrinsic_left` of the
+    premium is left as time value (little left to earn from theta), or once
+    its delta reached `max_delta` (the underlying moved against it).
+    Either threshold can be None to ignore it.
+    """
+    close = np.zeros(len(analysis), dtype=bool)
+    if min_extrinsic_left is not None:
+        close |= analysis["extrinsic_left"].to_numpy() <= min_extrinsic_left
+    if max_delta is not None:
+        close |= np.abs(analysis["delta"].to_numpy()) >= max_delta
+    return close
+
+
+def plan_greeks_close_orders(analysis: pd.DataFrame, min_extrinsic_left=0.2, max_delta=0.5,
+                             price_decimals=None) -> pd.DataFrame:
+    """order plan, like plan_close_orders, buying back the positions greeks_close_mask picks at their current price"""
+    selected = analysis[greeks_close_mask(analysis, min_extrinsic_left, max_delta)]
+    plan = selected[POSITION_COLUMNS].copy()
+    plan["action"] = "BUY"
+    plan["tier"] = np.nan
+    plan["buy_price"] = round_prices(selected["option_price"], selected["symbol"], price_decimals)
+    return plan.reset_index(drop=True)
@@ -0,0 +1,216 @@
+import math
+import queue
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from bars import BarBuffer
+from pacing import HistoricalPacer
+from trade_app import RequestError
+
+# max simultaneous open historical data requests allowed by IB
+MAX_IN_FLIGHT = 50
+# seconds TWS has to answer a request before it fails and frees its slot
+REQUEST_TIMEOUT = 60.0
+
+# bar sizes subject to the 60 requests per 10 minutes rule
+SMALL_BAR_SIZES = {"1 secs", "5 secs", "10 secs", "15 secs", "30 secs"}
+
+# longest duration IB returns in a single request, per bar size
+CHUNKS = {
+    "1 secs": ("1800 S", timedelta(seconds=1800)),
+    "5 secs": ("3600 S", timedelta(seconds=3600)),
+    "10 secs": ("14400 S", timedelta(seconds=14400)),
+    "15 secs": ("14400 S", timedelta(seconds=14400)),
+    "30 secs": ("28800 S", timedelta(seconds=28800)),
+    "1 min": ("1 D", timedelta(days=1)),
+    "2 mins": ("2 D", timedelta(days=2)),
+    "3 mins": ("1 W", timedelta(weeks=1)),
+    "5 mins": ("1 W", timedelta(weeks=1)),
+    "15 mins": ("2 W", timedelta(weeks=2)),
+    "30 mins": ("1 M", timedelta(days=30)),
+    "1 hour": ("1 M", timedelta(days=30)),
+    "1 day": ("1 Y", timedelta(days=365)),
+}
+
+DURATION_UNITS = {
+    "S": timedelta(seconds=1),
+    "D": timedelta(days=1),
+    "W": timedelta(weeks=1),
+    "M": timedelta(days=30),
+    "Y": timedelta(days=365),
+}
+
+
+def is_pacing_violation(error: Exception) -> bool:
+    return isinstance(error, RequestError) and error.code == 162 and "pacing violation" in error.message.lower()
+
+
+def is_no_data(error: Exception) -> bool:
+    """HMDS has no bars for the window, e.g. a holiday or an illiquid option"""
+    return isinstance(error, RequestError) and error.code == 162 and "returned no data" in error.message.lower()
+
+
+def parse_duration(duration: str) -> timedelta:
+    """'2 D' -> timedelta(days=2)"""
+    amount, unit = duration.split()
+    return int(amount) * DURATION_UNITS[unit]
+
+
+def format_end(end: datetime) -> str:
+    return end.astimezone(timezone.utc).strftime("%Y%m%d-%H:%M:%S")
+
+
+def split_duration(duration, bar_size, end=None, what_to_show="TRADES"):
+    """splits a request into (endDateTime, durationStr) chunks IB can serve in one go
+
+    Chunks are returned newest first. ADJUSTED_LAST requests cannot take an end date,
+    so they are never split.
+    """
+    end_str = format_end(end) if end is not None else ""
+    if bar_size not in CHUNKS or what_to_show == "ADJUSTED_LAST":
+        return [(end_str, duration)]
+    chunk_duration, chunk_length = CHUNKS[bar_size]
+    total = parse_duration(duration)
+    if total <= chunk_length:
+        return [(end_str, duration)]
+
+    end = end or datetime.now(timezone.utc)
+    chunks = [(end_str, chunk_duration)]
+    for i in range(1, math.ceil(total / chunk_length)):
+        chunks.append((format_end(end - i * chunk_length), chunk_duration))
+    return chunks
+
+
+class HistoricalRequest:
+    """bars of one contract, possibly made of several chunks"""
+
+    def __init__(self, contract, duration, bar_size, what_to_show, use_rth, end):
+        self.contract = contract
+        self.duration = duration
+        self.bar_size = bar_size
+        self.what_to_show = what_to_show
+        self.use_rth = use_rth
+        self.chunks = split_duration(duration, bar_size, end, what_to_show)
+        self.frames = [None] * len(self.chunks)
+        self.pending = len(self.chunks)
+        self.future = Future()
+        self._lock = threading.Lock()
+
+    @property
+    def pacing_key(self):
+        contract = self.contract
+        return (contract.conId, contract.symbol, contract.secType, contract.exchange, self.what_to_show)
+
+    def chunk_done(self, index, frame):
+        with self._lock:
+            self.frames[index] = frame
+            self.pending -= 1
+            finished = self.pending == 0
+        if finished:
+            frames = [frame for frame in reversed(self.frames) if len(frame)]
+            if not frames:
+                self.future.set_result(self.frames[0])
+                return
+            data = pd.concat(frames) if len(frames) > 1 else frames[0]
+            data = data[~data.index.duplicated(keep="last")].sort_index()
+            self.future.set_result(data)
+
+    def chunk_failed(self, error):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class HistoricalDataFetcher:
+    """keeps as many reqHistoricalData requests in flight as IB pacing allows
+
+    Long ranges are split into chunks, pacing violations are retried with
+    exponential backoff and chunks without data count as empty. A chunk not
+    answered within `timeout` seconds is cancelled and fails its request with
+    TimeoutError. fetch returns a Future of a DataFrame indexed by Date.
+
+        fetcher = HistoricalDataFetcher(app)
+        futures = [fetcher.fetch(make_stock(ticker), "1 Y", "1 day") for ticker in tickers]
+        data = [future.result() for future in futures]
+    """
+
+    def __init__(self, app, max_in_flight=MAX_IN_FLIGHT, max_retries=5, backoff=5.0, pacer=None,
+                 timeout=REQUEST_TIMEOUT):
+        self.app = app
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.pacer = pacer or HistoricalPacer()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def fetch(self, contract, duration="1 D", bar_size="1 min", what_to_show="TRADES", use_rth=1, end=None) -> Future:
+        request = HistoricalRequest(contract, duration, bar_size, what_to_show, use_rth, end)
+        for index in range(len(request.chunks)):
+            self._queue.put((request, index, 0))
+        return request.future
+
+    def fetch_many(self, contracts, duration="1 D", bar_size="1 min", what_to_show="TRADES", use_rth=1, end=None):
+        return [self.fetch(contract, duration, bar_size, what_to_show, use_rth, end) for contract in contracts]
+
+    def _run(self):
+        while True:
+            request, index, attempt = self._queue.get()
+            if request.future.done():  # another chunk already failed
+                continue
+            self.pacer.wait(request.pacing_key, request.bar_size in SMALL_BAR_SIZES)
+            self._slots.acquire()
+            self._send(request, index, attempt)
+
+    def _send(self, request, index, attempt):
+        req_id = self.app.next_request_id()
+        future = Future()
+        future.add_done_callback(lambda f: self._on_done(f, request, index, attempt))
+        timer = threading.Timer(self.timeout, self._expire, args=(req_id,))
+        timer.daemon = True
+        future.add_done_callback(lambda f: timer.cancel())
+        self.app.requests[req_id] = future
+        end, duration = request.chunks[index]
+        self.app.pacer.wait()
+        self.app.reqHistoricalData(
+            reqId=req_id,
+            contract=request.contract,
+            endDateTime=end,
+            durationStr=duration,
+            barSizeSetting=request.bar_size,
+            whatToShow=request.what_to_show,
+            useRTH=request.use_rth,
+            formatDate=1,
+            keepUpToDate=False,
+            chartOptions=[],
+        )
+        timer.start()
+
+    def _expire(self, req_id):
+        future = self.app.requests.pop(req_id, None)
+        if future is None:  # answered meanwhile
+            return
+        self.app._bars.pop(req_id, None)
+        self.app.pacer.wait()
+        self.app.cancelHistoricalData(req_id)
+        future.set_exception(TimeoutError(f"historical data request {req_id} not answered after {self.timeout}s"))
+
+    def _on_done(self, future, request, index, attempt):
+        self._slots.release()
+        error = future.exception()
+        if error is None:
+            request.chunk_done(index, future.result())
+        elif is_no_data(error):
+            request.chunk_done(index, BarBuffer(capacity=0).to_frame())
+        elif is_pacing_violation(error) and attempt < self.max_retries:
+            delay = self.backoff * 2 ** attempt
+            print(f"pacing violation for {request.contract.symbol}, retrying in {delay}s")
+            timer = threading.Timer(delay, self._queue.put, args=((request, index, attempt + 1),))
+            timer.daemon = True
+            timer.start()
+        else:
+            request.chunk_failed(error)
@@ -0,0 +1,325 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from orders import ORDER_REF
+
+DEFAULT_JOURNAL_DIR = os.path.expanduser("~/.aquiles")
+
+# order states, in the order they happen
+PLANNED = 1  # order id assigned, not sent yet
+SUBMITTED = 2  # placeOrder sent
+ACKED = 3  # TWS reported a status
+FILLED = 4
+CANCELLED = 5
+REJECTED = 6
+RESERVED = 7  # order ids below `order_id` are taken, not an order
+GONE = 8  # acked, no longer working at IB when checked (filled or cancelled while we were away)
+SUPERSEDED = 9  # planned by a run that never sent it, a later plan replaced it
+DONE_STATES = {FILLED, CANCELLED, REJECTED, GONE, SUPERSEDED}
+STATE_NAMES = {
+    PLANNED: "planned", SUBMITTED: "submitted", ACKED: "acked", FILLED: "filled",
+    CANCELLED: "cancelled", REJECTED: "rejected", RESERVED: "reserved", GONE: "gone", SUPERSEDED: "superseded",
+}
+
+# timestamp, state, order id, conId, contract key, account, action, order type, tif,
+# quantity, limit price, good after, good till (YYYYMMDDHHMMSS, 0 if unset), crc32 of the rest
+RECORD = struct.Struct("<dBqq48s16scccddqqI")
+RECORD_SIZE = RECORD.size  # 128 bytes
+ID_BLOCK = 100
+COMPACT_SIZE = 1 << 20
+
+ORDER_TYPES = {"LMT": b"L", "MKT": b"M", "STP": b"S"}
+TIFS = {"": b"D", "DAY": b"D", "GTC": b"C", "GTD": b"T"}
+
+
+def _code(value, codes) -> bytes:
+    return codes.get(value, b"?")
+
+
+def _decode(code, codes) -> str:
+    return next((value for value, c in codes.items() if c == code and value), "")
+
+
+def tws_time_to_int(text) -> int:
+    """"20240719 09:30:00 US/Eastern" to 20240719093000"""
+    return int(text[:17].replace(" ", "").replace(":", "")) if text else 0
+
+
+def int_to_tws_time(value) -> str:
+    if not value:
+        return ""
+    text = str(value)
+    return f"{text[:8]} {text[8:10]}:{text[10:12]}:{text[12:14]} US/Eastern"
+
+
+class JournalEntry:
+    """the last known state of one order"""
+
+    __slots__ = (
+        "timestamp", "state", "order_id", "con_id", "contract_key", "account", "action", "order_type", "tif",
+        "quantity", "limit_price", "good_after", "good_till",
+    )
+
+    def __init__(self, timestamp, state, order_id, con_id, contract_key, account, action, order_type, tif,
+                 quantity, limit_price, good_after, good_till):
+        self.timestamp = timestamp
+        self.state = state
+        self.order_id = order_id
+        self.con_id = con_id
+        self.contract_key = contract_key
+        self.account = account
+        self.action = action
+        self.order_type = order_type
+        self.tif = tif
+        self.quantity = quantity
+        self.limit_price = limit_price
+        self.good_after = good_after
+        self.good_till = good_till
+
+    @classmethod
+    def unpack(cls, data):
+        fields = RECORD.unpack(data)
+        if zlib.crc32(data[:-4]) != fields[-1]:
+            return None
+        (timestamp, state, order_id, con_id, key, account, action, order_type, tif,
+         quantity, limit_price, good_after, good_till, _) = fields
+        return cls(
+            timestamp, state, order_id, con_id, key.rstrip(b"\0").decode(), account.rstrip(b"\0").decode(),
+            "BUY" if action == b"B" else "SELL", _decode(order_type, ORDER_TYPES), _decode(tif, TIFS),
+            quantity, limit_price, int_to_tws_time(good_after), int_to_tws_time(good_till),
+        )
+
+    def pack(self) -> bytes:
+        data = RECORD.pack(
+            self.timestamp, self.state, self.order_id, self.con_id, self.contract_key.encode()[:48],
+            self.account.encode()[:16], b"B" if self.action == "BUY" else b"S", _code(self.order_type, ORDER_TYPES),
+            _code(self.tif, TIFS), self.quantity, self.limit_price, tws_time_to_int(self.good_after),
+            tws_time_to_int(self.good_till), 0,
+        )
+        return data[:-4] + struct.pack("<I", zlib.crc32(data[:-4]))
+
+    def with_state(self, state):
+        entry = JournalEntry(*[getattr(self, name) for name in self.__slots__])
+        entry.timestamp = time.time()
+        entry.state = state
+        return entry
+
+    @property
+    def expired(self) -> bool:
+        """True if TWS cancelled the order by itself since it was acked (day orders, past good till)"""
+        if self.tif == "DAY":
+            return datetime.fromtimestamp(self.timestamp).date() < datetime.now().date()
+        if self.tif == "GTD" and self.good_till:
+            return tws_time_to_int(self.good_till) < int(datetime.now().strftime("%Y%m%d%H%M%S"))
+        return False
+
+    def to_order(self):
+        """the Order as it was sent, without its OCA group"""
+        from ibapi.order import Order
+
+        order = Order()
+        order.orderId = self.order_id
+        order.orderRef = ORDER_REF
+        order.action = self.action
+        order.orderType = self.order_type
+        order.totalQuantity = self.quantity
+        order.tif = self.tif
+        if self.order_type != "MKT":
+            order.lmtPrice = self.limit_price
+        order.goodAfterTime = self.good_after
+        order.goodTillDate = self.good_till
+        order.account = self.account
+        return order
+
+
+class OrderJournal:
+    """append-only log of fixed size records of every order state change
+
+    Every record is 128 bytes with its own checksum, so a record torn by a
+    crash is detected and dropped on the next open. Records are written with
+    a single os.write on a file opened for appending, they survive the
+    process dying; planned orders and id reservations are also fsynced so
+    they survive the machine going down.
+
+    Opening the journal replays it once, `entries` then holds the last state
+    of every order and `reserved_until` the first order id never handed out.
+    TWS stays the truth for what is working, see sync.
+
+        journal = OrderJournal.for_client(23)
+        app.use_journal(journal)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # order id -> JournalEntry
+        self.reserved_until = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._replay()
+        if os.path.getsize(self.path) > COMPACT_SIZE:
+            self.compact()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    @classmethod
+    def for_client(cls, client_id, directory=DEFAULT_JOURNAL_DIR):
+        """order ids belong to a client id, so does the journal"""
+        return cls(os.path.join(directory, f"orders-{client_id}.journal"))
+
+    def _replay(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        good = 0
+        for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+            entry = JournalEntry.unpack(data[offset:offset + RECORD_SIZE])
+            if entry is None:
+                break
+            good = offset + RECORD_SIZE
+            if entry.state == RESERVED:
+                self.reserved_until = max(self.reserved_until, entry.order_id)
+            else:
+                self.entries[entry.order_id] = entry
+        if good < len(data):
+            print(f"journal {self.path}: dropping {len(data) - good} bytes of an interrupted write")
+        with open(self.path, "ab") as f:
+            f.truncate(good)
+
+    def compact(self):
+        """rewrites the journal with only the orders still planned, sent or working"""
+        with self._lock:
+            self.entries = {
+                order_id: entry for order_id, entry in self.entries.items()
+                if entry.state not in DONE_STATES and not (entry.state == ACKED and entry.expired)
+            }
+            reservation = JournalEntry(time.time(), RESERVED, self.reserved_until, 0, "", "", "", "", "", 0, 0, "", "")
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(reservation.pack() + b"".join(entry.pack() for entry in self.entries.values()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            if getattr(self, "_fd", None) is not None:
+                os.close(self._fd)
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def close(self):
+        os.close(self._fd)
+        self._fd = None
+
+    def _append(self, entries, sync=False):
+        data = b"".join(entry.pack() for entry in entries)
+        with self._lock:
+            os.write(self._fd, data)
+            if sync:
+                os.fsync(self._fd)
+            for entry in entries:
+                if entry.state == RESERVED:
+                    self.reserved_until = max(self.reserved_until, entry.order_id)
+                else:
+                    self.entries[entry.order_id] = entry
+
+    def reserve_ids(self, first_id, block=ID_BLOCK) -> int:
+        """takes the order ids first_id .. first_id + block - 1, returns the end of the block
+
+        The reservation is synced before any of its ids is used, so a restarted
+        app never hands out an id a previous run could have used.
+        """
+        end = first_id + block
+        self._append([JournalEntry(time.time(), RESERVED, end, 0, "", "", "", "", "", 0, 0, "", "")], sync=True)
+        return end
+
+    @staticmethod
+    def make_entry(state, order_id, contract, order) -> JournalEntry:
+        from contracts import contract_cache_key
+
+        return JournalEntry(
+            time.time(), state, order_id, contract.conId or 0, contract_cache_key(contract), order.account or "",
+            order.action, order.orderType, order.tif, float(order.totalQuantity),
+            0.0 if order.orderType == "MKT" else float(order.lmtPrice), order.goodAfterTime, order.goodTillDate,
+        )
+
+    def planned(self, orders):
+        """records a batch of (order id, contract, order) before any of them is sent"""
+        self._append([self.make_entry(PLANNED, order_id, contract, order) for order_id, contract, order in orders],
+                     sync=True)
+
+    def _record(self, state, handle):
+        self._append([self.make_entry(state, handle.order_id, handle.contract, handle.order)])
+
+    def on_submit(self, handle):
+        """written before placeOrder, an order is never sent without a record of it"""
+        self._record(SUBMITTED, handle)
+
+    def on_status(self, handle, status, first):
+        if first:
+            self._record(ACKED, handle)
+        if status == "Filled":
+            self._record(FILLED, handle)
+        elif status in ("Cancelled", "ApiCancelled"):
+            self._record(CANCELLED, handle)
+        elif status == "Inactive":
+            self._record(REJECTED, handle)
+
+    def on_error(self, handle):
+        self._record(REJECTED, handle)
+
+    def cancelled(self, order_id):
+        """records the cancellation of an order, also of orders sent by a previous run"""
+        entry = self.entries.get(order_id)
+        if entry is not None:
+            self._append([entry.with_state(CANCELLED)])
+
+    def sync(self, open_orders, client_id):
+        """brings the journal in line with the open orders TWS reported (TradeApp.request_open_orders)
+
+        Orders TWS lists are acked. Acked orders it no longer lists were filled,
+        cancelled by hand or expired while nothing was connected, they are done.
+        Planned orders never left, the plan about to run replaces them.
+        Sent orders TWS never acked stay as they are, see unconfirmed_orders.
+        """
+        listed = {order.orderId for _, order, _ in open_orders.values() if order.clientId == client_id}
+        changes = []
+        for entry in list(self.entries.values()):
+            if entry.order_id in listed:
+                if entry.state != ACKED:
+                    changes.append(entry.with_state(ACKED))
+            elif entry.state == ACKED:
+                changes.append(entry.with_state(GONE))
+            elif entry.state == PLANNED:
+                changes.append(entry.with_state(SUPERSEDED))
+        if changes:
+            self._append(changes)
+
+    def unconfirmed_orders(self, client_id, account=None) -> dict:
+        """orders sent but never acked, keyed like reconcile.index_working_orders
+
+        They may or may not have reached TWS, so they are marked unconfirmed
+        and diff_orders sends them again under the same id. Call sync first so
+        the ones TWS does list are acked.
+        """
+        from ibapi.contract import Contract
+
+        from reconcile import WorkingOrder
+
+        index = {}
+        for entry in list(self.entries.values()):
+            if entry.state != SUBMITTED or (account and entry.account != account):
+                continue
+            contract = Contract()
+            contract.conId = entry.con_id
+            order = entry.to_order()
+            order.clientId = client_id
+            index.setdefault((entry.con_id, entry.action), []).append(
+                WorkingOrder(contract, order, confirmed=False)
+            )
+        return index
+
+    def unfinished(self) -> list:
+        """orders planned or sent by a previous run that never got a final state"""
+        return [entry for entry in self.entries.values() if entry.state in (PLANNED, SUBMITTED)]
@@ -0,0 +1,252 @@
+"""latency histograms for the hot paths, off unless AQUILES_METRICS is set
+
+    AQUILES_METRICS=1 python aquiles.py close --source cloud
+
+collects the stages of close_open_positions_*, the time spent in every
+TradeApp callback and the submit -> ack -> fill latency of every order.
+The snapshot is written at exit to AQUILES_METRICS_PATH (JSON, or the
+Prometheus text format when the path ends in .prom) and can be taken at any
+time with snapshot(), to_json(), to_prometheus() or dump(path).
+
+When disabled every hook is a single check of a module global.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("AQUILES_METRICS", "") not in ("", "0")
+DEFAULT_PATH = os.path.expanduser(os.environ.get("AQUILES_METRICS_PATH", "~/.aquiles/metrics.json"))
+
+# values below 2**SUB_BUCKET_BITS microseconds are exact, above that every
+# power of two is split into 2**(SUB_BUCKET_BITS - 1) buckets (< 1.6% error)
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def bucket_index(value: int) -> int:
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKETS + (shift - 1) * HALF_SUB_BUCKETS + (value >> shift) - HALF_SUB_BUCKETS
+
+
+def bucket_bounds(index: int):
+    """lowest and highest value counted in a bucket"""
+    if index < SUB_BUCKETS:
+        return index, index
+    shift, sub = divmod(index - SUB_BUCKETS, HALF_SUB_BUCKETS)
+    shift += 1
+    low = (sub + HALF_SUB_BUCKETS) << shift
+    return low, low + (1 << shift) - 1
+
+
+class Histogram:
+    """HDR-style histogram of durations, log-linear buckets of microseconds
+
+    Recording is a dict increment, memory depends on the spread of the values
+    and not on how many were recorded.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        value = max(0, int(seconds * 1e6))
+        index = bucket_index(value)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def quantiles(self, quantiles=QUANTILES) -> dict:
+        """seconds below which each quantile of the values falls"""
+        with self._lock:
+            counts = sorted(self.counts.items())
+            count, highest = self.count, self.max
+        result = {}
+        if not count:
+            return result
+        position, seen = 0, 0
+        for quantile in sorted(quantiles):
+            rank = max(1, round(quantile * count))
+            while seen < rank:
+                seen += counts[position][1]
+                position += 1
+            low, high = bucket_bounds(counts[position - 1][0])
+            result[quantile] = min((low + high) / 2, highest) / 1e6
+        return result
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total / 1e6,
+            "min": self.min / 1e6 if self.min is not None else None,
+            "max": self.max / 1e6 if self.max is not None else None,
+            "quantiles": {str(quantile): value for quantile, value in self.quantiles().items()},
+        }
+
+
+class Registry:
+    """every histogram by name plus the latencies of each order by order id"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.orders = {}  # order id -> {"ack": seconds, "fill": seconds}
+        self._lock = threading.Lock()
+
+    def histogram(self, name) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def clear(self):
+        with self._lock:
+            self.histograms = {}
+            self.orders = {}
+
+
+registry = Registry()
+
+
+def observe(name, seconds: float):
+    if ENABLED:
+        registry.histogram(name).record(seconds)
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.histogram(self.name).record(time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """context manager recording how long its block took
+
+        with metrics.timer("close.resolve_contracts"):
+            contracts = resolver.resolve(contracts)
+    """
+    return _Timer(name) if ENABLED else _NULL_TIMER
+
+
+def timed(name):
+    """decorator recording how long every call of the function took"""
+    def decorator(func):
+        histogram_name = name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.histogram(histogram_name).record(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def order_acked(order_id, seconds: float):
+    """submit -> first status of an order"""
+    if ENABLED:
+        registry.orders.setdefault(order_id, {})["ack"] = seconds
+        registry.histogram("order.ack").record(seconds)
+
+
+def order_filled(order_id, seconds: float):
+    """first status -> Filled of an order"""
+    if ENABLED:
+        registry.orders.setdefault(order_id, {})["fill"] = seconds
+        registry.histogram("order.fill").record(seconds)
+
+
+def snapshot() -> dict:
+    return {
+        "timestamp": time.time(),
+        "histograms": {name: histogram.summary() for name, histogram in sorted(registry.histograms.items())},
+        "orders": {str(order_id): latencies for order_id, latencies in sorted(registry.orders.items())},
+    }
+
+
+def to_json() -> str:
+    return json.dumps(snapshot(), indent=2)
+
+
+def metric_name(name) -> str:
+    return "aquiles_" + "".join(c if c.isalnum() else "_" for c in name) + "_seconds"
+
+
+def to_prometheus() -> str:
+    """the histograms as Prometheus summaries, order latencies are only in the JSON"""
+    lines = []
+    for name, histogram in sorted(registry.histograms.items()):
+        metric = metric_name(name)
+        lines.append(f"# TYPE {metric} summary")
+        for quantile, value in histogram.quantiles().items():
+            lines.append(f'{metric}{{quantile="{quantile}"}} {value:.6f}')
+        lines.append(f"{metric}_sum {histogram.total / 1e6:.6f}")
+        lines.append(f"{metric}_count {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def dump(path=DEFAULT_PATH):
+    """writes the snapshot, in the Prometheus text format if path ends in .prom"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    text = to_prometheus() if path.endswith(".prom") else to_json()
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def enable(dump_at_exit=True, path=DEFAULT_PATH):
+    """turns the metrics on from code, as AQUILES_METRICS=1 does"""
+    global ENABLED
+    if not ENABLED and dump_at_exit:
+        atexit.register(dump, path)
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+if ENABLED:
+    atexit.register(dump, DEFAULT_PATH)
@@ -0,0 +1,130 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from options import execute_plan, make_plan
+from reconcile import check_positions
+
+REPORT_COLUMNS = [
+    "account", "order_id", "symbol", "action", "quantity", "limit_price", "status", "filled", "avg_fill_price",
+    "ack_ms",
+]
+
+
+def load_gateways(path) -> list:
+    """gateways to connect to, from a JSON file like
+
+        [
+            {"host": "127.0.0.1", "port": 7496, "client_id": 23},
+            {"host": "10.0.0.2", "port": 4001, "client_id": 24, "accounts": ["U1234567"]}
+        ]
+
+    Without "accounts" a connection serves every account TWS manages for it.
+    Every connection needs its own client_id.
+    """
+    with open(path) as f:
+        gateways = json.load(f)
+    client_ids = [gateway["client_id"] for gateway in gateways]
+    if len(set(client_ids)) != len(client_ids):
+        raise ValueError(f"client ids of the gateways in {path} must be distinct")
+    return gateways
+
+
+def connect_all(gateways, timeout: float = 10) -> list:
+    """connects to every gateway at the same time"""
+    from trade_app import start_app
+
+    with ThreadPoolExecutor(max_workers=len(gateways)) as executor:
+        return list(executor.map(
+            lambda gateway: start_app(gateway["host"], gateway["port"], gateway["client_id"], timeout), gateways
+        ))
+
+
+def assign_accounts(accounts_per_app: list) -> list:
+    """gives every account to the first connection that lists it
+
+    Two client ids on the same TWS both manage every account, closing an
+    account from both would send every BUY twice.
+    """
+    seen = set()
+    assigned = []
+    for accounts in accounts_per_app:
+        assigned.append([account for account in dict.fromkeys(accounts) if account not in seen])
+        seen.update(accounts)
+    return assigned
+
+
+def shard_positions(positions: pd.DataFrame, accounts_per_app: list) -> list:
+    """splits the positions by account, one list of (account, positions) per connection
+
+    Each account goes to exactly one connection, see assign_accounts.
+    """
+    accounts_per_app = assign_accounts(accounts_per_app)
+    if "account" not in positions:
+        accounts = [account for accounts in accounts_per_app for account in accounts]
+        if len(accounts) != 1:
+            raise ValueError("positions have no account column, cannot split them across accounts")
+        return [[(accounts[0], positions)] if accounts_of_app else [] for accounts_of_app in accounts_per_app]
+
+    by_account = dict(tuple(positions.groupby("account")))
+    served = {account for accounts in accounts_per_app for account in accounts}
+    for account in set(by_account) - served:
+        print(f"account {account} is not served by any gateway, skipping its {len(by_account[account])} positions")
+    return [
+        [(account, by_account[account]) for account in accounts if account in by_account]
+        for accounts in accounts_per_app
+    ]
+
+
+def report_row(account, handle):
+    return (
+        account, handle.order_id, handle.contract.localSymbol or handle.contract.symbol, handle.order.action,
+        handle.order.totalQuantity, handle.order.lmtPrice, handle.status, handle.filled, handle.avg_fill_price,
+        handle.ack_latency * 1000 if handle.ack_latency is not None else None,
+    )
+
+
+def run_shard(app, shard, tiered=False, exit_after_days=None, resolver=None) -> list:
+    """closes the positions of the accounts of one connection, one account after the other"""
+    if not shard:
+        return []
+    live = app.request_positions()
+    rows = []
+    for account, positions in shard:
+        positions = check_positions(positions, live, account)
+        plan = make_plan(positions, tiered, exit_after_days)
+        rows += [report_row(account, handle) for handle in execute_plan(app, plan, resolver=resolver, account=account)]
+    return rows
+
+
+def close_open_positions_accounts(gateways, positions: pd.DataFrame, dry_run=False, tiered=False,
+                                  exit_after_days=None) -> pd.DataFrame:
+    """closes the positions of every account, each connection working on its accounts in parallel
+
+    Wall time follows the connection with the most work instead of the sum of all accounts.
+    Contracts are resolved through the first connection into one cache shared by every shard,
+    conIds are the same whatever the account.
+    Returns one report with the orders sent to every account.
+    """
+    if dry_run:
+        groups = positions.groupby("account") if "account" in positions else [(None, positions)]
+        for account, group in groups:
+            print(f"account {account}:")
+            execute_plan(None, make_plan(group, tiered, exit_after_days), dry_run=True)
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+
+    from contracts import ContractResolver
+
+    apps = connect_all(gateways)
+    try:
+        resolver = ContractResolver(apps[0])
+        accounts_per_app = [gateway.get("accounts") or app.accounts for gateway, app in zip(gateways, apps)]
+        shards = shard_positions(positions, accounts_per_app)
+        with ThreadPoolExecutor(max_workers=len(apps)) as executor:
+            results = executor.map(lambda args: run_shard(*args, tiered, exit_after_days, resolver), zip(apps, shards))
+            rows = [row for shard_rows in results for row in shard_rows]
+    finally:
+        for app in apps:
+            app.disconnect()
+    return pd.DataFrame.from_records(rows, columns=REPORT_COLUMNS)
@@ -0,0 +1,194 @@
+import os
+from datetime import date, datetime
+
+import numpy as np
+
+from records import OptionChainRecord
+
+DEFAULT_CHAIN_DIR = os.path.expanduser("~/.aquiles/chains")
+
+
+def expiry_to_int(expiry) -> int:
+    """YYYYMMDD string, date or int to the int YYYYMMDD expiries are stored as"""
+    if isinstance(expiry, (date, datetime)):
+        return int(expiry.strftime("%Y%m%d"))
+    return int(str(expiry)[:8])
+
+
+class OptionChain:
+    """expirations and strikes one exchange lists for an underlying and trading class
+
+    Both are sorted NumPy arrays, every lookup is a binary search.
+    Expirations are ints like 20240719.
+    """
+
+    __slots__ = ("underlying_con_id", "exchange", "trading_class", "multiplier", "expirations", "strikes")
+
+    def __init__(self, underlying_con_id, exchange, trading_class, multiplier, expirations, strikes):
+        self.underlying_con_id = underlying_con_id
+        self.exchange = exchange
+        self.trading_class = trading_class
+        self.multiplier = multiplier
+        self.expirations = np.unique(np.asarray([expiry_to_int(e) for e in expirations], dtype=np.int64))
+        self.strikes = np.unique(np.asarray(list(strikes), dtype=np.float64))
+
+    @classmethod
+    def from_record(cls, record):
+        """from an OptionChainRecord of TradeApp.option_chains"""
+        return cls(record.underlying_con_id, record.exchange, record.trading_class, record.multiplier,
+                   record.expirations, record.strikes)
+
+    def to_record(self, req_id) -> OptionChainRecord:
+        """as securityDefinitionOptionParameter would have sent it"""
+        return OptionChainRecord(
+            req_id, self.exchange, self.underlying_con_id, self.trading_class, self.multiplier,
+            {str(expiry) for expiry in self.expirations.tolist()}, set(self.strikes.tolist()),
+        )
+
+    @property
+    def key(self):
+        return self.underlying_con_id, self.exchange, self.trading_class
+
+    def has_strike(self, strike) -> bool:
+        i = np.searchsorted(self.strikes, strike)
+        return i < len(self.strikes) and self.strikes[i] == strike
+
+    def has_expiry(self, expiry) -> bool:
+        expiry = expiry_to_int(expiry)
+        i = np.searchsorted(self.expirations, expiry)
+        return i < len(self.expirations) and self.expirations[i] == expiry
+
+    def strike_below(self, price, inclusive=True):
+        """highest strike below (or at) price, None if there is none"""
+        i = np.searchsorted(self.strikes, price, side="right" if inclusive else "left")
+        return float(self.strikes[i - 1]) if i > 0 else None
+
+    def strike_above(self, price, inclusive=True):
+        """lowest strike above (or at) price, None if there is none"""
+        i = np.searchsorted(self.strikes, price, side="left" if inclusive else "right")
+        return float(self.strikes[i]) if i < len(self.strikes) else None
+
+    def strikes_between(self, low, high) -> np.ndarray:
+        """strikes in [low, high], a view of the sorted array"""
+        return self.strikes[np.searchsorted(self.strikes, low, "left"):np.searchsorted(self.strikes, high, "right")]
+
+    def expiry_on_or_after(self, day):
+        """first expiration on or after day, None if there is none"""
+        i = np.searchsorted(self.expirations, expiry_to_int(day), side="left")
+        return int(self.expirations[i]) if i < len(self.expirations) else None
+
+    def expirations_between(self, first, last) -> np.ndarray:
+        first, last = expiry_to_int(first), expiry_to_int(last)
+        return self.expirations[
+            np.searchsorted(self.expirations, first, "left"):np.searchsorted(self.expirations, last, "right")
+        ]
+
+
+class OptionChainStore:
+    """option chains by (underlying conId, exchange, trading class), snapshotted to disk once a day
+
+    Chains only change when strikes or expirations are listed, so a snapshot
+    of the day is reused by every later run instead of asking TWS again.
+
+        store = OptionChainStore.load() or OptionChainStore()
+        chain = store.fetch(app, "SPY", 756733)[0]
+        chain.strike_below(spot)
+
+    app.use_chain_store() sends request_option_chain, and so option_chain_df, through the store too.
+    """
+
+    def __init__(self, path=DEFAULT_CHAIN_DIR):
+        self.path = path
+        self.chains = {}  # (underlying conId, exchange, trading class) -> OptionChain
+        self._by_underlying = {}  # underlying conId -> list of keys
+
+    def __len__(self):
+        return len(self.chains)
+
+    def add(self, chain: OptionChain):
+        if chain.key not in self.chains:
+            self._by_underlying.setdefault(chain.underlying_con_id, []).append(chain.key)
+        self.chains[chain.key] = chain
+
+    def add_records(self, records) -> list:
+        """adds the OptionChainRecords of TradeApp.option_chains, returns their chains"""
+        chains = [OptionChain.from_record(record) for record in records]
+        for chain in chains:
+            self.add(chain)
+        return chains
+
+    def get(self, underlying_con_id, exchange="SMART", trading_class=None):
+        """chain of an underlying on an exchange, the one with the most strikes if trading_class is None"""
+        if trading_class is not None:
+            return self.chains.get((underlying_con_id, exchange, trading_class))
+        candidates = [self.chains[key] for key in self._by_underlying.get(underlying_con_id, []) if key[1] == exchange]
+        return max(candidates, key=lambda chain: len(chain.strikes), default=None)
+
+    def for_underlying(self, underlying_con_id) -> list:
+        return [self.chains[key] for key in self._by_underlying.get(underlying_con_id, [])]
+
+    def fetch(self, app, symbol, underlying_con_id, sec_type="STK", timeout: float = 10) -> list:
+        """chains of an underlying, requested from TWS only if the store does not have them
+
+        Fetched chains are saved right away so the next run of the day finds them.
+        """
+        chains = self.for_underlying(underlying_con_id)
+        if not chains:
+            records = app.request_option_chain(app.next_request_id(), symbol, underlying_con_id, sec_type, timeout)
+            if app.chain_store is not self:  # otherwise the app already added and saved them
+                self.add_records(records)
+                if records:
+                    self.save()
+            chains = self.for_underlying(underlying_con_id)
+        return chains
+
+    @staticmethod
+    def snapshot_name(day=None) -> str:
+        return f"chains-{(day or date.today()).strftime('%Y%m%d')}.npz"
+
+    def save(self, day=None):
+        """writes the chains as the snapshot of the day"""
+        chains = list(self.chains.values())
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, self.snapshot_name(day))
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            underlying_con_ids=np.asarray([chain.underlying_con_id for chain in chains], dtype=np.int64),
+            exchanges=np.asarray([chain.exchange for chain in chains], dtype=str),
+            trading_classes=np.asarray([chain.trading_class for chain in chains], dtype=str),
+            multipliers=np.asarray([chain.multiplier for chain in chains], dtype=str),
+            # the arrays of all chains back to back, chain i spans offsets[i]:offsets[i + 1]
+            expiration_offsets=np.cumsum([0] + [len(chain.expirations) for chain in chains]),
+            expirations=np.concatenate([chain.expirations for chain in chains] or [np.empty(0, np.int64)]),
+            strike_offsets=np.cumsum([0] + [len(chain.strikes) for chain in chains]),
+            strikes=np.concatenate([chain.strikes for chain in chains] or [np.empty(0, np.float64)]),
+        )
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path=DEFAULT_CHAIN_DIR, day=None):
+        """the store of the snapshot of the day, None if there is none"""
+        try:
+            snapshot = np.load(os.path.join(path, cls.snapshot_name(day)), allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        store = cls(path)
+        with snapshot:
+            expiration_offsets, strike_offsets = snapshot["expiration_offsets"], snapshot["strike_offsets"]
+            expirations, strikes = snapshot["expirations"], snapshot["strikes"]
+            for i, (con_id, exchange, trading_class, multiplier) in enumerate(zip(
+                snapshot["underlying_con_ids"], snapshot["exchanges"], snapshot["trading_classes"],
+                snapshot["multipliers"],
+            )):
+                chain = OptionChain.__new__(OptionChain)
+                chain.underlying_con_id = int(con_id)
+                chain.exchange = str(exchange)
+                chain.trading_class = str(trading_class)
+                chain.multiplier = str(multiplier)
+                # already sorted and unique when saved
+                chain.expirations = expirations[expiration_offsets[i]:expiration_offsets[i + 1]]
+                chain.strikes = strikes[strike_offsets[i]:strike_offsets[i + 1]]
+                store.add(chain)
+        return store
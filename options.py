@@ -1,14 +1,24 @@
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
-import requests
-from ibapi.contract import Contract
 
+import metrics
 from aquiles_enums import Status, Right
-from orders import place_order
+from orders import make_oca_leg, make_order, wait_for_acks
+from reconcile import apply_diff, check_positions, diff_orders, index_working_orders
+from sheet import SHEET_PATH, SheetWatcher, read_sheet_positions
+
+# ibapi, the contract resolver and the tracker client are imported where they
+# are used, so planning a dry run loads neither the broker nor HTTP modules
+
+# columns of the table of open positions every close-out plan starts from
+POSITION_COLUMNS = ["symbol", "expiry", "strike", "right", "sell_price", "days_since_open", "num_contracts"]
 
 
 def make_option(symbol, expiry, strike, right, multiplier="100", exchange="SMART"):
+    from ibapi.contract import Contract
+
     contract = Contract()
     contract.symbol = symbol
     contract.secType = "OPT"
@@ -33,51 +43,233 @@ BUY_PERCENTAGES = {
     '8': 0.30,  # Buy To Close if price dropped 70%
 }
 
+# decimals of the limit price, these tickers only trade in 0.1 increments
+PRICE_DECIMALS = {
+    'CPER': 1,
+    'EZU': 1,
+    'SPX': 1,
+}
+DEFAULT_PRICE_DECIMALS = 2
 
-def close_open_positions_cloud(app, dry_run=False):
-    """Read downloaded CSV of Options Trading google sheet
+# days since open during which each BUY_PERCENTAGES tier applies, end excluded
+TIER_WINDOWS = {
+    '1': (0, 1),
+    '7': (1, 8),
+    '8': (8, None),
+}
 
-    Extract the PUT options and their date they were sold to open.
-    Place order to close contracts that have dropped in price.
 
-    Close if price dropped 25% within 1 day, 30% within 7 days, 50% after 7 days.
+def load_sheet_positions(path=SHEET_PATH) -> pd.DataFrame:
+    """open positions of the downloaded CSV of the Options Trading google sheet
+
+    The Ticker column looks like "SYM Mon DD'YY strike P price", see sheet.py.
+    """
+    return read_sheet_positions(path)
+
+
+def load_tracker_positions(rows) -> pd.DataFrame:
+    """open short options from the rows of the tracker's trades_json endpoint"""
+    df = pd.DataFrame.from_records(rows)
+    if df.empty:
+        return pd.DataFrame(columns=POSITION_COLUMNS)
+    # closed positions and protective puts are not closed out
+    df = df[(df["status"] != Status.closed.value) & (df["type"] != "BUY")]
+    today = pd.Timestamp(datetime.today().date())
+    positions = pd.DataFrame({
+        "symbol": df["symbol"],
+        "expiry": pd.to_datetime(df["last_trade_date_or_contract_month"], format="%Y-%m-%d").dt.strftime("%Y%m%d"),
+        "strike": df["strike"].astype(float),
+        "right": df["right"].astype(int).map({right.value: right.name.upper() for right in Right}),
+        "sell_price": df["sell_price"].astype(float),
+        "days_since_open": (today - pd.to_datetime(df["sell_date"], format="%Y-%m-%d")).dt.days,
+        "num_contracts": df["num_of_contracts"].astype(int),
+    })
+    if "account" in df:
+        positions["account"] = df["account"]
+    return positions.reset_index(drop=True)
+
+
+def round_price(price, decimals=DEFAULT_PRICE_DECIMALS) -> float:
+    """rounds a limit price to `decimals`, never below one tick"""
+    return max(round(price, decimals), 10.0 ** -decimals)
+
+
+def round_prices(prices, symbols, price_decimals=None):
+    """rounds every price to the tick of its ticker, exactly like get_buy_price does
+
+    Python's round on each price rather than np.round(price * scale) / scale,
+    the scaled product lands on the other side of half a tick for many prices.
     """
-    url = "https://tracker.aquilesinvierto.com/tracker/trades_json/"
-    response = requests.get(url)
-    data = response.json()
+    price_decimals = PRICE_DECIMALS if price_decimals is None else price_decimals
+    decimals = pd.Series(symbols).map(price_decimals).fillna(DEFAULT_PRICE_DECIMALS).astype(int).tolist()
+    prices = np.asarray(prices, dtype=np.float64).tolist()
+    return np.array([round_price(price, places) for price, places in zip(prices, decimals)], dtype=np.float64)
 
-    for idx, row in enumerate(data):
-        if row["status"] == Status.closed.value:
-            # closed position
-            continue
-        if row["type"] == "BUY":
-            # this is a protective put
-            continue
 
-        ticker = row['symbol']
-        avg_cost = float(row['sell_price'])
-        days_since_open = get_days_since_open(row['sell_date'])
-        num_contracts = int(row['num_of_contracts'])
+def buy_percentages(days_since_open, percentages=None):
+    """fraction of the sell price to buy back at, per position"""
+    percentages = BUY_PERCENTAGES if percentages is None else percentages
+    days = np.asarray(days_since_open)
+    return np.select([days < 1, days <= 7], [percentages['1'], percentages['7']], default=percentages['8'])
 
-        buy_price = get_buy_price(avg_cost, days_since_open, ticker)
 
-        expiry = datetime.strptime(row['last_trade_date_or_contract_month'], "%Y-%m-%d").strftime('%Y%m%d')
-        strike = row['strike']
-        right = Right(row['right']).name.upper()
-        contract = make_option(ticker, expiry, strike, right)
+def plan_close_orders(positions: pd.DataFrame, percentages=None, price_decimals=None) -> pd.DataFrame:
+    """order plan to buy to close every position once its price dropped enough
 
-        print(f"BUY {num_contracts} {ticker} {expiry} {strike} {right} {buy_price}")
+    Close if price dropped 25% within 1 day, 50% within 7 days, 70% after 7 days.
+    The plan can be printed for a dry run or sent with execute_plan.
+    """
+    plan = positions[POSITION_COLUMNS].copy()
+    plan["action"] = "BUY"
+    plan["tier"] = buy_percentages(plan["days_since_open"], percentages)
+    plan["buy_price"] = round_prices(plan["sell_price"] * plan["tier"], plan["symbol"], price_decimals)
+    return plan
 
-        if not dry_run:
-            order_id = app.nextValidOrderId
 
-            place_order(
-                app, order_id, action="BUY", limit_price=buy_price, contract=contract, num_contracts=num_contracts
-            )
-            app.nextOrderId()
+def plan_exit_groups(positions: pd.DataFrame, percentages=None, price_decimals=None, exit_after_days=None,
+                     today=None) -> pd.DataFrame:
+    """order plan with one One-Cancels-All group per position
 
+    Every tier becomes a leg resting at IB only during its window of days since open,
+    plus an optional market order once the position is `exit_after_days` old.
+    Whichever leg fills first cancels the others, so nothing has to be repriced.
+    Legs of tiers already past are left out.
+    """
+    percentages = BUY_PERCENTAGES if percentages is None else percentages
+    today = pd.Timestamp(today or datetime.today().date())
+    base = positions[POSITION_COLUMNS].copy()
+    base["action"] = "BUY"
+    opened = today - pd.to_timedelta(base["days_since_open"], unit="D")
+    base["oca_group"] = (
+        "aquiles " + base["symbol"] + " " + base["expiry"] + " " + base["strike"].astype(str)
+        + " " + base["right"] + " " + opened.dt.strftime("%Y%m%d")
+    )
 
-def close_open_positions_csv(app, dry_run=False):
+    legs = []
+    for key, (start, end) in TIER_WINDOWS.items():
+        leg = base.copy()
+        leg["order_type"] = "LMT"
+        leg["tier"] = percentages[key]
+        leg["buy_price"] = round_prices(leg["sell_price"] * leg["tier"], leg["symbol"], price_decimals)
+        leg["good_after"] = opened + pd.Timedelta(days=start)
+        leg["good_till"] = opened + pd.Timedelta(days=end) if end is not None else pd.NaT
+        legs.append(leg)
+    if exit_after_days is not None:
+        leg = base.copy()
+        leg["order_type"] = "MKT"
+        leg["tier"] = np.nan
+        leg["buy_price"] = np.nan
+        leg["good_after"] = opened + pd.Timedelta(days=exit_after_days)
+        leg["good_till"] = pd.NaT
+        legs.append(leg)
+
+    plan = pd.concat(legs, ignore_index=True)
+    plan = plan[plan["good_till"].isna() | (plan["good_till"] > today)]
+    plan.loc[plan["good_after"] <= today, "good_after"] = pd.NaT
+    return plan.sort_values("oca_group", kind="stable").reset_index(drop=True)
+
+
+def format_tws_time(timestamp):
+    if pd.isna(timestamp):
+        return None
+    return timestamp.strftime("%Y%m%d %H:%M:%S") + " US/Eastern"
+
+
+def plan_order(row, min_tick=None):
+    """the Order of one row of a plan from plan_close_orders or plan_exit_groups"""
+    order_type = getattr(row, "order_type", "LMT")
+    price = None if order_type == "MKT" else float(row.buy_price)
+    if price is not None and min_tick:
+        from contracts import round_to_tick
+
+        price = round_to_tick(price, min_tick)
+    oca_group = getattr(row, "oca_group", None)
+    if oca_group is None:
+        return make_order(row.action, price, order_type, int(row.num_contracts))
+    return make_oca_leg(
+        row.action, price, oca_group, order_type, int(row.num_contracts),
+        good_after=format_tws_time(row.good_after), good_till=format_tws_time(row.good_till),
+    )
+
+
+def execute_plan(app, plan: pd.DataFrame, dry_run=False, resolver=None, account=None, cancel_unplanned=True) -> list:
+    """prints every planned order and, unless dry_run, sends them and waits for the acks
+
+    Contracts are qualified by the resolver first so orders are placed by conId.
+    Planned orders already working at IB are left alone, working orders that
+    differ are modified and our orders no longer in the plan are cancelled.
+    With `account` the orders go to that account and only its working orders are considered.
+    Pass cancel_unplanned=False when the plan only covers some of the positions,
+    it is also turned off when a contract could not be resolved.
+    With a journal (TradeApp.use_journal) the orders a crashed run sent but TWS
+    never acknowledged are sent again under the same ids.
+    """
+    for row in plan.itertuples(index=False):
+        line = f"{row.action} {row.num_contracts} {row.symbol} {row.expiry} {row.strike} {row.right} {row.buy_price}"
+        if hasattr(row, "oca_group"):
+            line += f" OCA '{row.oca_group}' {format_tws_time(row.good_after)} - {format_tws_time(row.good_till)}"
+        print(line)
+    if dry_run:
+        return []
+
+    from contracts import ContractResolver
+
+    resolver = resolver or ContractResolver(app)
+    with metrics.timer("close.resolve_contracts"):
+        contracts = resolver.resolve([
+            make_option(row.symbol, row.expiry, row.strike, row.right) for row in plan.itertuples(index=False)
+        ])
+    desired = []
+    unresolved = 0
+    for row, contract in zip(plan.itertuples(index=False), contracts):
+        if contract is None:
+            print(f"skipping {row.symbol} {row.expiry} {row.strike} {row.right}, contract not resolved")
+            unresolved += 1
+            continue
+        order = plan_order(row, resolver.min_tick(contract))
+        if account:
+            order.account = account
+        desired.append((contract, order))
+
+    # only send what differs from the orders already working, so re-runs are idempotent
+    with metrics.timer("close.open_orders"):
+        open_orders = app.request_open_orders()
+        working = index_working_orders(open_orders, account)
+        if app.journal is not None:
+            app.journal.sync(open_orders, app.clientId)
+            for key, orders in app.journal.unconfirmed_orders(app.clientId, account).items():
+                working.setdefault(key, []).extend(orders)
+    if unresolved and cancel_unplanned:
+        # their working orders cannot be told apart from orders no longer planned, keep them all
+        print(f"{unresolved} contracts not resolved, leaving the working orders of unplanned contracts")
+        cancel_unplanned = False
+    diff = diff_orders(desired, working, app.clientId, cancel_unplanned)
+    print(diff)
+    with metrics.timer("close.send_orders"):
+        handles = apply_diff(app, diff)
+    with metrics.timer("close.wait_for_acks"):
+        wait_for_acks(handles)
+    return handles
+
+
+def make_plan(positions, tiered=False, exit_after_days=None):
+    if tiered:
+        return plan_exit_groups(positions, exit_after_days=exit_after_days)
+    return plan_close_orders(positions)
+
+
+def _close_positions(app, positions, dry_run, tiered, exit_after_days, resolver, cancel_unplanned=True):
+    if not dry_run:
+        with metrics.timer("close.check_positions"):
+            positions = check_positions(positions, app.request_positions())
+    with metrics.timer("close.plan"):
+        plan = make_plan(positions, tiered, exit_after_days)
+    with metrics.timer("close.execute"):
+        return execute_plan(app, plan, dry_run, resolver, cancel_unplanned=cancel_unplanned)
+
+
+def close_open_positions_cloud(app, dry_run=False, tracker=None, tiered=False, exit_after_days=None,
+                               resolver=None):
     """Read downloaded CSV of Options Trading google sheet
 
     Extract the PUT options and their date they were sold to open.
@@ -85,33 +277,57 @@ def close_open_positions_csv(app, dry_run=False):
 
     Close if price dropped 25% within 1 day, 30% within 7 days, 50% after 7 days.
     """
-    df = pd.read_csv(
-        "~/Downloads/Options trading Aquiles Invierto - Sheet1.csv", header=2
-    )
-    df = df.query("Status == 'O'")  # Only open positions
+    from tracker import TrackerClient
 
-    for idx, row in df.iterrows():
-        ticker = row['Ticker.1'].strip()
-        avg_cost = float(row['Ticker'].split(" ")[-1])
-        days_since_open = int(row['Days since open'])
-        num_contracts = abs(int(row['Num Contratos']))
+    tracker = tracker or TrackerClient()
+    with metrics.timer("close.fetch_tracker"):
+        trades = tracker.open_trades()
+    with metrics.timer("close.load_positions"):
+        positions = load_tracker_positions(trades)
+    return _close_positions(app, positions, dry_run, tiered, exit_after_days, resolver)
 
-        buy_price = get_buy_price(avg_cost, days_since_open, ticker)
 
-        expiry = datetime.strptime(row['Ticker'].split(" ")[1], "%b%d'%y").strftime('%Y%m%d')
-        strike = row['Ticker'].split(" ")[2]
-        right = row['Ticker'].split(" ")[3]
-        contract = make_option(ticker, expiry, strike, right)
+def close_open_positions_csv(app, dry_run=False, path=SHEET_PATH, tiered=False, exit_after_days=None,
+                             resolver=None):
+    """Read downloaded CSV of Options Trading google sheet
 
-        print(f"BUY {num_contracts} {ticker} {expiry} {strike} {right} {buy_price}")
+    Extract the PUT options and their date they were sold to open.
+    Place order to close contracts that have dropped in price.
 
-        if not dry_run:
-            order_id = app.nextValidOrderId
+    Close if price dropped 25% within 1 day, 30% within 7 days, 50% after 7 days.
+    """
+    with metrics.timer("close.load_positions"):
+        positions = load_sheet_positions(path)
+    return _close_positions(app, positions, dry_run, tiered, exit_after_days, resolver)
+
+
+def watch_open_positions_csv(app, dry_run=False, path=SHEET_PATH, tiered=False, exit_after_days=None,
+                             resolver=None, interval: float = 5, stop=None):
+    """closes positions of every new export of the sheet as it lands
 
-            place_order(
-                app, order_id, action="BUY", limit_price=buy_price, contract=contract, num_contracts=num_contracts
+    Only positions new or changed since the previous export are planned, the
+    orders of the others are left working. An export is only recorded as
+    handled once all its orders were acknowledged, otherwise it is retried
+    every `interval` seconds.
+    """
+    if not dry_run:
+        from contracts import ContractResolver
+
+        resolver = resolver or ContractResolver(app)
+    watcher = SheetWatcher(path, tier_starts=[start for start, _ in TIER_WINDOWS.values() if start])
+    for positions in watcher.watch(interval, stop):
+        print(f"{len(positions)} new or changed positions in {path}")
+        try:
+            handles = _close_positions(
+                app, positions, dry_run, tiered, exit_after_days, resolver, cancel_unplanned=False
             )
-            app.nextOrderId()
+        except Exception as error:
+            print(f"closing the positions of {path} failed, retrying: {error!r}")
+            continue
+        if all(handle.acked.done() and handle.acked.exception() is None for handle in handles):
+            watcher.commit()
+        else:
+            print(f"some orders for {path} were not acknowledged, retrying")
 
 
 def get_buy_price(avg_cost, days_since_open, ticker):
@@ -123,9 +339,4 @@ def get_buy_price(avg_cost, days_since_open, ticker):
         # days_since_sold > 7:
         buy_price = avg_cost * BUY_PERCENTAGES['8']  # Buy To Close if price dropped 70%
 
-    if ticker in ['CPER', 'EZU', 'SPX']:
-        buy_price = round(buy_price, 1)
-    else:
-        buy_price = round(buy_price, 2)
-
-    return buy_price
+    return round_price(buy_price, PRICE_DECIMALS.get(ticker, DEFAULT_PRICE_DECIMALS))
@@ -1,27 +1,186 @@
 import time
+from concurrent.futures import Future, TimeoutError
+from typing import TYPE_CHECKING
 
-from ibapi.contract import Contract
-from ibapi.order import Order
+import metrics
 
+if TYPE_CHECKING:  # ibapi is imported only when an order is made, dry runs never load it
+    from ibapi.contract import Contract
+    from ibapi.order import Order
 
-def place_order(
-    app, order_id, action: str, limit_price, contract: Contract, order_type: str = "LMT",
-    num_contracts: int = 1
-) -> int:
-    """places order and returns order id
+# orderRef of every order we place, tells our orders apart from manual ones
+ORDER_REF = "aquiles"
 
-    By default, orders are valid only for the trading session on the day the order was placed.
+# order states after which TWS sends no more updates for an order
+DONE_STATUSES = {"Filled", "Cancelled", "ApiCancelled", "Inactive"}
 
-    action: BUY, SELL
+
+class OrderError(Exception):
+    def __init__(self, order_id, code, message):
+        super().__init__(f"order {order_id} rejected: [{code}] {message}")
+        self.order_id = order_id
+        self.code = code
+
+
+def is_warning(error_code: int) -> bool:
+    """TWS reports informational messages through the error callback too"""
+    return error_code == 399 or 2100 <= error_code < 2200
+
+
+class OrderHandle:
+    """tracks an order submitted to TWS
+
+    `acked` resolves with the first status TWS reports for the order and
+    `done` with its final status (Filled, Cancelled, Inactive).
+    Both fail with OrderError if TWS rejects the order.
+    """
+
+    def __init__(self, order_id: int, contract: "Contract", order: "Order"):
+        self.order_id = order_id
+        self.contract = contract
+        self.order = order
+        self.status = None
+        self.filled = 0
+        self.avg_fill_price = 0.0
+        self.submitted_at = None
+        self.acked_at = None
+        self.journal = None  # OrderJournal recording the order, if the app has one
+        self.acked = Future()
+        self.done = Future()
+
+    @property
+    def ack_latency(self):
+        """seconds between placeOrder and the first status from TWS"""
+        if self.acked_at is None:
+            return None
+        return self.acked_at - self.submitted_at
+
+    def on_submit(self):
+        self.submitted_at = time.monotonic()
+        if self.journal is not None:
+            self.journal.on_submit(self)
+
+    def on_status(self, status, filled=None, avg_fill_price=None):
+        changed = status != self.status
+        self.status = status
+        if filled is not None:
+            self.filled = filled
+        if avg_fill_price is not None:
+            self.avg_fill_price = avg_fill_price
+        if self.journal is not None and changed:
+            self.journal.on_status(self, status, first=not self.acked.done())
+        if not self.acked.done():
+            self.acked_at = time.monotonic()
+            if metrics.ENABLED and self.submitted_at is not None:
+                metrics.order_acked(self.order_id, self.acked_at - self.submitted_at)
+            self.acked.set_result(status)
+        if status in DONE_STATUSES and not self.done.done():
+            if metrics.ENABLED and status == "Filled":
+                metrics.order_filled(self.order_id, time.monotonic() - self.acked_at)
+            self.done.set_result(status)
+
+    def on_error(self, code, message):
+        if self.journal is not None and not self.done.done():
+            self.journal.on_error(self)
+        error = OrderError(self.order_id, code, message)
+        for future in (self.acked, self.done):
+            if not future.done():
+                future.set_exception(error)
+
+
+def make_order(action: str, limit_price, order_type: str = "LMT", num_contracts: int = 1) -> "Order":
+    """action: BUY, SELL
     order_type: LMT, MKT, STP
     """
+    from ibapi.order import Order
+
     order = Order()
+    order.orderRef = ORDER_REF
     order.allOrNone = True
     order.action = action
     order.orderType = order_type
     order.totalQuantity = num_contracts
-    order.lmtPrice = limit_price
+    if limit_price is not None:
+        order.lmtPrice = limit_price
+    return order
+
+
+def make_oca_leg(action: str, limit_price, oca_group: str, order_type: str = "LMT", num_contracts: int = 1,
+                 good_after: str = None, good_till: str = None) -> "Order":
+    """one leg of a One-Cancels-All group, the first leg to fill cancels the others
 
-    app.placeOrder(order_id, contract, order)
-    time.sleep(5)
+    good_after / good_till are "YYYYMMDD HH:MM:SS US/Eastern" times limiting when the leg can fill.
+    Legs rest at IB until they fill or good_till passes.
+    """
+    order = make_order(action, limit_price, order_type, num_contracts)
+    order.ocaGroup = oca_group
+    order.ocaType = 1  # cancel the remaining legs with block
+    order.tif = "GTD" if good_till else "GTC"
+    if good_after:
+        order.goodAfterTime = good_after
+    if good_till:
+        order.goodTillDate = good_till
+    return order
+
+
+def submit_order(app, order_id: int, contract: "Contract", order: "Order", pace=True) -> OrderHandle:
+    """sends the order without waiting for TWS and returns a handle to follow it
+
+    Orders go out back-to-back, only throttled by the app's message pacer
+    (pass pace=False if the caller already waited for its slot).
+    With a live portfolio, raises GuardrailError instead of sending an order over its limits.
+    """
+    if app.portfolio is not None:
+        app.portfolio.check(contract, order)
+    handle = OrderHandle(order_id, contract, order)
+    handle.journal = app.journal
+    app.orders[order_id] = handle
+    if pace:
+        app.pacer.wait()
+    handle.on_submit()
+    with metrics.timer("order.place"):
+        app.placeOrder(order_id, contract, order)
+    return handle
+
+
+def submit_orders(app, orders) -> list:
+    """submits a batch of (contract, order) pairs with fresh order ids"""
+    return [submit_order(app, app.nextOrderId(), contract, order) for contract, order in orders]
+
+
+def wait_for_acks(handles, timeout: float = 30) -> list:
+    """blocks until TWS acknowledged every order or `timeout` seconds passed
+
+    Returns the handles that were not acknowledged in time or were rejected.
+    """
+    deadline = time.monotonic() + timeout
+    failed = []
+    for handle in handles:
+        try:
+            status = handle.acked.result(timeout=max(0, deadline - time.monotonic()))
+        except TimeoutError:
+            print(f"order {handle.order_id}: no acknowledgment after {timeout}s")
+            failed.append(handle)
+        except OrderError as error:
+            print(error)
+            failed.append(handle)
+        else:
+            print(f"order {handle.order_id}: {status} in {handle.ack_latency * 1000:.0f} ms")
+    return failed
+
+
+def place_order(
+    app, order_id, action: str, limit_price, contract: "Contract", order_type: str = "LMT",
+    num_contracts: int = 1
+) -> int:
+    """places order and returns order id
+
+    By default, orders are valid only for the trading session on the day the order was placed.
+    The order is tracked in `app.orders[order_id]`, see submit_order.
+
+    action: BUY, SELL
+    order_type: LMT, MKT, STP
+    """
+    order = make_order(action, limit_price, order_type, num_contracts)
+    submit_order(app, order_id, contract, order)
     return order_id
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import deque
+
+# TWS disconnects clients that send more than 50 messages per second
+MAX_MESSAGES_PER_SECOND = 50
+
+
+class Pacer:
+    """spaces out messages sent to TWS so we never exceed `rate` messages per second
+
+    Safe to share between threads, every caller gets its own time slot.
+    """
+
+    def __init__(self, rate: float = MAX_MESSAGES_PER_SECOND):
+        self.interval = 1 / rate
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """takes the next time slot and returns how many seconds to wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        return slot - now
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HistoricalPacer:
+    """enforces the IB pacing rules for historical data requests
+
+    * no more than 60 requests in any 10 minutes for bars of 30 seconds or less
+    * no more than 5 requests for the same contract within 2 seconds
+
+    wait blocks until sending the next request would not cause a pacing violation.
+    """
+
+    def __init__(self, max_requests=60, window=600.0, max_same_contract=5, same_contract_window=2.0):
+        self.max_requests = max_requests
+        self.window = window
+        self.max_same_contract = max_same_contract
+        self.same_contract_window = same_contract_window
+        self._small_bar_requests = deque()
+        self._by_contract = {}
+        self._lock = threading.Lock()
+
+    def _delay(self, key, small_bars, now):
+        delay = 0.0
+        if small_bars:
+            while self._small_bar_requests and self._small_bar_requests[0] <= now - self.window:
+                self._small_bar_requests.popleft()
+            if len(self._small_bar_requests) >= self.max_requests:
+                delay = self._small_bar_requests[0] + self.window - now
+        same = self._by_contract.setdefault(key, deque())
+        while same and same[0] <= now - self.same_contract_window:
+            same.popleft()
+        if len(same) >= self.max_same_contract:
+            delay = max(delay, same[0] + self.same_contract_window - now)
+        return delay
+
+    def wait(self, key, small_bars: bool):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._delay(key, small_bars, now)
+                if delay <= 0:
+                    if small_bars:
+                        self._small_bar_requests.append(now)
+                    self._by_contract[key].append(now)
+                    return
+            time.sleep(delay)
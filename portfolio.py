@@ -0,0 +1,306 @@
+"""live P&L and exposure of the book, fed by reqAccountUpdates and reqPnLSingle
+
+    portfolio = Portfolio(app, limits=Limits(max_notional=250_000, max_underlying_notional=50_000))
+    portfolio.start()
+    ...
+    snapshot = portfolio.snapshot()
+    print(snapshot.underlyings())
+
+Positions live in preallocated arrays with one row per conId, and the
+aggregates of every underlying (notional, unrealized and daily P&L, market
+value, open legs) are adjusted by the change of the one row a callback
+touched, so an update costs the same however many legs the book has.
+
+Only the reader thread writes. snapshot() copies the arrays without taking
+a lock: a version counter is odd while a row is written, the copy is taken
+again if it changed meanwhile.
+"""
+import queue
+import sys
+import threading
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+UNSET = sys.float_info.max  # ibapi's UNSET_DOUBLE, sent for values TWS does not know
+DEFAULT_MULTIPLIER = 100
+
+# columns of Portfolio.values
+POSITION, MARKET_PRICE, MARKET_VALUE, AVG_COST, UNREALIZED, DAILY, REALIZED, STRIKE, MULTIPLIER = range(9)
+VALUE_COLUMNS = [
+    "position", "market_price", "market_value", "avg_cost", "unrealized_pnl", "daily_pnl", "realized_pnl",
+    "strike", "multiplier",
+]
+# columns of Portfolio.aggregates and Portfolio.totals
+NOTIONAL, AGG_UNREALIZED, AGG_DAILY, AGG_VALUE, LEGS = range(5)
+AGGREGATE_COLUMNS = ["notional", "unrealized_pnl", "daily_pnl", "market_value", "legs"]
+RIGHTS = {"P": 1, "C": 2}  # 0 is not an option
+
+
+class GuardrailError(Exception):
+    def __init__(self, symbol, message):
+        super().__init__(f"{symbol}: {message}")
+        self.symbol = symbol
+
+
+class Limits:
+    """risk limits checked before an order adds exposure, None means no limit"""
+
+    __slots__ = ("max_notional", "max_underlying_notional", "max_daily_loss")
+
+    def __init__(self, max_notional=None, max_underlying_notional=None, max_daily_loss=None):
+        self.max_notional = max_notional
+        self.max_underlying_notional = max_underlying_notional
+        self.max_daily_loss = max_daily_loss
+
+
+def expiry_days(value) -> int:
+    """"20240719" to days since 1970-01-01, -1 without an expiry"""
+    if not value:
+        return -1
+    return int(np.datetime64(f"{value[:4]}-{value[4:6]}-{value[6:8]}", "D").astype(np.int64))
+
+
+def contract_multiplier(contract) -> float:
+    if contract.multiplier:
+        return float(contract.multiplier)
+    return DEFAULT_MULTIPLIER if contract.secType == "OPT" else 1.0
+
+
+def order_notional(contract, order) -> float:
+    """assignment exposure an order adds, only selling options adds any"""
+    if contract.secType != "OPT" or order.action != "SELL":
+        return 0.0
+    return contract.strike * contract_multiplier(contract) * float(order.totalQuantity)
+
+
+class PortfolioSnapshot:
+    """a consistent copy of the position table and the aggregates"""
+
+    __slots__ = ("con_ids", "symbols", "underlying", "rights", "expiries", "values", "aggregates", "totals",
+                 "taken_at")
+
+    def __init__(self, con_ids, symbols, underlying, rights, expiries, values, aggregates, totals):
+        self.con_ids = con_ids
+        self.symbols = symbols  # underlying id -> symbol
+        self.underlying = underlying
+        self.rights = rights
+        self.expiries = expiries
+        self.values = values
+        self.aggregates = aggregates
+        self.totals = totals
+        self.taken_at = time.time()
+
+    def days_to_expiry(self, today=None) -> np.ndarray:
+        today = expiry_days((today or date.today()).strftime("%Y%m%d"))
+        return np.where(self.expiries >= 0, self.expiries - today, -1)
+
+    def positions(self, today=None) -> pd.DataFrame:
+        df = pd.DataFrame(self.values, columns=VALUE_COLUMNS)
+        df.insert(0, "con_id", self.con_ids)
+        df.insert(1, "symbol", np.asarray(self.symbols, dtype=object)[self.underlying])
+        df.insert(2, "right", pd.Categorical.from_codes(self.rights, ["", "P", "C"]))
+        df["days_to_expiry"] = self.days_to_expiry(today)
+        df["notional"] = np.where(
+            self.rights > 0, df["strike"] * df["multiplier"] * np.maximum(-df["position"], 0), 0.0
+        )
+        return df
+
+    def underlyings(self, today=None) -> pd.DataFrame:
+        """aggregates per underlying, with the days to the nearest expiry of its open legs"""
+        df = pd.DataFrame(self.aggregates, columns=AGGREGATE_COLUMNS)
+        df.insert(0, "symbol", self.symbols)
+        nearest = np.full(len(self.symbols), np.iinfo(np.int64).max)
+        open_legs = (self.values[:, POSITION] != 0) & (self.expiries >= 0)
+        np.minimum.at(nearest, self.underlying[open_legs], self.days_to_expiry(today)[open_legs])
+        df["days_to_expiry"] = np.where(nearest == np.iinfo(np.int64).max, -1, nearest)
+        return df
+
+    def total(self, column) -> float:
+        return float(self.totals[AGGREGATE_COLUMNS.index(column)])
+
+
+class Portfolio:
+    """position table by conId with running aggregates per underlying
+
+    updatePortfolio (reqAccountUpdates) brings positions, prices and market
+    values, pnlSingle (one reqPnLSingle per conId, sent from a worker thread)
+    brings the daily and unrealized P&L as they change.
+
+    With `limits`, submit_order calls check before sending an order so the
+    book never goes over them. Only positions count: orders still working
+    do not, and orders that reduce exposure always pass.
+    """
+
+    def __init__(self, app, account=None, limits: Limits = None, capacity: int = 1024):
+        self.app = app
+        self.account = account
+        self.limits = limits
+        self.size = 0
+        self.con_ids = np.zeros(capacity, dtype=np.int64)
+        self.underlying = np.zeros(capacity, dtype=np.int32)
+        self.rights = np.zeros(capacity, dtype=np.int8)
+        self.expiries = np.full(capacity, -1, dtype=np.int64)
+        self.values = np.zeros((capacity, len(VALUE_COLUMNS)), dtype=np.float64)
+        self.aggregates = np.zeros((64, len(AGGREGATE_COLUMNS)), dtype=np.float64)
+        self.totals = np.zeros(len(AGGREGATE_COLUMNS), dtype=np.float64)
+        self.rows = {}  # conId -> row
+        self.symbols = []  # underlying id -> symbol
+        self.underlyings = {}  # symbol -> underlying id
+        self.pnl_requests = {}  # reqId of reqPnLSingle -> row
+        self.ready = threading.Event()
+        self._version = 0
+        self._subscriptions = queue.Queue()
+        self._worker = None
+
+    def start(self, timeout: float = 10):
+        """subscribes to the account updates and waits for the first full download"""
+        self.account = self.account or self.app.accounts[0]
+        self.app.portfolio = self
+        self._worker = threading.Thread(target=self._subscribe_pnl, daemon=True)
+        self._worker.start()
+        self.app.pacer.wait()
+        self.app.reqAccountUpdates(True, self.account)
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f"portfolio of {self.account} not received after {timeout}s")
+        return self
+
+    def stop(self):
+        self.app.pacer.wait()
+        self.app.reqAccountUpdates(False, self.account)
+        self._subscriptions.put(None)
+        for req_id in list(self.pnl_requests):
+            self.app.pacer.wait()
+            self.app.cancelPnLSingle(req_id)
+        self.pnl_requests.clear()
+        if self.app.portfolio is self:
+            self.app.portfolio = None
+
+    def _subscribe_pnl(self):
+        while True:
+            row = self._subscriptions.get()
+            if row is None:
+                return
+            req_id = self.app.next_request_id()
+            self.pnl_requests[req_id] = row
+            self.app.pacer.wait()
+            self.app.reqPnLSingle(req_id, self.account, "", int(self.con_ids[row]))
+
+    def _grow(self):
+        capacity = 2 * len(self.con_ids)
+        for name in ("con_ids", "underlying", "rights", "expiries", "values"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _underlying_id(self, symbol) -> int:
+        underlying = self.underlyings.get(symbol)
+        if underlying is None:
+            underlying = self.underlyings[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            if underlying == len(self.aggregates):
+                aggregates = np.zeros((2 * len(self.aggregates), len(AGGREGATE_COLUMNS)), dtype=np.float64)
+                aggregates[:underlying] = self.aggregates
+                self.aggregates = aggregates
+        return underlying
+
+    def _add_row(self, contract) -> int:
+        if self.size == len(self.con_ids):
+            self._grow()
+        row = self.size
+        self.con_ids[row] = contract.conId
+        self.underlying[row] = self._underlying_id(contract.symbol)
+        self.rights[row] = RIGHTS.get((contract.right or "")[:1].upper(), 0) if contract.secType == "OPT" else 0
+        self.expiries[row] = expiry_days(contract.lastTradeDateOrContractMonth)
+        self.values[row, STRIKE] = contract.strike or 0.0
+        self.values[row, MULTIPLIER] = contract_multiplier(contract)
+        self.size += 1
+        self.rows[contract.conId] = row
+        self._subscriptions.put(row)
+        return row
+
+    def _contribution(self, row):
+        values = self.values[row]
+        position = values[POSITION]
+        notional = values[STRIKE] * values[MULTIPLIER] * -position if self.rights[row] and position < 0 else 0.0
+        return notional, values[UNREALIZED], values[DAILY], values[MARKET_VALUE], 1.0 if position else 0.0
+
+    def _update(self, row, changes):
+        """writes (column, value) pairs of a row and moves its contribution to the aggregates"""
+        self._version += 1
+        before = self._contribution(row)
+        for column, value in changes:
+            if value != UNSET:
+                self.values[row, column] = value
+        delta = np.subtract(self._contribution(row), before)
+        self.aggregates[self.underlying[row]] += delta
+        self.totals += delta
+        self._version += 1
+
+    def on_portfolio(self, contract, position, market_price, market_value, avg_cost, unrealized, realized, account):
+        if account != self.account:
+            return
+        row = self.rows.get(contract.conId)
+        if row is None:
+            self._version += 1
+            row = self._add_row(contract)
+            self._version += 1
+        self._update(row, (
+            (POSITION, float(position)), (MARKET_PRICE, market_price), (MARKET_VALUE, market_value),
+            (AVG_COST, avg_cost), (UNREALIZED, unrealized), (REALIZED, realized),
+        ))
+
+    def on_pnl(self, req_id, position, daily, unrealized, realized, value):
+        row = self.pnl_requests.get(req_id)
+        if row is not None:
+            self._update(row, (
+                (POSITION, float(position)), (DAILY, daily), (UNREALIZED, unrealized), (REALIZED, realized),
+                (MARKET_VALUE, value),
+            ))
+
+    def on_download_end(self, account):
+        if account == self.account:
+            self.ready.set()
+
+    def snapshot(self) -> PortfolioSnapshot:
+        """a copy of the table consistent with itself, never blocks the reader thread"""
+        while True:
+            version = self._version
+            if version & 1:
+                time.sleep(0)
+                continue
+            size, count = self.size, len(self.symbols)
+            snapshot = PortfolioSnapshot(
+                self.con_ids[:size].copy(), self.symbols[:count], self.underlying[:size].copy(),
+                self.rights[:size].copy(), self.expiries[:size].copy(), self.values[:size].copy(),
+                self.aggregates[:count].copy(), self.totals.copy(),
+            )
+            if self._version == version:
+                return snapshot
+
+    def exposure(self, symbol=None) -> float:
+        """notional of the short options of an underlying, or of the whole book"""
+        if symbol is None:
+            return float(self.totals[NOTIONAL])
+        underlying = self.underlyings.get(symbol)
+        return 0.0 if underlying is None else float(self.aggregates[underlying, NOTIONAL])
+
+    def check(self, contract, order):
+        """raises GuardrailError if the order would take the book over the limits"""
+        limits = self.limits
+        added = order_notional(contract, order)
+        if limits is None or added <= 0:
+            return
+        symbol = contract.symbol
+        if limits.max_daily_loss is not None and -self.totals[AGG_DAILY] >= limits.max_daily_loss:
+            raise GuardrailError(symbol, f"daily loss {-self.totals[AGG_DAILY]:.2f} reached the limit")
+        if limits.max_notional is not None and self.exposure() + added > limits.max_notional:
+            raise GuardrailError(symbol, f"notional {self.exposure() + added:.0f} over {limits.max_notional}")
+        if limits.max_underlying_notional is not None and \
+                self.exposure(symbol) + added > limits.max_underlying_notional:
+            raise GuardrailError(
+                symbol, f"notional {self.exposure(symbol) + added:.0f} over {limits.max_underlying_notional}"
+            )
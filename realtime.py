@@ -0,0 +1,292 @@
+"""streaming bars of many symbols with rolling indicators
+
+    streams = RealTimeBars(app)
+    for ticker in tickers:
+        streams.subscribe(make_stock(ticker))            # 5 second bars, reqRealTimeBars
+    streams.subscribe(make_stock("SPY"), "1 min")        # reqHistoricalData with keepUpToDate
+    ...
+    print(streams.snapshot())
+
+Every symbol keeps its last `capacity` bars in a NumPy ring buffer and its
+indicators (session VWAP, EMA, ATR, realized volatility) as running sums, so
+a bar costs the same on the reader thread however long the stream has run
+and memory does not grow.
+"""
+import math
+import threading
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from bars import BAR_COLUMNS
+
+DEFAULT_CAPACITY = 4096
+EMA_SPAN = 20
+ATR_PERIOD = 14
+VOLATILITY_WINDOW = 60
+TRADING_SECONDS_PER_YEAR = 252 * 6.5 * 3600
+EXCHANGE_TIMEZONE = ZoneInfo("America/New_York")  # VWAP sessions follow the exchange's date
+
+# bar size -> seconds, "5 secs" is the only size reqRealTimeBars sends
+BAR_SECONDS = {
+    "5 secs": 5, "10 secs": 10, "15 secs": 15, "30 secs": 30, "1 min": 60, "2 mins": 120, "3 mins": 180,
+    "5 mins": 300, "15 mins": 900, "30 mins": 1800, "1 hour": 3600, "1 day": 6.5 * 3600,
+}
+
+
+def bar_time(value) -> int:
+    """epoch seconds of a bar, from reqRealTimeBars or from reqHistoricalData with formatDate=2"""
+    if isinstance(value, str) and len(value) == 8:  # daily bars always come as YYYYMMDD
+        return int(datetime.strptime(value, "%Y%m%d").replace(tzinfo=timezone.utc).timestamp())
+    return int(value)
+
+
+def session_day(timestamp, tz=EXCHANGE_TIMEZONE) -> int:
+    """day number of the exchange-local date of a bar, extended hours bars stay in their session"""
+    return datetime.fromtimestamp(timestamp, tz).toordinal()
+
+
+class BarStream:
+    """the last `capacity` bars of one symbol and its indicators
+
+    Bars go into preallocated arrays, the oldest one is overwritten once they
+    are full. A bar with the same time as the last one replaces it, that is
+    how keepUpToDate reports the bar still being built.
+
+    Indicators are kept up to date with every bar: the state of the finished
+    bars is a few running sums, the value shown also includes the last bar.
+    """
+
+    __slots__ = (
+        "symbol", "bar_seconds", "req_id", "times", "values", "start", "size", "_lock", "tz", "_last_session",
+        "ema_alpha", "atr_period", "volatility_window", "annualize",
+        "_prev_close", "_ema", "_atr", "_atr_sum", "_tr_count", "_session", "_pv", "_volume",
+        "_returns", "_return_sum", "_return_sum_sq", "_return_count", "_return_pos",
+        "vwap", "ema", "atr", "volatility", "updated",
+    )
+
+    def __init__(self, symbol, bar_seconds=5, capacity=DEFAULT_CAPACITY, ema_span=EMA_SPAN, atr_period=ATR_PERIOD,
+                 volatility_window=VOLATILITY_WINDOW, tz=EXCHANGE_TIMEZONE):
+        self.symbol = symbol
+        self.bar_seconds = bar_seconds
+        self.req_id = None
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, len(BAR_COLUMNS)), dtype=np.float64)
+        self.start = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        self.tz = tz
+        self._last_session = None  # session of the last bar
+        self.ema_alpha = 2 / (ema_span + 1)
+        self.atr_period = atr_period
+        self.volatility_window = volatility_window
+        self.annualize = math.sqrt(TRADING_SECONDS_PER_YEAR / bar_seconds)
+        # state of the finished bars
+        self._prev_close = None
+        self._ema = None
+        self._atr = None
+        self._atr_sum = 0.0  # true ranges until there are atr_period of them
+        self._tr_count = 0
+        self._session = None
+        self._pv = 0.0
+        self._volume = 0.0
+        self._returns = np.zeros(volatility_window, dtype=np.float64)
+        self._return_sum = 0.0
+        self._return_sum_sq = 0.0
+        self._return_count = 0
+        self._return_pos = 0
+        # values including the last bar
+        self.vwap = self.ema = self.atr = self.volatility = None
+        self.updated = None
+
+    def __len__(self):
+        return self.size
+
+    def _last_index(self):
+        return (self.start + self.size - 1) % len(self.times)
+
+    def _true_range(self, high, low) -> float:
+        if self._prev_close is None:
+            return high - low
+        return max(high - low, abs(high - self._prev_close), abs(low - self._prev_close))
+
+    def _return(self, close) -> float:
+        return math.log(close / self._prev_close) if self._prev_close and close > 0 else None
+
+    def _finish(self, session, high, low, close, volume):
+        """folds the last bar into the running state, it will not change any more"""
+        self._ema = close if self._ema is None else self._ema + self.ema_alpha * (close - self._ema)
+
+        true_range = self._true_range(high, low)
+        self._tr_count += 1
+        if self._tr_count < self.atr_period:
+            self._atr_sum += true_range
+        elif self._tr_count == self.atr_period:
+            self._atr = (self._atr_sum + true_range) / self.atr_period
+        else:  # Wilder's smoothing
+            self._atr += (true_range - self._atr) / self.atr_period
+
+        if session != self._session:
+            self._session, self._pv, self._volume = session, 0.0, 0.0
+        self._pv += (high + low + close) / 3 * volume
+        self._volume += volume
+
+        log_return = self._return(close)
+        if log_return is not None:
+            if self._return_count == self.volatility_window:
+                oldest = self._returns[self._return_pos]
+                self._return_sum -= oldest
+                self._return_sum_sq -= oldest * oldest
+            else:
+                self._return_count += 1
+            self._returns[self._return_pos] = log_return
+            self._return_pos = (self._return_pos + 1) % self.volatility_window
+            self._return_sum += log_return
+            self._return_sum_sq += log_return * log_return
+        self._prev_close = close
+
+    def _show(self, session, high, low, close, volume):
+        """indicator values of the finished bars plus the last one"""
+        self.ema = close if self._ema is None else self._ema + self.ema_alpha * (close - self._ema)
+
+        true_range = self._true_range(high, low)
+        if self._atr is None:
+            self.atr = (self._atr_sum + true_range) / (self._tr_count + 1)
+        else:
+            self.atr = self._atr + (true_range - self._atr) / self.atr_period
+
+        typical = (high + low + close) / 3
+        pv, total = (self._pv, self._volume) if session == self._session else (0.0, 0.0)
+        total += volume
+        self.vwap = (pv + typical * volume) / total if total > 0 else typical
+
+        log_return = self._return(close)
+        count, total, total_sq = self._return_count, self._return_sum, self._return_sum_sq
+        if log_return is not None:
+            if count == self.volatility_window:
+                oldest = self._returns[self._return_pos]
+                total, total_sq = total - oldest, total_sq - oldest * oldest
+            else:
+                count += 1
+            total, total_sq = total + log_return, total_sq + log_return * log_return
+        if count > 1:
+            variance = max(0.0, (total_sq - total * total / count) / (count - 1))
+            self.volatility = math.sqrt(variance) * self.annualize
+        else:
+            self.volatility = None
+
+    def on_bar(self, timestamp, open_, high, low, close, volume):
+        """adds a bar, or replaces the last one if it has the same time"""
+        timestamp = bar_time(timestamp)
+        volume = float(volume)
+        session = session_day(timestamp, self.tz)
+        with self._lock:
+            if self.size and timestamp == self.times[self._last_index()]:
+                index = self._last_index()
+            else:
+                if self.size:
+                    last = self.values[self._last_index()]
+                    self._finish(self._last_session, last[1], last[2], last[3], last[4])
+                if self.size == len(self.times):
+                    index = self.start
+                    self.start = (self.start + 1) % len(self.times)
+                else:
+                    index = (self.start + self.size) % len(self.times)
+                    self.size += 1
+            self.times[index] = timestamp
+            self.values[index] = (open_, high, low, close, volume)
+            self._show(session, high, low, close, volume)
+            self._last_session = session
+            self.updated = timestamp
+
+    def indicators(self) -> dict:
+        with self._lock:
+            close = self.values[self._last_index(), 3] if self.size else None
+            return {
+                "symbol": self.symbol, "time": self.updated, "close": close, "vwap": self.vwap,
+                "ema": self.ema, "atr": self.atr, "volatility": self.volatility,
+            }
+
+    def bars(self, last: int = None) -> pd.DataFrame:
+        """a copy of the bars in the buffer, oldest first, indexed by Date"""
+        with self._lock:
+            count = self.size if last is None else min(last, self.size)
+            order = (self.start + np.arange(self.size - count, self.size)) % len(self.times)
+            times, values = self.times[order], self.values[order]
+        return pd.DataFrame(
+            values, index=pd.Index(pd.to_datetime(times, unit="s", utc=True), name="Date"), columns=BAR_COLUMNS,
+        )
+
+
+class RealTimeBars:
+    """streams bars of many contracts into BarStreams, keyed by symbol
+
+    "5 secs" bars come from reqRealTimeBars. Other bar sizes come from
+    reqHistoricalData with keepUpToDate, which first sends `duration` of past
+    bars so the indicators start warm. Each subscription takes a market data
+    line at IB.
+    """
+
+    def __init__(self, app, capacity=DEFAULT_CAPACITY, what_to_show="TRADES", use_rth=False, **indicator_options):
+        self.app = app
+        self.capacity = capacity
+        self.what_to_show = what_to_show
+        self.use_rth = use_rth
+        self.indicator_options = indicator_options
+        self.streams = {}  # symbol -> BarStream
+
+    def subscribe(self, contract, bar_size="5 secs", duration="1 D", key=None) -> BarStream:
+        key = key or contract.localSymbol or contract.symbol
+        if key in self.streams:
+            return self.streams[key]
+        stream = BarStream(key, BAR_SECONDS[bar_size], self.capacity, **self.indicator_options)
+        stream.req_id = self.app.next_request_id()
+        self.app.bar_handlers[stream.req_id] = stream.on_bar
+        self.streams[key] = stream
+        self.app.pacer.wait()
+        if bar_size == "5 secs":
+            self.app.reqRealTimeBars(stream.req_id, contract, 5, self.what_to_show, self.use_rth, [])
+        else:
+            self.app.reqHistoricalData(
+                reqId=stream.req_id,
+                contract=contract,
+                endDateTime="",
+                durationStr=duration,
+                barSizeSetting=bar_size,
+                whatToShow=self.what_to_show,
+                useRTH=int(self.use_rth),
+                formatDate=2,  # epoch seconds
+                keepUpToDate=True,
+                chartOptions=[],
+            )
+        return stream
+
+    def subscribe_many(self, contracts, bar_size="5 secs", duration="1 D") -> list:
+        return [self.subscribe(contract, bar_size, duration) for contract in contracts]
+
+    def unsubscribe(self, key):
+        stream = self.streams.pop(key, None)
+        if stream is None:
+            return
+        self.app.bar_handlers.pop(stream.req_id, None)
+        self.app.pacer.wait()
+        if stream.bar_seconds == 5:
+            self.app.cancelRealTimeBars(stream.req_id)
+        else:
+            self.app.cancelHistoricalData(stream.req_id)
+
+    def close(self):
+        for key in list(self.streams):
+            self.unsubscribe(key)
+
+    def __getitem__(self, key) -> BarStream:
+        return self.streams[key]
+
+    def snapshot(self) -> pd.DataFrame:
+        """the last close and indicators of every symbol"""
+        return pd.DataFrame.from_records(
+            [stream.indicators() for stream in list(self.streams.values())],
+            columns=["symbol", "time", "close", "vwap", "ema", "atr", "volatility"],
+        )
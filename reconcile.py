@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+from orders import DONE_STATUSES, ORDER_REF, submit_order
+
+POSITION_KEY = ["symbol", "expiry", "strike", "right"]
+
+
+class WorkingOrder:
+    """an order already working at IB
+
+    An unconfirmed order was sent but TWS never acknowledged it, see OrderJournal.unconfirmed_orders.
+    """
+
+    __slots__ = ("order_id", "client_id", "contract", "order", "confirmed")
+
+    def __init__(self, contract, order, confirmed=True):
+        self.order_id = order.orderId
+        self.client_id = order.clientId
+        self.contract = contract
+        self.order = order
+        self.confirmed = confirmed
+
+
+class OrderDiff:
+    """what has to change at IB so the working orders match the plan"""
+
+    def __init__(self):
+        self.place = []  # (contract, order)
+        self.modify = []  # (order id, contract, order)
+        self.cancel = []  # order ids
+        self.unchanged = 0
+
+    def __bool__(self):
+        return bool(self.place or self.modify or self.cancel)
+
+    def __str__(self):
+        return (
+            f"{len(self.place)} to place, {len(self.modify)} to modify, "
+            f"{len(self.cancel)} to cancel, {self.unchanged} unchanged"
+        )
+
+
+def order_key(contract, order):
+    return contract.conId, order.action
+
+
+def index_working_orders(open_orders, account=None) -> dict:
+    """working orders from TradeApp.request_open_orders, keyed by (conId, action)"""
+    index = {}
+    for contract, order, state in open_orders.values():
+        if state.status in DONE_STATUSES or (account and order.account != account):
+            continue
+        index.setdefault(order_key(contract, order), []).append(WorkingOrder(contract, order))
+    return index
+
+
+def _sort_key(order):
+    return order.goodAfterTime, order.goodTillDate, order.orderType, order.lmtPrice
+
+
+def same_order(working, desired) -> bool:
+    return (
+        working.orderType == desired.orderType
+        and float(working.totalQuantity) == float(desired.totalQuantity)
+        and (desired.orderType == "MKT" or abs(working.lmtPrice - desired.lmtPrice) < 1e-9)
+        and working.goodAfterTime == desired.goodAfterTime
+        and working.goodTillDate == desired.goodTillDate
+    )
+
+
+def diff_orders(desired, index, client_id, cancel_unplanned=True) -> OrderDiff:
+    """minimal set of changes turning the working orders in `index` into `desired`
+
+    desired is a list of (qualified contract, order). Orders for the same
+    (conId, action) are paired in time window order. Working orders of other
+    clients cannot be modified, they only keep us from placing duplicates.
+    Unconfirmed orders are sent again under the same id even if unchanged.
+    Our own orders (orderRef) for contracts no longer planned are cancelled,
+    unless cancel_unplanned is False because `desired` only covers some positions.
+    """
+    diff = OrderDiff()
+    wanted = {}
+    for contract, order in desired:
+        wanted.setdefault(order_key(contract, order), []).append((contract, order))
+
+    for key, orders in wanted.items():
+        orders.sort(key=lambda pair: _sort_key(pair[1]))
+        working = sorted(index.get(key, []), key=lambda w: _sort_key(w.order))
+        for i, (contract, order) in enumerate(orders):
+            if i >= len(working):
+                diff.place.append((contract, order))
+            elif working[i].confirmed and same_order(working[i].order, order):
+                diff.unchanged += 1
+            elif working[i].client_id == client_id:
+                diff.modify.append((working[i].order_id, contract, order))
+            else:
+                print(f"{contract.localSymbol or contract.symbol}: working order of client "
+                      f"{working[i].client_id} differs from the plan, leaving it")
+                diff.unchanged += 1
+        for extra in working[len(orders):]:
+            if extra.order.orderRef == ORDER_REF and extra.client_id == client_id:
+                diff.cancel.append(extra.order_id)
+
+    for key, working in index.items():
+        if key in wanted or not cancel_unplanned:
+            continue
+        for extra in working:
+            if extra.order.orderRef == ORDER_REF and extra.client_id == client_id:
+                diff.cancel.append(extra.order_id)
+    return diff
+
+
+def apply_diff(app, diff: OrderDiff) -> list:
+    """sends only the changes, returns the handles of placed and modified orders
+
+    With a journal the new orders are recorded as planned before the first one is sent.
+    """
+    placed = [(app.nextOrderId(), contract, order) for contract, order in diff.place]
+    if app.journal is not None and placed:
+        app.journal.planned(placed)
+    handles = [submit_order(app, order_id, contract, order) for order_id, contract, order in placed + diff.modify]
+    for order_id in diff.cancel:
+        app.pacer.wait()
+        app.cancelOrder(order_id, "")
+        if app.journal is not None:
+            app.journal.cancelled(order_id)
+    return handles
+
+
+def live_short_options(positions_df: pd.DataFrame) -> pd.DataFrame:
+    """contracts short at the broker per (symbol, expiry, strike, right), from TradeApp.positions_df"""
+    options = positions_df[positions_df["SecType"] == "OPT"]
+    live = pd.DataFrame({
+        "symbol": options["Symbol"],
+        "expiry": options["LastTradeDateOrContractMonth"].astype(str).str[:8],
+        "strike": options["Strike"].astype(float),
+        "right": options["Right"].str[0].str.upper(),
+        "live_short": -options["Position"].astype(float),
+    })
+    return live.groupby(POSITION_KEY, as_index=False)["live_short"].sum()
+
+
+def check_positions(positions: pd.DataFrame, positions_df: pd.DataFrame, account=None) -> pd.DataFrame:
+    """keeps only the tracker/sheet positions that are still open at the broker
+
+    The positions are joined with the live ones in one hash merge on
+    (symbol, expiry, strike, right). Positions already assigned, expired or
+    closed are dropped, and the contracts of a position are capped to what
+    is still short at the broker so closing never opens a long position.
+    With `account` only the live positions of that account count.
+    """
+    if account:
+        positions_df = positions_df[positions_df["Account"] == account]
+    live = live_short_options(positions_df)
+    checked = positions.assign(right=positions["right"].str[0].str.upper()).merge(
+        live, on=POSITION_KEY, how="left", validate="many_to_one"
+    )
+    checked["live_short"] = checked["live_short"].fillna(0).clip(lower=0)
+    # several rows can share a contract, the earlier ones get the live contracts first
+    before = checked.groupby(POSITION_KEY)["num_contracts"].cumsum() - checked["num_contracts"]
+    allowed = np.clip(checked["live_short"] - before, 0, checked["num_contracts"]).astype(int)
+
+    for row in checked[allowed < checked["num_contracts"]].itertuples(index=False):
+        print(f"{row.symbol} {row.expiry} {row.strike} {row.right}: {row.num_contracts} in the tracker, "
+              f"{row.live_short:g} short at the broker")
+    checked["num_contracts"] = allowed
+    return checked[checked["num_contracts"] > 0].drop(columns="live_short").reset_index(drop=True)
@@ -0,0 +1,53 @@
+import pandas as pd
+
+POSITION_COLUMNS = [
+    "ConId", "LastTradeDateOrContractMonth", "Position", "Account", "Symbol", "Avg cost",
+    "SecType", "Currency", "Strike", "Right", "TradingClass",
+]
+OPTION_CHAIN_COLUMNS = ["reqId", "Exchange", "UnderlyingConId", "Symbol", "Multiplier", "Expiry", "Strike"]
+
+
+class PositionRecord:
+    """one position as reported by TWS, cheap to create in the position callback"""
+
+    __slots__ = ("account", "contract", "position", "avg_cost")
+
+    def __init__(self, account, contract, position, avg_cost):
+        self.account = account
+        self.contract = contract
+        self.position = position
+        self.avg_cost = avg_cost
+
+    def as_row(self):
+        contract = self.contract
+        return (
+            contract.conId, contract.lastTradeDateOrContractMonth, self.position, self.account,
+            contract.symbol, self.avg_cost, contract.secType, contract.currency, contract.strike,
+            contract.right, contract.tradingClass,
+        )
+
+
+class OptionChainRecord:
+    """expirations and strikes one exchange lists for an underlying"""
+
+    __slots__ = ("req_id", "exchange", "underlying_con_id", "trading_class", "multiplier", "expirations", "strikes")
+
+    def __init__(self, req_id, exchange, underlying_con_id, trading_class, multiplier, expirations, strikes):
+        self.req_id = req_id
+        self.exchange = exchange
+        self.underlying_con_id = underlying_con_id
+        self.trading_class = trading_class
+        self.multiplier = multiplier
+        self.expirations = expirations
+        self.strikes = strikes
+
+    def as_row(self):
+        return (
+            self.req_id, self.exchange, self.underlying_con_id, self.trading_class,
+            self.multiplier, self.expirations, self.strikes,
+        )
+
+
+def records_to_frame(records, columns) -> pd.DataFrame:
+    """builds a DataFrame from the records in a single pass"""
+    return pd.DataFrame.from_records([record.as_row() for record in records], columns=columns)
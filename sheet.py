@@ -0,0 +1,182 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+SHEET_PATH = os.environ.get("AQUILES_SHEET_PATH", "~/Downloads/Options trading Aquiles Invierto - Sheet1.csv")
+HEADER_ROW = 2  # the export starts with two lines of titles
+DEFAULT_SNAPSHOT_DIR = os.path.expanduser("~/.aquiles/sheets")
+# days since open at which the buy price of a position changes, see options.TIER_WINDOWS
+TIER_STARTS = (1, 8)
+
+# sheet column -> (name we use, dtype), the only columns read
+SHEET_COLUMNS = {
+    "Ticker": ("ticker", "string"),  # "SYM Mon DD'YY strike P price"
+    "Ticker.1": ("symbol", "string"),  # the second column titled Ticker holds the underlying
+    "Days since open": ("days_since_open", "float64"),
+    "Num Contratos": ("num_contracts", "float64"),
+    "Status": ("status", "string"),
+}
+OPTIONAL_COLUMNS = {
+    "Account": ("account", "string"),
+}
+
+TICKER_PATTERN = (
+    r"^\s*\S+\s+(?P<expiry>\S+)\s+(?P<strike>\S+)\s+(?P<right>\S+)\s+(?:.*\s)?(?P<sell_price>\S+)\s*$"
+)
+
+
+def read_sheet(path=SHEET_PATH, header_row=HEADER_ROW) -> pd.DataFrame:
+    """the open rows of the export, only the columns in SHEET_COLUMNS with their dtypes"""
+    path = os.path.expanduser(path)
+    header = pd.read_csv(path, header=header_row, nrows=0).columns
+    missing = [column for column in SHEET_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"{path} has no column {', '.join(missing)}")
+    wanted = {**SHEET_COLUMNS, **{c: spec for c, spec in OPTIONAL_COLUMNS.items() if c in header}}
+    # columns are read by position, duplicated titles like Ticker cannot be told apart by name
+    positions = sorted((header.get_loc(column), name, dtype) for column, (name, dtype) in wanted.items())
+    df = pd.read_csv(
+        path,
+        header=header_row,
+        usecols=[position for position, _, _ in positions],
+        names=[name for _, name, _ in positions],
+        dtype={name: dtype for _, name, dtype in positions},
+        thousands=",",
+    )
+    return df[df["status"].eq("O").fillna(False).astype(bool)]  # only open positions
+
+
+def parse_positions(df: pd.DataFrame) -> pd.DataFrame:
+    """positions from the rows of read_sheet, the Ticker column is parsed with one regex"""
+    ticker = df["ticker"].str.extract(TICKER_PATTERN)
+    unparsed = ticker["expiry"].isna()
+    if unparsed.any():
+        print(f"skipping {unparsed.sum()} rows with an unexpected Ticker: {df.loc[unparsed, 'ticker'].tolist()[:5]}")
+        df, ticker = df[~unparsed], ticker[~unparsed]
+    positions = pd.DataFrame({
+        "symbol": df["symbol"].str.strip().astype(object),
+        "expiry": pd.to_datetime(ticker["expiry"], format="%b%d'%y").dt.strftime("%Y%m%d"),
+        "strike": ticker["strike"].astype(np.float64),
+        "right": ticker["right"].astype(object),
+        "sell_price": ticker["sell_price"].astype(np.float64),
+        "days_since_open": df["days_since_open"].astype(int),
+        "num_contracts": df["num_contracts"].abs().astype(int),
+    })
+    if "account" in df:
+        positions["account"] = df["account"].str.strip().astype(object)
+    return positions.reset_index(drop=True)
+
+
+def read_sheet_positions(path=SHEET_PATH, header_row=HEADER_ROW) -> pd.DataFrame:
+    return parse_positions(read_sheet(path, header_row))
+
+
+def snapshot_path_for(path, directory=DEFAULT_SNAPSHOT_DIR) -> str:
+    """one snapshot per sheet, named after its absolute path"""
+    name = hashlib.sha1(os.path.abspath(os.path.expanduser(path)).encode()).hexdigest()[:16]
+    return os.path.join(directory, f"{name}.npz")
+
+
+def row_hashes(positions: pd.DataFrame, tier_starts=TIER_STARTS) -> np.ndarray:
+    """hash of what the plan of each position depends on
+
+    days_since_open grows every day, only its buy price tier is hashed so an
+    export of the next day does not plan every position again.
+    """
+    columns = ["symbol", "expiry", "strike", "right", "sell_price", "num_contracts"]
+    if "account" in positions:
+        columns.append("account")
+    inputs = positions[columns].assign(
+        tier=np.searchsorted(np.asarray(tier_starts), positions["days_since_open"].to_numpy(), side="right"),
+    )
+    return pd.util.hash_pandas_object(inputs, index=False).to_numpy()
+
+
+class SheetWatcher:
+    """notices new exports of the sheet and returns only the positions that changed
+
+    The file is checked by modification time and size, then by a digest of its
+    bytes, so polling an unchanged export costs a stat call. Rows are compared
+    with the last snapshot by hash, the snapshot of every sheet is kept on disk
+    so a restart does not plan every position again.
+
+    The snapshot only moves forward on commit, once the changed positions were
+    handled. Until then every poll returns them again, so a failed run is retried.
+
+        watcher = SheetWatcher()
+        while True:
+            positions = watcher.poll()
+            if positions is not None and close(positions):
+                watcher.commit()
+            time.sleep(5)
+    """
+
+    def __init__(self, path=SHEET_PATH, header_row=HEADER_ROW, snapshot_path=None, tier_starts=TIER_STARTS):
+        self.path = os.path.expanduser(path)
+        self.header_row = header_row
+        self.snapshot_path = snapshot_path or snapshot_path_for(self.path)
+        self.tier_starts = tier_starts
+        self._stat = None
+        self.digest, self.hashes = self._load_snapshot()
+        self._pending = None  # (stat, digest, hashes) of the export returned by poll, until commit
+
+    def _load_snapshot(self):
+        try:
+            with np.load(self.snapshot_path, allow_pickle=False) as snapshot:
+                return str(snapshot["digest"]), snapshot["hashes"]
+        except (FileNotFoundError, KeyError, ValueError):
+            return None, np.empty(0, dtype=np.uint64)
+
+    def _save_snapshot(self):
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        tmp = self.snapshot_path + ".tmp.npz"
+        np.savez(tmp, digest=np.asarray(self.digest), hashes=self.hashes)
+        os.replace(tmp, self.snapshot_path)
+
+    def poll(self):
+        """positions new or changed since the last committed export, None if the file did not change"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if self._stat == stat:
+            return None
+        with open(self.path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        if digest == self.digest:
+            self._stat = stat
+            return None
+
+        positions = read_sheet_positions(self.path, self.header_row)
+        hashes = row_hashes(positions, self.tier_starts)
+        self._pending = (stat, digest, hashes)
+        return positions[~np.isin(hashes, self.hashes)].reset_index(drop=True)
+
+    def commit(self):
+        """records the export of the last poll as handled"""
+        if self._pending is None:
+            return
+        self._stat, self.digest, self.hashes = self._pending
+        self._pending = None
+        self._save_snapshot()
+
+    def watch(self, interval: float = 5, stop=None):
+        """yields the new or changed positions of every new export until stop is set
+
+        The caller calls commit once it handled them, otherwise they are yielded again.
+        """
+        while stop is None or not stop.is_set():
+            positions = self.poll()
+            if positions is not None:
+                if len(positions):
+                    yield positions
+                else:  # only rows removed, nothing to do
+                    self.commit()
+            if stop is None:
+                time.sleep(interval)
+            else:
+                stop.wait(interval)
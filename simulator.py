@@ -0,0 +1,344 @@
+import heapq
+import itertools
+import math
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timedelta
+
+# the simulator speaks the text protocol of this TWS server version
+SERVER_VERSION = 151
+
+# incoming message ids, see ibapi.message.OUT
+REQ_MKT_DATA = 1
+CANCEL_MKT_DATA = 2
+PLACE_ORDER = 3
+CANCEL_ORDER = 4
+REQ_OPEN_ORDERS = 5
+REQ_IDS = 8
+REQ_CONTRACT_DATA = 9
+REQ_ALL_OPEN_ORDERS = 16
+REQ_HISTORICAL_DATA = 20
+REQ_POSITIONS = 61
+START_API = 71
+
+# outgoing message ids, see ibapi.message.IN
+TICK_PRICE = 1
+ORDER_STATUS = 3
+ERR_MSG = 4
+NEXT_VALID_ID = 9
+MANAGED_ACCTS = 15
+HISTORICAL_DATA = 17
+OPEN_ORDER_END = 53
+POSITION_DATA = 61
+POSITION_END = 62
+
+BID, ASK = 1, 2  # tick types, see ibapi.ticktype.TickTypeEnum
+
+BAR_SECONDS = {
+    "1 secs": 1, "5 secs": 5, "10 secs": 10, "15 secs": 15, "30 secs": 30, "1 min": 60, "2 mins": 120,
+    "3 mins": 180, "5 mins": 300, "15 mins": 900, "30 mins": 1800, "1 hour": 3600, "1 day": 86400,
+}
+DURATION_SECONDS = {"S": 1, "D": 86400, "W": 7 * 86400, "M": 30 * 86400, "Y": 365 * 86400}
+
+
+def make_msg(*fields) -> bytes:
+    payload = b"".join(str(field).encode() + b"\0" for field in fields)
+    return struct.pack("!I", len(payload)) + payload
+
+
+class SimulatorConfig:
+    """behaviour of the simulated gateway
+
+    ack_latency: seconds between placeOrder and the Submitted status
+    fill_latency: seconds between the ack and the Filled status, None never fills
+    bars_per_request: bars returned by every historical request, None derives it from duration and bar size
+    max_messages_per_second: reject messages above the TWS rate limit, None disables the check
+    """
+
+    def __init__(self, ack_latency=0.0, fill_latency=None, bars_per_request=None, positions=(),
+                 accounts=("DU0000001",), next_order_id=1, max_messages_per_second=50,
+                 max_historical_requests=60, historical_window=600.0):
+        self.ack_latency = ack_latency
+        self.fill_latency = fill_latency
+        self.bars_per_request = bars_per_request
+        self.positions = list(positions)
+        self.accounts = list(accounts)
+        self.next_order_id = next_order_id
+        self.max_messages_per_second = max_messages_per_second
+        self.max_historical_requests = max_historical_requests
+        self.historical_window = historical_window
+
+
+def make_position(symbol, expiry, strike, right, position, avg_cost, account="DU0000001", con_id=0):
+    """a position for SimulatorConfig.positions"""
+    return {
+        "account": account, "con_id": con_id, "symbol": symbol, "sec_type": "OPT", "expiry": expiry,
+        "strike": strike, "right": right, "multiplier": "100", "exchange": "SMART", "currency": "USD",
+        "position": position, "avg_cost": avg_cost,
+    }
+
+
+class ClientSession:
+    """one API client connected to the simulator"""
+
+    def __init__(self, gateway, sock):
+        self.gateway = gateway
+        self.config = gateway.config
+        self.sock = sock
+        self.client_id = None
+        self.stats = gateway.stats
+        self._send_lock = threading.Lock()
+        self._messages = deque()
+        self._historical = deque()
+        self._recent_requests = {}
+        self._perm_ids = itertools.count(1)
+
+    def send(self, *fields):
+        data = make_msg(*fields)
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def later(self, delay, *fields):
+        if delay <= 0:
+            self.send(*fields)
+        else:
+            self.gateway.schedule(time.monotonic() + delay, self, fields)
+
+    def error(self, req_id, code, message):
+        self.send(ERR_MSG, 2, req_id, code, message)
+
+    def _recv_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("client disconnected")
+            data += chunk
+        return data
+
+    def _recv_payload(self):
+        size = struct.unpack("!I", self._recv_exact(4))[0]
+        return self._recv_exact(size)
+
+    def _recv_msg(self):
+        return self._recv_payload().split(b"\0")[:-1]
+
+    def handshake(self):
+        if self._recv_exact(4) != b"API\0":
+            raise ConnectionError("not an API client")
+        # the version range "v100..176" is not null terminated
+        versions = self._recv_payload().decode().split(" ")[0]
+        max_version = int(versions[1:].split("..")[1])
+        if max_version < SERVER_VERSION:
+            raise ConnectionError(f"client supports up to server version {max_version}, need {SERVER_VERSION}")
+        self.send(SERVER_VERSION, datetime.now().strftime("%Y%m%d %H:%M:%S EST"))
+
+    def run(self):
+        try:
+            self.handshake()
+            while True:
+                self.handle([field.decode() for field in self._recv_msg()])
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.sock.close()
+
+    def _over_rate_limit(self):
+        limit = self.config.max_messages_per_second
+        if limit is None:
+            return False
+        now = time.monotonic()
+        self._messages.append(now)
+        while self._messages[0] <= now - 1:
+            self._messages.popleft()
+        return len(self._messages) > limit
+
+    def handle(self, fields):
+        self.stats["messages"] += 1
+        msg_id = int(fields[0])
+        if self._over_rate_limit():
+            self.stats["rate_violations"] += 1
+            self.error(-1, 100, "Max rate of messages per second has been exceeded")
+            return
+        handler = self.HANDLERS.get(msg_id)
+        if handler is not None:
+            handler(self, fields)
+
+    def start_api(self, fields):
+        self.client_id = int(fields[2])
+        self.send(NEXT_VALID_ID, 1, self.gateway.next_order_id())
+        self.send(MANAGED_ACCTS, 1, ",".join(self.config.accounts))
+
+    def req_ids(self, fields):
+        self.send(NEXT_VALID_ID, 1, self.gateway.next_order_id())
+
+    def place_order(self, fields):
+        order_id = int(fields[1])
+        quantity, price = fields[17], fields[19] or "0"
+        self.stats["orders"] += 1
+        perm_id = next(self._perm_ids)
+        ack = self.config.ack_latency
+        self.later(ack, ORDER_STATUS, order_id, "Submitted", 0, quantity, 0, perm_id, 0, 0, self.client_id, "", 0)
+        if self.config.fill_latency is not None:
+            self.later(ack + self.config.fill_latency, ORDER_STATUS, order_id, "Filled", quantity, 0, price,
+                       perm_id, 0, price, self.client_id, "", 0)
+
+    def cancel_order(self, fields):
+        order_id = int(fields[2])
+        self.send(ORDER_STATUS, order_id, "Cancelled", 0, 0, 0, 0, 0, 0, self.client_id, "", 0)
+        self.error(order_id, 202, "Order Canceled - reason:")
+
+    def req_mkt_data(self, fields):
+        req_id, symbol = int(fields[2]), fields[4]
+        mid = round(random.Random(zlib.crc32(symbol.encode())).uniform(1, 100), 2)
+        self.send(TICK_PRICE, 6, req_id, BID, mid - 0.05, 10, 0)
+        self.send(TICK_PRICE, 6, req_id, ASK, mid + 0.05, 10, 0)
+
+    def req_open_orders(self, fields):
+        self.send(OPEN_ORDER_END, 1)
+
+    def req_contract_data(self, fields):
+        self.error(int(fields[2]), 200, "No security definition has been found for the request")
+
+    def req_positions(self, fields):
+        for p in self.config.positions:
+            self.send(
+                POSITION_DATA, 3, p["account"], p["con_id"], p["symbol"], p["sec_type"], p["expiry"], p["strike"],
+                p["right"], p["multiplier"], p["exchange"], p["currency"], "", p["symbol"], p["position"],
+                p["avg_cost"],
+            )
+        self.send(POSITION_END, 1)
+
+    def _historical_pacing_violation(self, key, small_bars):
+        now = time.monotonic()
+        if self._recent_requests.get(key, -math.inf) > now - 15:  # identical request within 15 seconds
+            return True
+        self._recent_requests[key] = now
+        if not small_bars:
+            return False
+        while self._historical and self._historical[0] <= now - self.config.historical_window:
+            self._historical.popleft()
+        if len(self._historical) >= self.config.max_historical_requests:
+            return True
+        self._historical.append(now)
+        return False
+
+    def req_historical_data(self, fields):
+        req_id = int(fields[1])
+        symbol, end, bar_size, duration = fields[3], fields[15], fields[16], fields[17]
+        bar_seconds = BAR_SECONDS.get(bar_size, 60)
+        if self._historical_pacing_violation((symbol, end, bar_size, duration), bar_seconds <= 30):
+            self.stats["pacing_violations"] += 1
+            self.error(req_id, 162, "Historical Market Data Service error message:Historical data request pacing violation")
+            return
+
+        count = self.config.bars_per_request
+        if count is None:
+            amount, unit = duration.split()
+            count = max(1, int(amount) * DURATION_SECONDS[unit] // bar_seconds)
+        end_time = datetime.strptime(end[:17], "%Y%m%d-%H:%M:%S") if end else datetime.now().replace(microsecond=0)
+        date_format = "%Y%m%d" if bar_seconds >= 86400 else "%Y%m%d %H:%M:%S"
+        rng = random.Random(zlib.crc32(symbol.encode()))
+        price = 100.0
+        fields = [HISTORICAL_DATA, req_id, "", "", count]
+        for i in range(count):
+            date = (end_time - timedelta(seconds=bar_seconds * (count - i))).strftime(date_format)
+            close = max(0.01, price * (1 + rng.gauss(0, 0.001)))
+            high, low = max(price, close) * 1.0005, min(price, close) * 0.9995
+            fields += [date, round(price, 4), round(high, 4), round(low, 4), round(close, 4), rng.randint(100, 10000),
+                       round((high + low) / 2, 4), rng.randint(1, 100)]
+            price = close
+        self.stats["bars"] += count
+        self.send(*fields)
+
+    HANDLERS = {
+        START_API: start_api,
+        REQ_MKT_DATA: req_mkt_data,
+        REQ_IDS: req_ids,
+        PLACE_ORDER: place_order,
+        CANCEL_ORDER: cancel_order,
+        REQ_OPEN_ORDERS: req_open_orders,
+        REQ_ALL_OPEN_ORDERS: req_open_orders,
+        REQ_CONTRACT_DATA: req_contract_data,
+        REQ_POSITIONS: req_positions,
+        REQ_HISTORICAL_DATA: req_historical_data,
+    }
+
+
+class GatewaySimulator:
+    """local stand-in for TWS / IB Gateway, good enough for EClient
+
+    Sends nextValidId and managedAccounts on connect, acknowledges (and
+    optionally fills) orders after a configurable latency, serves synthetic
+    bars, one bid and ask per market data request and the configured positions,
+    and enforces the message rate and historical data pacing limits.
+    Contract details are not simulated.
+
+        with GatewaySimulator(SimulatorConfig(ack_latency=0.05)) as gateway:
+            app = start_app(port=gateway.port)
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or SimulatorConfig()
+        self.stats = {"messages": 0, "orders": 0, "bars": 0, "rate_violations": 0, "pacing_violations": 0}
+        self._order_ids = itertools.count(self.config.next_order_id)
+        self._server = socket.create_server((host, port))
+        self.host, self.port = self._server.getsockname()[:2]
+        self._queue = []
+        self._queue_ready = threading.Condition()
+        self._sequence = itertools.count()
+        self._running = False
+
+    def next_order_id(self):
+        return next(self._order_ids)
+
+    def schedule(self, due, session, fields):
+        with self._queue_ready:
+            heapq.heappush(self._queue, (due, next(self._sequence), session, fields))
+            self._queue_ready.notify()
+
+    def _send_scheduled(self):
+        while self._running:
+            with self._queue_ready:
+                while self._running and (not self._queue or self._queue[0][0] > time.monotonic()):
+                    timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                    self._queue_ready.wait(timeout)
+                if not self._running:
+                    return
+                _, _, session, fields = heapq.heappop(self._queue)
+            try:
+                session.send(*fields)
+            except OSError:
+                pass
+
+    def _accept(self):
+        while self._running:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=ClientSession(self, sock).run, daemon=True).start()
+
+    def start(self):
+        self._running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        threading.Thread(target=self._send_scheduled, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._server.close()
+        with self._queue_ready:
+            self._queue_ready.notify_all()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("ibapi")
+
+from ibapi.ticktype import TickTypeEnum  # noqa: E402
+
+from aio import AsyncTradeApp  # noqa: E402
+from orders import make_order  # noqa: E402
+from simulator import GatewaySimulator, SimulatorConfig, make_position  # noqa: E402
+from trade_app import RequestError, make_stock  # noqa: E402
+
+
+def run(gateway, test):
+    """runs test(app) with an AsyncTradeApp connected to the gateway"""
+    async def main():
+        app = await AsyncTradeApp.connect(port=gateway.port, timeout=5)
+        try:
+            return await asyncio.wait_for(test(app), 10)
+        finally:
+            app.disconnect()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def gateway():
+    positions = [make_position("AAPL", "20300118", 150.0, "P", -1, 120.0)]
+    with GatewaySimulator(SimulatorConfig(positions=positions)) as gateway:
+        yield gateway
+
+
+def test_connect(gateway):
+    async def test(app):
+        return app.app.accounts
+
+    assert run(gateway, test) == ["DU0000001"]
+
+
+def test_positions_drop_the_closed_ones(gateway):
+    async def test(app):
+        first = await app.positions()
+        gateway.config.positions = []
+        return first, await app.positions()
+
+    first, second = run(gateway, test)
+    assert first["Symbol"].tolist() == ["AAPL"]
+    assert second.empty
+
+
+def test_open_orders(gateway):
+    async def test(app):
+        return await app.open_orders()
+
+    assert run(gateway, test) == {}
+
+
+def test_historical_bars(gateway):
+    async def test(app):
+        return await app.historical_bars(make_stock("AAPL"), "1 D", "1 hour")
+
+    assert len(run(gateway, test)) == 24
+
+
+def test_contract_details_fail_without_a_definition(gateway):
+    async def test(app):
+        return await app.contract_details(make_stock("AAPL"))
+
+    with pytest.raises(RequestError):
+        run(gateway, test)
+
+
+def test_place_and_cancel_order(gateway):
+    async def test(app):
+        handle = await app.place_order(make_stock("AAPL"), make_order("BUY", 1.0))
+        return handle.status, await app.cancel_order(handle)
+
+    assert run(gateway, test) == ("Submitted", "Cancelled")
+
+
+def test_order_done():
+    async def test(app):
+        handle = await app.place_order(make_stock("AAPL"), make_order("BUY", 1.0))
+        return await app.order_done(handle)
+
+    with GatewaySimulator(SimulatorConfig(fill_latency=0.01)) as gateway:
+        assert run(gateway, test) == "Filled"
+
+
+def test_ticks(gateway):
+    async def test(app):
+        ticks = []
+        async for tick in app.ticks(make_stock("AAPL")):
+            ticks.append(tick)
+            if len(ticks) == 2:
+                return ticks
+
+    (bid_type, bid), (ask_type, ask) = run(gateway, test)
+    assert (bid_type, ask_type) == (TickTypeEnum.BID, TickTypeEnum.ASK)
+    assert ask - bid == pytest.approx(0.1)
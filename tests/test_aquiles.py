@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("ibapi")
+
+from ibapi.contract import Contract  # noqa: E402
+
+import aquiles  # noqa: E402
+import options  # noqa: E402
+from orders import make_order, submit_order  # noqa: E402
+from pacing import Pacer  # noqa: E402
+from portfolio import GuardrailError  # noqa: E402
+
+
+class AccountApp:
+    """just enough of TradeApp for close, the account download ends as soon as it is requested"""
+
+    clientId = 23
+    journal = None
+    accounts = ["DU0000001"]
+
+    def __init__(self):
+        self.portfolio = None
+        self.orders = {}
+        self.placed = []
+        self.pacer = Pacer(rate=1e6)
+        self.disconnected = False
+
+    def reqAccountUpdates(self, subscribe, account):
+        if subscribe:
+            self.portfolio.on_download_end(account)
+
+    def placeOrder(self, order_id, contract, order):
+        self.placed.append(order_id)
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+def make_put(strike):
+    contract = Contract()
+    contract.symbol, contract.secType, contract.strike, contract.right = "AAPL", "OPT", strike, "P"
+    return contract
+
+
+def test_close_checks_orders_against_the_limits(monkeypatch):
+    app = AccountApp()
+    monkeypatch.setattr(aquiles, "connect", lambda args: app)
+    sent = []
+
+    def close_open_positions_csv(app, dry_run, path, tiered=False, exit_after_days=None):
+        sent.append(submit_order(app, 1, make_put(150.0), make_order("BUY", 0.05)))
+        with pytest.raises(GuardrailError):
+            submit_order(app, 2, make_put(150.0), make_order("SELL", 1.0))
+
+    monkeypatch.setattr(options, "close_open_positions_csv", close_open_positions_csv)
+    aquiles.main(["close", "--no-journal", "--max-notional", "10000"])
+
+    assert len(sent) == 1 and app.placed == [1]
+    assert app.portfolio is None and app.disconnected
+
+
+def test_limits_need_a_single_connection(capsys):
+    with pytest.raises(SystemExit):
+        aquiles.main(["close", "--gateways", "gateways.json", "--max-daily-loss", "1000"])
+    assert "--gateways" in capsys.readouterr().err
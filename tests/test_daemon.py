@@ -0,0 +1,197 @@
+import threading
+import time
+import types
+from datetime import date
+
+import pytest
+
+pytest.importorskip("ibapi")
+
+from ibapi.contract import Contract  # noqa: E402
+from ibapi.ticktype import TickTypeEnum  # noqa: E402
+
+from daemon import CloseOutDaemon, WatchedPosition  # noqa: E402
+from orders import make_order  # noqa: E402
+from pacing import Pacer  # noqa: E402
+from reconcile import WorkingOrder  # noqa: E402
+
+
+class RecordingApp:
+    """just enough of TradeApp for the daemon, placeOrder only records the order"""
+
+    clientId = 23
+    journal = None
+    portfolio = None
+
+    def __init__(self):
+        self.orders = {}
+        self.placed = []
+        self.pacer = Pacer(rate=1e6)
+        self._next_id = 1
+
+    def nextOrderId(self):
+        self._next_id += 1
+        return self._next_id - 1
+
+    def placeOrder(self, order_id, contract, order):
+        self.placed.append((order_id, order.lmtPrice))
+
+
+def make_position():
+    contract = Contract()
+    contract.conId = 1234
+    row = types.SimpleNamespace(symbol="AAPL", sell_price=1.0, days_since_open=3, num_contracts=1)
+    return WatchedPosition(("AAPL", "20300118", 150.0, "P"), contract, row, date.today())
+
+
+def tick(daemon, position, price):
+    daemon._on_tick(position, TickTypeEnum.ASK, price)
+    while not daemon._actions.empty():
+        daemon._act(*daemon._actions.get())
+
+
+def test_cancelled_order_is_placed_again():
+    app = RecordingApp()
+    daemon = CloseOutDaemon(app, lambda: None, resolver=object())
+    position = make_position()
+
+    tick(daemon, position, position.target)
+    assert len(app.placed) == 1
+    position.handle.on_status("Cancelled")  # a DAY order expiring at the close
+
+    tick(daemon, position, position.target)
+    assert len(app.placed) == 2
+    assert app.placed[1][0] != app.placed[0][0]
+    assert position.working
+
+
+def test_rejected_order_is_parked_until_the_next_refresh():
+    app = RecordingApp()
+    daemon = CloseOutDaemon(app, lambda: None, resolver=object())
+    position = make_position()
+
+    tick(daemon, position, position.target)
+    position.handle.on_error(201, "Order rejected - reason: insufficient margin")
+
+    for _ in range(5):
+        tick(daemon, position, position.target)
+    assert len(app.placed) == 1
+    assert position.key in daemon.parked
+
+
+def test_failed_action_parks_the_position_and_keeps_the_worker_alive():
+    app = RecordingApp()
+    daemon = CloseOutDaemon(app, lambda: None, resolver=object())
+    position = make_position()
+
+    def fail(*args):
+        raise ConnectionError("not connected")
+
+    app.placeOrder = fail
+    daemon._on_tick(position, TickTypeEnum.ASK, position.target)
+    daemon._worker.start()
+    deadline = time.monotonic() + 2
+    while position.key not in daemon.parked and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert position.key in daemon.parked
+    assert daemon._worker.is_alive()
+
+
+def test_reprice_of_a_filled_order_sends_nothing():
+    app = RecordingApp()
+    daemon = CloseOutDaemon(app, lambda: None, resolver=object())
+    position = make_position()
+
+    tick(daemon, position, position.target)
+    position.pending = True
+    daemon._actions.put(("reprice", position))
+    position.handle.on_status("Filled", 1, position.target)  # fills before the worker gets to it
+    tick(daemon, position, position.target)
+
+    assert len(app.placed) == 1
+    assert not position.pending
+
+
+def test_failed_refresh_does_not_stop_the_daemon():
+    app = RecordingApp()
+    app.reqMarketDataType = lambda market_data_type: None
+    stop = threading.Event()
+    calls = []
+
+    def load_positions():
+        calls.append(1)
+        if len(calls) >= 2:
+            stop.set()
+        raise TimeoutError("tracker down")
+
+    CloseOutDaemon(app, load_positions, resolver=object(), refresh_interval=0).run(stop)
+    assert len(calls) == 2
+
+
+def test_filled_order_is_not_placed_again():
+    app = RecordingApp()
+    daemon = CloseOutDaemon(app, lambda: None, resolver=object())
+    position = make_position()
+
+    tick(daemon, position, position.target)
+    position.handle.on_status("Filled", 1, position.target)
+
+    tick(daemon, position, position.target)
+    assert len(app.placed) == 1
+
+
+def resting_order(client_id, limit_price, oca_group=""):
+    order = make_order("BUY", limit_price)
+    order.orderId = 7
+    order.clientId = client_id
+    order.ocaGroup = oca_group
+    return order
+
+
+def test_order_resting_at_ib_is_followed_not_doubled():
+    app = RecordingApp()
+    daemon = CloseOutDaemon(app, lambda: None, resolver=object())
+    position = make_position()
+    working = {(1234, "BUY"): [WorkingOrder(position.contract, resting_order(23, position.target))]}
+
+    assert daemon._adopt(position, working)
+    assert position.working and position.handle.order_id == 7
+    tick(daemon, position, position.target)
+    assert app.placed == []
+
+
+def test_order_resting_at_ib_is_repriced_under_its_id():
+    app = RecordingApp()
+    daemon = CloseOutDaemon(app, lambda: None, resolver=object())
+    position = make_position()
+    working = {(1234, "BUY"): [WorkingOrder(position.contract, resting_order(23, position.target + 0.1))]}
+
+    daemon._adopt(position, working)
+    tick(daemon, position, position.target + 1)
+    assert app.placed == [(7, position.target)]
+
+
+def test_orders_of_other_clients_or_oca_groups_are_left_alone():
+    app = RecordingApp()
+    daemon = CloseOutDaemon(app, lambda: None, resolver=object())
+    position = make_position()
+
+    other = {(1234, "BUY"): [WorkingOrder(position.contract, resting_order(0, position.target))]}
+    assert not daemon._adopt(position, other)
+    tiered = {(1234, "BUY"): [WorkingOrder(position.contract, resting_order(23, position.target, "close AAPL"))]}
+    assert not daemon._adopt(position, tiered)
+
+
+def test_failed_modify_never_becomes_a_new_order():
+    app = RecordingApp()
+    daemon = CloseOutDaemon(app, lambda: None, resolver=object())
+    position = make_position()
+    working = {(1234, "BUY"): [WorkingOrder(position.contract, resting_order(23, position.target + 0.1))]}
+
+    daemon._adopt(position, working)
+    tick(daemon, position, position.target + 1)  # the modify goes out
+    position.handle.on_error(104, "Cannot modify a filled order")
+
+    tick(daemon, position, position.target)
+    assert app.placed == [(7, position.target)]
+    assert position.key in daemon.parked
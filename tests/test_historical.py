@@ -0,0 +1,99 @@
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("ibapi")
+
+from historical import HistoricalDataFetcher, HistoricalRequest  # noqa: E402
+from trade_app import RequestError, make_stock  # noqa: E402
+
+
+def finished(result=None, error=None):
+    future = Future()
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+    return future
+
+
+def three_day_request():
+    end = datetime(2024, 7, 5, 20, tzinfo=timezone.utc)
+    request = HistoricalRequest(make_stock("AAPL"), "3 D", "1 min", "TRADES", 1, end)
+    assert len(request.chunks) == 3
+    return request
+
+
+def bars(date):
+    return pd.DataFrame({"Close": [1.0]}, index=pd.Index([date], name="Date"))
+
+
+def test_chunk_without_data_counts_as_empty():
+    fetcher = HistoricalDataFetcher(app=None)
+    request = three_day_request()
+    no_data = RequestError(1, 162, "Historical Market Data Service error message:HMDS query returned no data")
+    for index, future in enumerate([finished(bars("20240705")), finished(error=no_data), finished(bars("20240703"))]):
+        fetcher._slots.acquire()
+        fetcher._on_done(future, request, index, 0)
+
+    assert list(request.future.result().index) == ["20240703", "20240705"]
+
+
+def test_other_errors_fail_the_request():
+    fetcher = HistoricalDataFetcher(app=None)
+    request = three_day_request()
+    fetcher._slots.acquire()
+    fetcher._on_done(finished(error=RequestError(1, 200, "No security definition")), request, 1, 0)
+
+    with pytest.raises(RequestError):
+        request.future.result()
+
+
+def test_bars_outside_regular_hours_are_stored_apart(tmp_path):
+    from bar_store import BarStore
+
+    store = BarStore(str(tmp_path))
+    contract = make_stock("AAPL")
+    bars = pd.DataFrame(
+        {"Open": [1.0], "High": [2.0], "Low": [0.5], "Close": [1.5], "Volume": [100.0]},
+        index=pd.DatetimeIndex([datetime(2024, 1, 2, 4)], name="Date"),
+    )
+    store.write(contract, "1 hour", "TRADES", bars, use_rth=0)
+
+    assert store.load(contract, "1 hour", "TRADES", use_rth=1) is None
+    assert store.load(contract, "1 hour", "TRADES", use_rth=0)["Close"].tolist() == [1.5]
+
+
+class SilentApp:
+    """TradeApp whose historical data requests are never answered"""
+
+    def __init__(self):
+        from pacing import Pacer
+
+        self.requests = {}
+        self._bars = {}
+        self.pacer = Pacer(rate=1e6)
+        self.cancelled = []
+        self._next_id = 1
+
+    def next_request_id(self):
+        self._next_id += 1
+        return self._next_id - 1
+
+    def reqHistoricalData(self, **kwargs):
+        pass
+
+    def cancelHistoricalData(self, req_id):
+        self.cancelled.append(req_id)
+
+
+def test_unanswered_request_times_out_and_frees_its_slot():
+    app = SilentApp()
+    fetcher = HistoricalDataFetcher(app, max_in_flight=1, timeout=0.05)
+    futures = fetcher.fetch_many([make_stock("AAPL"), make_stock("MSFT")], "1 D", "1 day")
+
+    for future in futures:
+        assert isinstance(future.exception(timeout=5), TimeoutError)
+    assert app.cancelled == [1, 2] and app.requests == {}
@@ -0,0 +1,50 @@
+import time
+import types
+
+from journal import ACKED, GONE, PLANNED, SUBMITTED, SUPERSEDED, JournalEntry, OrderJournal
+
+
+def make_entry(state, order_id):
+    return JournalEntry(time.time(), state, order_id, 1000 + order_id, "AAPL-OPT", "DU1", "BUY", "LMT", "DAY",
+                        1, 0.5, "", "")
+
+
+def open_order(order_id, client_id=23):
+    return (None, types.SimpleNamespace(orderId=order_id, clientId=client_id), None)
+
+
+def test_sync_follows_tws(tmp_path):
+    journal = OrderJournal(str(tmp_path / "orders.journal"))
+    journal._append([make_entry(ACKED, 1), make_entry(ACKED, 2), make_entry(SUBMITTED, 3), make_entry(SUBMITTED, 4)])
+
+    journal.sync({101: open_order(1), 104: open_order(4)}, client_id=23)
+
+    assert journal.entries[1].state == ACKED
+    assert journal.entries[2].state == GONE  # filled or cancelled by hand while nothing was connected
+    assert journal.entries[3].state == SUBMITTED  # still unconfirmed, sent again under its id
+    assert journal.entries[4].state == ACKED
+
+
+def test_orders_of_other_clients_do_not_ack_ours(tmp_path):
+    journal = OrderJournal(str(tmp_path / "orders.journal"))
+    journal._append([make_entry(ACKED, 1)])
+
+    journal.sync({101: open_order(1, client_id=7)}, client_id=23)
+
+    assert journal.entries[1].state == GONE
+
+
+def test_planned_orders_of_a_crashed_run_are_retired(tmp_path):
+    path = str(tmp_path / "orders.journal")
+    journal = OrderJournal(path)
+    journal._append([make_entry(PLANNED, 1)])
+    journal.close()
+
+    journal = OrderJournal(path)
+    assert [entry.order_id for entry in journal.unfinished()] == [1]
+    journal.sync({}, client_id=23)
+    journal.close()
+
+    journal = OrderJournal(path)
+    assert journal.entries[1].state == SUPERSEDED
+    assert journal.unfinished() == []
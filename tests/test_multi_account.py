@@ -0,0 +1,32 @@
+import pandas as pd
+
+from multi_account import assign_accounts, shard_positions
+
+
+def positions(*accounts):
+    return pd.DataFrame({"symbol": ["AAPL"] * len(accounts), "num_contracts": [1] * len(accounts),
+                         "account": list(accounts)})
+
+
+def shard_accounts(shards):
+    return [[account for account, _ in shard] for shard in shards]
+
+
+def test_account_served_by_two_connections_goes_to_the_first():
+    shards = shard_positions(positions("U1", "U2", "U3"), [["U1", "U2"], ["U2", "U3"]])
+    assert shard_accounts(shards) == [["U1", "U2"], ["U3"]]
+
+
+def test_two_client_ids_on_the_same_tws_do_not_both_close():
+    shards = shard_positions(positions("U1", "U1", "U2"), [["U1", "U2"], ["U1", "U2"]])
+    assert shard_accounts(shards) == [["U1", "U2"], []]
+    assert sum(len(group) for shard in shards for _, group in shard) == 3
+
+
+def test_single_account_without_account_column():
+    shards = shard_positions(positions("U1").drop(columns="account"), [["U1"], ["U1"]])
+    assert shard_accounts(shards) == [["U1"], []]
+
+
+def test_assign_accounts_drops_repeats():
+    assert assign_accounts([["U1", "U1"], ["U1", "U2"], []]) == [["U1"], ["U2"], []]
@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("ibapi")
+
+from option_chain import OptionChainStore  # noqa: E402
+from trade_app import TradeApp  # noqa: E402
+
+
+class ChainApp(TradeApp):
+    """TradeApp answering reqSecDefOptParams at once, without TWS"""
+
+    def __init__(self):
+        super().__init__()
+        self.nextValidOrderId = 1
+        self.requested = []
+
+    def reqSecDefOptParams(self, reqId, underlyingSymbol, futFopExchange, underlyingSecType, underlyingConId):
+        self.requested.append(underlyingSymbol)
+        self.securityDefinitionOptionParameter(
+            reqId, "SMART", underlyingConId, underlyingSymbol, "100", {"20300118", "20291221"}, {400.0, 410.0},
+        )
+        self.securityDefinitionOptionParameterEnd(reqId)
+
+
+def test_fetched_chains_are_saved(tmp_path):
+    app = ChainApp()
+    chain = OptionChainStore(str(tmp_path)).fetch(app, "SPY", 756733)[0]
+
+    saved = OptionChainStore.load(str(tmp_path)).get(756733)
+    assert saved.expirations.tolist() == chain.expirations.tolist() == [20291221, 20300118]
+    assert saved.strikes.tolist() == [400.0, 410.0]
+
+
+def test_option_chains_come_from_the_store(tmp_path):
+    first = ChainApp()
+    first.use_chain_store(OptionChainStore(str(tmp_path)))
+    first.request_option_chain(1, "SPY", 756733)
+
+    second = ChainApp()
+    second.use_chain_store(OptionChainStore.load(str(tmp_path)))
+    records = second.request_option_chain(2, "SPY", 756733)
+
+    assert first.requested == ["SPY"] and second.requested == []
+    assert records[0].expirations == {"20291221", "20300118"}
+    assert second.option_chain_df["Strike"].tolist() == [{400.0, 410.0}]
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from options import buy_percentages, get_buy_price, plan_close_orders, round_prices
+
+SELL_PRICES = [cents / 100 for cents in range(1, 2000)]
+DAYS_SINCE_OPEN = [0, 3, 10]  # one of each BUY_PERCENTAGES tier
+
+
+@pytest.mark.parametrize("symbol", ["AAPL", "SPX"])
+def test_round_prices_matches_get_buy_price(symbol):
+    sell_price = np.repeat(SELL_PRICES, len(DAYS_SINCE_OPEN))
+    days = np.tile(DAYS_SINCE_OPEN, len(SELL_PRICES))
+
+    rounded = round_prices(sell_price * buy_percentages(days), [symbol] * len(sell_price))
+
+    expected = [get_buy_price(price, day, symbol) for price, day in zip(sell_price.tolist(), days.tolist())]
+    assert rounded.tolist() == expected
+
+
+def test_limit_is_never_below_one_tick():
+    assert get_buy_price(0.01, 3, "AAPL") == 0.01
+    assert get_buy_price(0.1, 10, "SPX") == 0.1
+    assert round_prices([0.005, 0.004], ["AAPL", "AAPL"]).tolist() == [0.01, 0.01]
+
+
+def test_plan_quotes_the_daemon_limits():
+    positions = pd.DataFrame({
+        "symbol": ["AAPL", "AAPL", "SPX"], "expiry": ["20300118"] * 3, "strike": [150.0, 140.0, 4000.0],
+        "right": ["P"] * 3, "sell_price": [0.22, 0.13, 12.35], "days_since_open": [0, 3, 10],
+        "num_contracts": [1, 1, 1],
+    })
+    plan = plan_close_orders(positions)
+    assert plan["buy_price"].tolist() == [
+        get_buy_price(row.sell_price, row.days_since_open, row.symbol) for row in positions.itertuples()
+    ]
+
+
+class UnresolvingApp:
+    """TradeApp with one of our close-out orders working, cancelOrder only records the id"""
+
+    clientId = 23
+    journal = None
+    portfolio = None
+
+    def __init__(self, open_orders):
+        from pacing import Pacer
+
+        self.pacer = Pacer(rate=1e6)
+        self.open_orders = open_orders
+        self.cancelled = []
+
+    def request_open_orders(self):
+        return dict(self.open_orders)
+
+    def cancelOrder(self, order_id, manual_cancel_order_time=""):
+        self.cancelled.append(order_id)
+
+
+class NothingResolves:
+    def resolve(self, contracts):
+        return [None] * len(contracts)
+
+
+def test_orders_of_unresolved_contracts_are_not_cancelled():
+    pytest.importorskip("ibapi")
+    from ibapi.contract import Contract
+    from ibapi.order_state import OrderState
+
+    from options import execute_plan
+    from orders import make_order
+
+    contract = Contract()
+    contract.conId = 1234
+    order = make_order("BUY", 0.05)
+    order.orderId, order.clientId = 7, 23
+    state = OrderState()
+    state.status = "Submitted"
+    app = UnresolvingApp({1: (contract, order, state)})
+    plan = pd.DataFrame({
+        "action": ["BUY"], "num_contracts": [1], "symbol": ["AAPL"], "expiry": ["20300118"],
+        "strike": [150.0], "right": ["P"], "buy_price": [0.05],
+    })
+
+    assert execute_plan(app, plan, resolver=NothingResolves()) == []
+    assert app.cancelled == []
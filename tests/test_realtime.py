@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from realtime import EXCHANGE_TIMEZONE, BarStream
+
+
+def eastern(text) -> int:
+    return int(datetime.strptime(text, "%Y-%m-%d %H:%M").replace(tzinfo=EXCHANGE_TIMEZONE).timestamp())
+
+
+def test_vwap_session_follows_the_exchange_date():
+    stream = BarStream("AAPL", bar_seconds=60)
+    stream.on_bar(eastern("2024-07-08 19:00"), 10, 10, 10, 10, 100)
+    stream.on_bar(eastern("2024-07-08 20:30"), 20, 20, 20, 20, 100)  # past midnight UTC, same session
+    assert stream.vwap == pytest.approx(15)
+
+    stream.on_bar(eastern("2024-07-09 04:00"), 30, 30, 30, 30, 100)  # pre-market opens the next session
+    assert stream.vwap == pytest.approx(30)
+
+
+def test_bar_being_built_replaces_the_last_one():
+    stream = BarStream("AAPL", bar_seconds=60)
+    stream.on_bar(eastern("2024-07-08 10:00"), 10, 10, 10, 10, 100)
+    stream.on_bar(eastern("2024-07-08 10:01"), 12, 12, 12, 12, 100)
+    stream.on_bar(eastern("2024-07-08 10:01"), 14, 14, 14, 14, 100)
+    assert len(stream) == 2
+    assert stream.vwap == pytest.approx(12)
+    assert stream.bars()["Close"].tolist() == [10, 14]
+
+
+def test_indicators_match_pandas():
+    rng = np.random.default_rng(1)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, 300)))
+    stream = BarStream("AAPL", bar_seconds=5, capacity=128, ema_span=20, volatility_window=60)
+    start = eastern("2024-07-08 10:00")
+    for i, close in enumerate(closes):
+        stream.on_bar(start + 5 * i, close, close + 0.05, close - 0.05, close, 10)
+
+    series = pd.Series(closes)
+    assert stream.ema == pytest.approx(series.ewm(span=20, adjust=False).mean().iloc[-1])
+    returns = np.log(series).diff().iloc[-60:]
+    assert stream.volatility == pytest.approx(returns.std() * stream.annualize)
+    assert len(stream) == 128
+    assert stream.bars()["Close"].to_numpy() == pytest.approx(closes[-128:])
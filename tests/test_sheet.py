@@ -0,0 +1,34 @@
+import os
+
+from sheet import SheetWatcher, snapshot_path_for
+
+
+def write_export(path, days):
+    rows = [
+        "Options trading,,,,",
+        "Aquiles Invierto,,,,",
+        "Ticker,Ticker,Days since open,Num Contratos,Status",
+        f"AAPL Jan18'30 150 P 1.20,AAPL,{days[0]},-1,O",
+        f"MSFT Jan18'30 300 P 2.50,MSFT,{days[1]},-2,O",
+    ]
+    with open(path, "w") as f:
+        f.write("\n".join(rows) + "\n")
+    mtime = os.stat(path).st_mtime_ns + 1_000_000_000  # a new export even within the same second
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_next_day_export_only_replans_positions_changing_tier(tmp_path):
+    sheet = str(tmp_path / "sheet.csv")
+    write_export(sheet, [3, 7])
+    watcher = SheetWatcher(sheet, snapshot_path=str(tmp_path / "snapshot.npz"))
+    assert len(watcher.poll()) == 2
+    watcher.commit()
+
+    write_export(sheet, [4, 8])
+    restarted = SheetWatcher(sheet, snapshot_path=str(tmp_path / "snapshot.npz"))
+    assert restarted.poll()["symbol"].tolist() == ["MSFT"]
+
+
+def test_every_sheet_has_its_own_snapshot(tmp_path):
+    assert snapshot_path_for(str(tmp_path / "a.csv")) != snapshot_path_for(str(tmp_path / "b.csv"))
+    assert snapshot_path_for(str(tmp_path / "a.csv")) == snapshot_path_for(str(tmp_path / "." / "a.csv"))
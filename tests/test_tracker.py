@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from tracker import TrackerClient, iter_json_array
+
+TRADES = [
+    {"id": 1, "status": 0, "type": "SELL", "symbol": "AAPL"},
+    {"id": 2, "status": 1, "type": "SELL", "symbol": "MSFT"},  # closed
+    {"id": 3, "status": 0, "type": "BUY", "symbol": "SPY"},  # protective put
+    {"id": 4, "status": 0, "type": "SELL", "symbol": 'KO, "the" [drink]'},
+]
+ETAG = '"v1"'
+
+
+class TrackerHandler(BaseHTTPRequestHandler):
+    """stand-in for the tracker, every path is one way of serving TRADES"""
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunked(self, data, chunk_size=7):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        server = self.server
+        path, _, query = self.path.partition("?")
+        server.hits[path] = server.hits.get(path, 0) + 1
+        hit = server.hits[path]
+        if path == "/trades":
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self._chunked(TRADES)
+        elif path == "/pages":
+            page = int(query.partition("=")[2] or 1)
+            next_url = f"http://127.0.0.1:{server.server_port}/pages?page={page + 1}" if page < 2 else None
+            self._json({"results": TRADES[2 * (page - 1):2 * page], "next": next_url})
+        elif path == "/flaky":
+            if hit <= 2:
+                self._json({"error": "unavailable"}, status=503)
+            else:
+                self._chunked(TRADES)
+        elif path == "/slow":
+            if hit == 1:
+                time.sleep(1)
+            self._chunked(TRADES)
+        else:
+            self._json({}, status=404)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TrackerHandler)
+    server.hits = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(server, path, tmp_path, **kwargs):
+    url = f"http://127.0.0.1:{server.server_port}{path}"
+    return TrackerClient(url, snapshot_path=str(tmp_path / "snapshot.json"), backoff=0, **kwargs)
+
+
+def open_ids(rows):
+    return [row["id"] for row in rows]
+
+
+def test_chunked_array_is_parsed_as_it_streams(server, tmp_path):
+    rows = client(server, "/trades", tmp_path, chunk_size=5).open_trades()
+    assert open_ids(rows) == [1, 4]
+    assert rows[1]["symbol"] == 'KO, "the" [drink]'
+
+
+def test_not_modified_returns_the_snapshot(server, tmp_path):
+    tracker = client(server, "/trades", tmp_path)
+    first = tracker.open_trades()
+    assert tracker.open_trades() == first
+    assert server.hits["/trades"] == 2  # the second answer was a 304 without a body
+
+
+def test_pages_are_followed(server, tmp_path):
+    tracker = client(server, "/pages", tmp_path)
+    assert open_ids(tracker.open_trades()) == [1, 4]
+    assert open_ids(tracker.all_trades()) == [1, 2, 3, 4]
+
+
+def test_server_errors_are_retried(server, tmp_path):
+    assert open_ids(client(server, "/flaky", tmp_path).open_trades()) == [1, 4]
+    assert server.hits["/flaky"] == 3
+
+
+def test_server_errors_give_up_after_the_retries(server, tmp_path):
+    with pytest.raises(requests.HTTPError):
+        client(server, "/flaky", tmp_path, retries=1).open_trades()
+
+
+def test_timeouts_are_retried(server, tmp_path):
+    rows = client(server, "/slow", tmp_path, timeout=(1, 0.3)).open_trades()
+    assert open_ids(rows) == [1, 4]
+    assert server.hits["/slow"] == 2
+
+
+def test_iter_json_array_across_chunk_boundaries():
+    text = json.dumps(TRADES)
+    for size in (1, 2, 3, 10):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert list(iter_json_array(chunks)) == TRADES
+
+
+def test_iter_json_array_rejects_a_truncated_array():
+    with pytest.raises(ValueError):
+        list(iter_json_array(['[{"id": 1}, {"id"']))
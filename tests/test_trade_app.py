@@ -0,0 +1,41 @@
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("ibapi")
+
+from trade_app import RequestError, TradeApp  # noqa: E402
+
+
+def test_error_fails_the_request():
+    app = TradeApp()
+    future = app.requests[5] = Future()
+    app.error(5, 200, "No security definition has been found for the request")
+
+    with pytest.raises(RequestError) as error:
+        future.result(0)
+    assert error.value.code == 200 and 5 not in app.requests
+
+
+def test_error_takes_the_reject_json_of_ibapi_10():
+    app = TradeApp()
+    future = app.requests[5] = Future()
+    app.error(5, 201, "Order rejected", '{"reason": "margin"}')
+
+    assert isinstance(future.exception(0), RequestError)
+
+
+def test_cancel_order_at_the_gateway():
+    from orders import make_order, submit_order
+    from simulator import GatewaySimulator
+    from trade_app import make_stock, start_app
+
+    with GatewaySimulator() as gateway:
+        app = start_app(port=gateway.port, timeout=5)
+        try:
+            handle = submit_order(app, app.nextOrderId(), make_stock("AAPL"), make_order("BUY", 1.0))
+            handle.acked.result(timeout=5)
+            app.cancelOrder(handle.order_id, "")
+            assert handle.done.result(timeout=5) == "Cancelled"
+        finally:
+            app.disconnect()
@@ -0,0 +1,156 @@
+import codecs
+import json
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from aquiles_enums import Status
+
+TRACKER_URL = "https://tracker.aquilesinvierto.com/tracker/trades_json/"
+DEFAULT_SNAPSHOT_PATH = os.path.expanduser("~/.aquiles/tracker_open_trades.json")
+
+
+def iter_json_array(chunks):
+    """yields the objects of a JSON array as its text arrives in chunks
+
+    Only the object being parsed is kept in memory, not the whole array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                obj, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # object not complete yet
+            yield obj
+        buffer = buffer[pos:]
+    if buffer.strip():
+        raise ValueError("truncated JSON array")
+
+
+def is_open_short(row) -> bool:
+    # closed positions and protective puts are not closed out
+    return row["status"] != Status.closed.value and row["type"] != "BUY"
+
+
+class TrackerClient:
+    """reads the open trades of the Aquiles Invierto tracker
+
+    Uses a keep-alive session and conditional GETs (ETag / If-Modified-Since).
+    The open trades of the last response are kept in a local snapshot that is
+    reused when the tracker answers 304 Not Modified. The response is parsed
+    as it streams in and closed trades are dropped as they are read, so memory
+    depends on the number of open positions, not on the whole history.
+
+    `params` is sent as query string, e.g. {"status": 0} if the tracker can
+    filter server side. Paginated responses ({"results": [...], "next": url})
+    are followed page by page.
+
+    Requests failing with a 5xx, a refused connection or a timeout before the
+    response started are retried `retries` times with exponential backoff.
+    """
+
+    def __init__(self, url=TRACKER_URL, snapshot_path=DEFAULT_SNAPSHOT_PATH, params=None,
+                 timeout=(5, 30), session=None, retries=3, backoff=0.5, chunk_size=64 * 1024):
+        self.url = url
+        self.snapshot_path = snapshot_path
+        self.params = params
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        if session is None:
+            session = requests.Session()
+            retry = Retry(
+                total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset({"GET"}), raise_on_status=False,
+            )
+            session.mount("http://", HTTPAdapter(max_retries=retry))
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+        self.session = session
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save_snapshot(self, response, rows):
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        snapshot = {
+            "url": self.url,
+            "params": self.params,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "rows": rows,
+        }
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, self.snapshot_path)
+
+    def _iter_rows(self, response):
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+        chunks = (decoder.decode(chunk) for chunk in response.iter_content(chunk_size=self.chunk_size))
+        first = next(chunks, "")
+        while first and not first.strip():
+            first = next(chunks, "")
+        if first.lstrip().startswith("["):
+            yield from iter_json_array(_prepend(first, chunks))
+            return
+        # paginated response, pages are small so they are parsed whole
+        page = json.loads(first + "".join(chunks))
+        yield from page["results"]
+        next_url = page.get("next")
+        while next_url:
+            response = self.session.get(next_url, timeout=self.timeout)
+            response.raise_for_status()
+            page = response.json()
+            yield from page["results"]
+            next_url = page.get("next")
+
+    def open_trades(self) -> list:
+        snapshot = self._load_snapshot()
+        headers = {}
+        if snapshot and snapshot["url"] == self.url and snapshot["params"] == self.params:
+            if snapshot["etag"]:
+                headers["If-None-Match"] = snapshot["etag"]
+            if snapshot["last_modified"]:
+                headers["If-Modified-Since"] = snapshot["last_modified"]
+
+        with self.session.get(self.url, params=self.params, headers=headers, timeout=self.timeout,
+                              stream=True) as response:
+            if response.status_code == 304:
+                return snapshot["rows"]
+            response.raise_for_status()
+            rows = [row for row in self._iter_rows(response) if is_open_short(row)]
+        self._save_snapshot(response, rows)
+        return rows
+
+    def all_trades(self) -> list:
+        """every row of the tracker, closed trades included, not cached"""
+        with self.session.get(self.url, params=self.params, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            return list(self._iter_rows(response))
+
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
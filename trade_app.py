@@ -0,0 +1,384 @@
+import inspect
+import threading
+import time
+
+from ibapi.client import EClient
+from ibapi.common import SetOfString, SetOfFloat
+from ibapi.wrapper import EWrapper
+from ibapi.contract import Contract
+import pandas as pd
+
+from bars import BarBuffer
+from metrics import timed
+from orders import is_warning
+from pacing import Pacer
+from records import (
+    OPTION_CHAIN_COLUMNS, POSITION_COLUMNS, OptionChainRecord, PositionRecord, records_to_frame
+)
+
+
+# ibapi 10 cancels with a manual cancel time, 9.81 only takes the order id
+CANCEL_TAKES_TIME = len(inspect.signature(EClient.cancelOrder).parameters) > 2
+
+
+class RequestError(Exception):
+    def __init__(self, req_id, code, message):
+        super().__init__(f"request {req_id} failed: [{code}] {message}")
+        self.req_id = req_id
+        self.code = code
+        self.message = message
+
+
+class TradeApp(EWrapper, EClient):
+    def __init__(self, log_bars=False):
+        EClient.__init__(self, self)
+        self.data = {}
+        self.log_bars = log_bars
+        self._bars = {}  # reqId -> BarBuffer of a request still receiving bars
+        self.nextValidOrderId = None
+        self._positions = {}  # (account, conId) -> PositionRecord
+        self._positions_df = None
+        self.positions_ready = threading.Event()
+        self.option_chains = {}  # reqId -> list of OptionChainRecord
+        self._option_chain_df = None
+        self.option_chain_ready = {}  # reqId -> threading.Event
+        self.chain_store = None  # OptionChainStore, see use_chain_store
+        self.orders = {}  # order id -> OrderHandle
+        self.open_orders = {}  # permId -> (Contract, Order, OrderState) as reported by openOrder
+        self.open_orders_ready = threading.Event()
+        self.requests = {}  # reqId -> Future resolved when the request completes
+        self._details = {}  # reqId -> ContractDetails received so far
+        self.tick_handlers = {}  # reqId of a market data subscription -> callable(tick_type, price)
+        # reqId of a streaming bar subscription -> callable(time, open, high, low, close, volume)
+        self.bar_handlers = {}
+        self._id_lock = threading.Lock()
+        self.journal = None  # OrderJournal, see use_journal
+        self._reserved_until = 0  # end of the block of order ids reserved in the journal
+        self.portfolio = None  # Portfolio fed by the account updates, see Portfolio.start
+        self.pacer = Pacer()
+        self.accounts = []
+        self.order_id_ready = threading.Event()
+        self.accounts_ready = threading.Event()
+
+    @property
+    def positions_df(self) -> pd.DataFrame:
+        """positions received so far, the DataFrame is rebuilt only after they changed"""
+        if self._positions_df is None:
+            self._positions_df = records_to_frame(list(self._positions.values()), POSITION_COLUMNS)
+        return self._positions_df
+
+    @property
+    def option_chain_df(self) -> pd.DataFrame:
+        if self._option_chain_df is None:
+            self._option_chain_df = records_to_frame(
+                [record for records in list(self.option_chains.values()) for record in records],
+                OPTION_CHAIN_COLUMNS,
+            )
+        return self._option_chain_df
+
+    @timed("callback.position")
+    def position(self, account, contract, position, avgCost):
+        super().position(account, contract, position, avgCost)
+        self._positions[(account, contract.conId)] = PositionRecord(account, contract, position, avgCost)
+        self._positions_df = None
+
+    @timed("callback.positionEnd")
+    def positionEnd(self):
+        super().positionEnd()
+        self._positions_df = None
+        self.positions_ready.set()
+
+    def request_positions(self, timeout: float = 10) -> pd.DataFrame:
+        """requests all positions and returns them once positionEnd arrived"""
+        self.positions_ready.clear()
+        self._positions.clear()
+        self.pacer.wait()
+        self.reqPositions()
+        if not self.positions_ready.wait(timeout):
+            raise TimeoutError(f"positions not received after {timeout}s")
+        return self.positions_df
+
+    @timed("callback.securityDefinitionOptionParameter")
+    def securityDefinitionOptionParameter(self, reqId:int, exchange:str,
+        underlyingConId:int, tradingClass:str, multiplier:str,
+        expirations:SetOfString, strikes:SetOfFloat):
+        super().securityDefinitionOptionParameter(
+            reqId, exchange, underlyingConId, tradingClass, multiplier, expirations, strikes
+        )
+        record = OptionChainRecord(reqId, exchange, underlyingConId, tradingClass, multiplier, expirations, strikes)
+        self.option_chains.setdefault(reqId, []).append(record)
+        self._option_chain_df = None
+
+    @timed("callback.securityDefinitionOptionParameterEnd")
+    def securityDefinitionOptionParameterEnd(self, reqId:int):
+        super().securityDefinitionOptionParameterEnd(reqId)
+        self._option_chain_df = None
+        self.option_chain_ready.setdefault(reqId, threading.Event()).set()
+
+    def use_chain_store(self, store=None):
+        """answers request_option_chain from `store`, by default the snapshot of the day, before asking TWS"""
+        from option_chain import OptionChainStore
+
+        if store is None:
+            store = OptionChainStore.load() or OptionChainStore()
+        self.chain_store = store
+        return self.chain_store
+
+    def request_option_chain(self, req_id, symbol, underlying_con_id, sec_type="STK", timeout: float = 10):
+        """requests the option chain of an underlying and returns its records once complete
+
+        With a chain store, chains it already has are not requested again and new ones are saved to it.
+        """
+        store = self.chain_store
+        chains = store.for_underlying(underlying_con_id) if store is not None else None
+        if chains:
+            self.option_chains[req_id] = [chain.to_record(req_id) for chain in chains]
+            self._option_chain_df = None
+            return self.option_chains[req_id]
+        ready = self.option_chain_ready[req_id] = threading.Event()
+        self.option_chains[req_id] = []
+        self.pacer.wait()
+        self.reqSecDefOptParams(req_id, symbol, "", sec_type, underlying_con_id)
+        if not ready.wait(timeout):
+            raise TimeoutError(f"option chain for {symbol} not received after {timeout}s")
+        records = self.option_chains[req_id]
+        if store is not None and records:
+            store.add_records(records)
+            store.save()
+        return records
+
+    @timed("callback.nextValidId")
+    def nextValidId(self, orderId:int):
+        """returns next valid order id"""
+        super().nextValidId(orderId)
+        with self._id_lock:
+            # ids reserved by an earlier run may be above what TWS saw used
+            self.nextValidOrderId = orderId if self.journal is None else max(orderId, self.journal.reserved_until)
+        self.order_id_ready.set()
+        print("nextValidId:", orderId)
+
+    @timed("callback.managedAccounts")
+    def managedAccounts(self, accountsList:str):
+        super().managedAccounts(accountsList)
+        self.accounts = [account for account in accountsList.split(",") if account]
+        self.accounts_ready.set()
+
+    def wait_until_ready(self, timeout: float = 10) -> bool:
+        """blocks until TWS sent the next valid order id and the managed accounts"""
+        deadline = time.monotonic() + timeout
+        return (
+            self.order_id_ready.wait(timeout)
+            and self.accounts_ready.wait(max(0, deadline - time.monotonic()))
+        )
+
+    def nextOrderId(self):
+        with self._id_lock:
+            oid = self.nextValidOrderId
+            self.nextValidOrderId += 1
+            if self.journal is not None and oid >= self._reserved_until:
+                self._reserved_until = self.journal.reserve_ids(oid)
+        return oid
+
+    def use_journal(self, journal):
+        """records every order in `journal` and takes order ids from blocks reserved in it
+
+        Orders a crashed run sent without an ack are then sent again, see execute_plan.
+        """
+        with self._id_lock:
+            self.journal = journal
+            self._reserved_until = 0
+            if self.nextValidOrderId is not None:
+                self.nextValidOrderId = max(self.nextValidOrderId, journal.reserved_until)
+
+    def cancelOrder(self, orderId, manualCancelOrderTime=""):
+        if CANCEL_TAKES_TIME:
+            super().cancelOrder(orderId, manualCancelOrderTime)
+        else:
+            super().cancelOrder(orderId)
+
+    def next_request_id(self):
+        """request ids come from the order id sequence so error callbacks are never ambiguous"""
+        return self.nextOrderId()
+
+    @timed("callback.openOrder")
+    def openOrder(self, orderId, contract, order, orderState):
+        super().openOrder(orderId, contract, order, orderState)
+        self.open_orders[order.permId or orderId] = (contract, order, orderState)
+        handle = self.orders.get(orderId)
+        if handle is not None:
+            handle.on_status(orderState.status)
+
+    @timed("callback.openOrderEnd")
+    def openOrderEnd(self):
+        super().openOrderEnd()
+        self.open_orders_ready.set()
+
+    def request_open_orders(self, all_clients=False, timeout: float = 10) -> dict:
+        """working orders by permId, only the ones of this client unless all_clients"""
+        self.open_orders_ready.clear()
+        self.open_orders.clear()
+        self.pacer.wait()
+        if all_clients:
+            self.reqAllOpenOrders()
+        else:
+            self.reqOpenOrders()
+        if not self.open_orders_ready.wait(timeout):
+            raise TimeoutError(f"open orders not received after {timeout}s")
+        return dict(self.open_orders)
+
+    @timed("callback.orderStatus")
+    def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId,
+                    parentId, lastFillPrice, clientId, whyHeld, mktCapPrice):
+        super().orderStatus(
+            orderId, status, filled, remaining, avgFillPrice, permId,
+            parentId, lastFillPrice, clientId, whyHeld, mktCapPrice
+        )
+        handle = self.orders.get(orderId)
+        if handle is not None:
+            handle.on_status(status, filled, avgFillPrice)
+
+    @timed("callback.error")
+    def error(self, reqId, errorCode, errorString, advancedOrderRejectJson=""):
+        # ibapi 10 also sends advancedOrderRejectJson, the base class of 9.81 does not take it
+        super().error(reqId, errorCode, errorString)
+        future = None if is_warning(errorCode) else self.requests.pop(reqId, None)
+        if future is not None:
+            self._bars.pop(reqId, None)
+            self._details.pop(reqId, None)
+            future.set_exception(RequestError(reqId, errorCode, errorString))
+            return
+        if reqId in self.bar_handlers and not is_warning(errorCode):
+            self.bar_handlers.pop(reqId)
+            print(f"bar subscription {reqId} stopped: [{errorCode}] {errorString}")
+            return
+        handle = self.orders.get(reqId)
+        if handle is None or is_warning(errorCode):
+            return
+        if errorCode == 202:  # order cancelled
+            handle.on_status("Cancelled")
+        else:
+            handle.on_error(errorCode, errorString)
+
+    @timed("callback.historicalData")
+    def historicalData(self, reqId, bar):
+        handler = self.bar_handlers.get(reqId)
+        if handler is not None:  # past bars of a keepUpToDate subscription
+            handler(bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume)
+            return
+        buffer = self._bars.get(reqId)
+        if buffer is None:
+            buffer = self._bars[reqId] = BarBuffer()
+        buffer.append(bar)
+        if self.log_bars:
+            print(
+                "reqID:{}, date:{}, open:{}, high:{}, low:{}, close:{}, volume:{}".format(
+                    reqId, bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume
+                )
+            )
+
+    @timed("callback.historicalDataEnd")
+    def historicalDataEnd(self, reqId:int, start:str, end:str):
+        """all bars arrived, app.data[reqId] holds them as a DataFrame indexed by Date"""
+        super().historicalDataEnd(reqId, start, end)
+        if reqId in self.bar_handlers:  # updates keep coming through historicalDataUpdate
+            return
+        buffer = self._bars.pop(reqId, None)
+        if buffer is None:  # request returned no bars
+            buffer = BarBuffer(capacity=0)
+        future = self.requests.pop(reqId, None)
+        if future is None:
+            self.data[reqId] = buffer.to_frame()
+        else:
+            future.set_result(buffer.to_frame())
+
+    @timed("callback.historicalDataUpdate")
+    def historicalDataUpdate(self, reqId, bar):
+        handler = self.bar_handlers.get(reqId)
+        if handler is not None:
+            handler(bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume)
+
+    @timed("callback.realtimeBar")
+    def realtimeBar(self, reqId, time, open_, high, low, close, volume, wap, count):
+        handler = self.bar_handlers.get(reqId)
+        if handler is not None:
+            handler(time, open_, high, low, close, volume)
+
+    @timed("callback.contractDetails")
+    def contractDetails(self, reqId:int, contractDetails):
+        super().contractDetails(reqId, contractDetails)
+        self._details.setdefault(reqId, []).append(contractDetails)
+
+    @timed("callback.contractDetailsEnd")
+    def contractDetailsEnd(self, reqId:int):
+        super().contractDetailsEnd(reqId)
+        details = self._details.pop(reqId, [])
+        future = self.requests.pop(reqId, None)
+        if future is not None:
+            future.set_result(details)
+
+    @timed("callback.updatePortfolio")
+    def updatePortfolio(self, contract, position, marketPrice, marketValue, averageCost, unrealizedPNL,
+                        realizedPNL, accountName):
+        if self.portfolio is not None:
+            self.portfolio.on_portfolio(
+                contract, position, marketPrice, marketValue, averageCost, unrealizedPNL, realizedPNL, accountName
+            )
+
+    @timed("callback.accountDownloadEnd")
+    def accountDownloadEnd(self, accountName:str):
+        super().accountDownloadEnd(accountName)
+        if self.portfolio is not None:
+            self.portfolio.on_download_end(accountName)
+
+    @timed("callback.pnlSingle")
+    def pnlSingle(self, reqId, pos, dailyPnL, unrealizedPnL, realizedPnL, value):
+        if self.portfolio is not None:
+            self.portfolio.on_pnl(reqId, pos, dailyPnL, unrealizedPnL, realizedPnL, value)
+
+    @timed("callback.tickPrice")
+    def tickPrice(self, reqId, tickType, price:float, attrib):
+        super().tickPrice(reqId, tickType, price, attrib)
+        handler = self.tick_handlers.get(reqId)
+        if handler is not None:
+            handler(tickType, price)
+
+
+def make_stock(symbol, sec_type="STK", currency="USD", exchange="SMART"):
+    """
+
+    :param symbol:
+    :param sec_type:
+    :param currency:
+    :param exchange: SMART, NYSE, NASDAQ, ISLAND, ARCA, BATS, IEX, SECTORS, PSX, AMEX
+        Use SMART when placing orders
+        ISLAND to fetch historical data
+    :return:
+    """
+    contract = Contract()
+    contract.symbol = symbol
+    contract.secType = sec_type
+    contract.currency = currency
+    contract.exchange = exchange
+    return contract
+
+
+def start_app(host="127.0.0.1", port=7496, client_id=23, timeout: float = 10):
+    """connects to TWS and returns the app once it is ready to trade
+
+    Returns as soon as TWS sent nextValidId and managedAccounts, raises
+    TimeoutError if that does not happen within `timeout` seconds.
+    """
+    app = TradeApp()
+    app.connect(host=host, port=port, clientId=client_id)
+    if not app.isConnected():
+        raise ConnectionError(f"could not connect to TWS at {host}:{port}")
+
+    def websocket_con():
+        app.run()
+
+    con_thread = threading.Thread(target=websocket_con, daemon=True)
+    con_thread.start()
+    if not app.wait_until_ready(timeout):
+        app.disconnect()
+        raise TimeoutError(f"TWS at {host}:{port} not ready after {timeout}s")
+    return app